@@ -0,0 +1,100 @@
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+# USD per million tokens: input, cached input, output
+DEFAULT_MODEL_PRICES = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "openai/gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gemini-1.5-flash-latest": {"input": 0.075, "cached_input": 0.01875, "output": 0.30},
+}
+BATCH_DISCOUNT = 0.5  # Batch API requests are billed at half price
+
+
+@dataclass
+class AICallRecord:
+    """One AI provider call (or response-cache hit): what it cost and how long it took."""
+    provider: str
+    model: str
+    task: str
+    outcome: str  # "success", "error", "cache_hit" or "rejected" (circuit breaker open)
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_seconds: Optional[float] = None  # None when no request was made
+    retries: int = 0  # Providers tried before this one for the same request
+    cache_hit: bool = False
+    error: Optional[str] = None
+    cost_usd: float = 0.0
+    batch_id: Optional[str] = None
+    country: Optional[str] = None
+    document_url: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+class AICallMetrics:
+    """Collects an AICallRecord per AI call and writes them to public.ai_call_metrics in bulk.
+
+    record() only appends to an in-memory buffer (it runs on provider and hedge
+    threads); flush() inserts the buffer through `db`. At most `max_buffer` records
+    are held, dropping the oldest, so a missing or failing database cannot grow memory.
+    """
+
+    def __init__(self, db=None, model_prices: Optional[Dict[str, Dict[str, float]]] = None, max_buffer: int = 10000):
+        self.db = db
+        self.model_prices = model_prices or DEFAULT_MODEL_PRICES
+        self._buffer = deque(maxlen=max_buffer)
+        self._lock = threading.Lock()
+
+    def estimate_cost(self, model: str, prompt_tokens: int, cached_prompt_tokens: int, completion_tokens: int, batch: bool = False) -> float:
+        prices = self.model_prices.get(model)
+        if not prices:
+            return 0.0
+        uncached = max(0, prompt_tokens - cached_prompt_tokens)
+        cost = (uncached * prices["input"] + cached_prompt_tokens * prices.get("cached_input", prices["input"])
+                + completion_tokens * prices["output"]) / 1_000_000
+        return round(cost * (BATCH_DISCOUNT if batch else 1.0), 6)
+
+    def record(self, record: AICallRecord, batch: bool = False):
+        if record.created_at is None:
+            record.created_at = datetime.now()
+        record.cost_usd = self.estimate_cost(record.model, record.prompt_tokens, record.cached_prompt_tokens, record.completion_tokens, batch)
+        with self._lock:
+            self._buffer.append(record)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self) -> int:
+        """Persist buffered records. Returns how many were written; they stay buffered if the insert fails."""
+        if self.db is None:
+            return 0
+        with self._lock:
+            records = list(self._buffer)
+            self._buffer.clear()
+        if not records:
+            return 0
+        written = self.db.insert_ai_call_metrics([asdict(record) for record in records])
+        if not written:
+            with self._lock:
+                self._buffer.extendleft(reversed(records))
+        return written
+
+
+_metrics: Optional[AICallMetrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_call_metrics(db, model_prices: Optional[Dict[str, Dict[str, float]]] = None) -> AICallMetrics:
+    """Process-wide collector; module level so buffered records survive Streamlit reruns."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = AICallMetrics(db, model_prices)
+        else:
+            _metrics.db = db
+            _metrics.model_prices = model_prices or DEFAULT_MODEL_PRICES
+        return _metrics
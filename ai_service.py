@@ -1,13 +1,245 @@
 import openai
 import google.generativeai as genai
-from typing import Dict, Any, List, Tuple, Optional
+from typing import Callable, Dict, Any, List, Tuple, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import hashlib
 import json
+import threading
+import time
 import streamlit as st
+from dataclasses import dataclass, field
 from datetime import datetime
 import re # For extracting potential JSON from Markdown if needed (future proofing)
+from ai_metrics import AICallMetrics, AICallRecord
+from cache_store import TTLCache
+from pipeline import context_thread_pool
+from provider_health import ProviderMonitor, get_provider_monitor
+from rule_extractor import RuleExtraction, RuleExtractor
+from throttling import TokenBucket, shared_token_bucket
+
+CHARS_PER_TOKEN = 4  # Rough average for English prose; good enough for sizing prompts
+
+# How map-reduce extraction merges per-chunk results (see merge_partial_extractions)
+LIST_FIELDS = ("required_fields", "supporting_documents", "validation_warnings")
+COMBINED_TEXT_FIELDS = ("fees", "processing_time", "submission_method", "target_applicants")
+
+# Runs hedged provider calls; shared so that abandoned slower calls never block the caller.
+# Each submitted call holds one of `_hedge_slots` until it finishes, abandoned ones
+# included, so calls never queue behind each other for a worker; when the slots run out
+# requests go sequential and slow calls are not hedged.
+MAX_HEDGED_CALLS = 16
+_hedge_executor = ThreadPoolExecutor(max_workers=MAX_HEDGED_CALLS, thread_name_prefix="ai-hedge")
+_hedge_slots = threading.BoundedSemaphore(MAX_HEDGED_CALLS)
+HEDGE_POLL_SECONDS = 0.25  # How often a hedged request checks whether a rate-limited call has been sent
+
+
+# Fields the model fills in; source URL, file path, format, fetch time, query and text
+# length are set by the code after parsing, so the model is not asked for them
+EXTRACTION_JSON_SCHEMA = {
+    "country": "Country name (e.g., USA, Canada)",
+    "visa_category": "Type of visa/immigration category (e.g., Work Visa, Student Visa)",
+    "form_name": "Official form name (e.g., Petition for a Nonimmigrant Worker)",
+    "form_id": "Official form number/ID (e.g., I-129)",
+    "description": "Brief, concise description of the form's purpose.",
+    "governing_authority": "Government agency responsible (e.g., USCIS, IRCC)",
+    "target_applicants": "Who should use this form (e.g., Employers filing for nonimmigrant workers)",
+    "required_fields": [{"name": "field name", "type": "text/number/date/etc", "description": "field description", "example_value": "example data"}],
+    "supporting_documents": ["list of required supporting documents (e.g., Passport, Birth Certificate)"],
+    "submission_method": "How to submit the form (e.g., Online, Mail, In-person)",
+    "processing_time": "Expected processing time (e.g., 6-12 months, 30 days)",
+    "fees": "Required fees (e.g., $460, Varies)",
+    "language": "Primary language of the document (e.g., English, French)",
+    "full_markdown_summary": "A comprehensive, detailed summary of the document in Markdown: its purpose, detailed instructions, eligibility, process, and any other relevant information, including what does not fit the structured fields above. Use Markdown headings (##, ###), lists, and bold text. This summary is the primary source of truth for detailed document intelligence."
+}
+
+# Built once and never varied per document, so every extraction request starts with the
+# same bytes. At about 610 tokens (740 combined) this prefix is below OpenAI's
+# 1,024-token minimum for prompt caching, so cached_prompt_tokens reads 0 for now; the
+# prefix only becomes cacheable if the schema or instructions grow past that size.
+EXTRACTION_SYSTEM_PROMPT = f"""You are an expert immigration document analyzer. You receive the text and metadata of an immigration form or document and extract its information as a JSON object that strictly adheres to the schema below. In 'full_markdown_summary', capture ALL available details, instructions, and nuances; keep the other fields concise.
+
+**IMPORTANT:** If the 'Document Text' is empty, very short, or states that text extraction failed, infer 'country', 'visa_category', 'form_name', 'form_id', 'description', and 'governing_authority' from the 'Document Info' (filename, URL, discovered query), and state in 'full_markdown_summary' that it is based on metadata only. Only set these fields to null if nothing can be inferred from any source.
+
+JSON Schema:
+{json.dumps(EXTRACTION_JSON_SCHEMA, indent=2)}
+
+If information is not available for a structured field, use null or an empty value, but always populate 'full_markdown_summary' with meaningful content about the document. The entire output must be a valid JSON object."""
+
+COMBINED_SYSTEM_PROMPT = EXTRACTION_SYSTEM_PROMPT + """
+
+**Validation:** Before answering, review your extraction for completeness and accuracy, and list every issue in 'validation_warnings' as a JSON array of clear, specific strings. Check for:
+1. Missing required information (fees, processing times, submission methods)
+2. Inconsistencies or contradictions
+3. Unclear or ambiguous information
+4. Potential errors in extraction
+Use an empty array if no issues are found. Example: ["Fee amount missing", "Processing time not specified", "Submission method unclear"]"""
+
+
+@dataclass
+class TokenUsage:
+    """Tokens billed for one document's AI calls, summed over providers, hedges and map-reduce parts. Thread-safe."""
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0  # Part of prompt_tokens served from the provider's prefix cache
+    completion_tokens: int = 0
+    response_cache_hits: int = 0  # Calls answered from response_cache, at no token cost
+    labels: Dict[str, Any] = field(default_factory=dict)  # batch_id, country, document_url for the call metrics
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, prompt_tokens: int, completion_tokens: int, cached_prompt_tokens: int = 0):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens or 0
+            self.completion_tokens += completion_tokens or 0
+            self.cached_prompt_tokens += cached_prompt_tokens or 0
+
+    def add_cache_hit(self):
+        with self._lock:
+            self.response_cache_hits += 1
+
+    def to_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "response_cache_hits": self.response_cache_hits
+            }
+
+
+def prompt_fingerprint(provider: str, model: str, system_prompt: str, user_prompt: str, params: Dict[str, Any]) -> str:
+    """Cache key for an LLM call: identical provider, model, prompts and generation params give the same key."""
+    payload = json.dumps({"provider": provider, "model": model, "system": system_prompt, "user": user_prompt, "params": params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_valid_json_response(text: Optional[str]) -> bool:
+    """Quiet check that a completion holds a JSON object, bare or in a ```json block."""
+    if not text:
+        return False
+    candidates = [text.strip()]
+    match = re.search(r"```json\s*(.*?)\s*```", text, re.DOTALL)
+    if match:
+        candidates.append(match.group(1))
+    for candidate in candidates:
+        try:
+            json.loads(candidate)
+            return True
+        except json.JSONDecodeError:
+            continue
+    return False
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_into_token_chunks(text: str, max_tokens: int) -> List[str]:
+    """Split text into chunks of at most ~`max_tokens`, breaking at blank lines, then lines, where possible."""
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + max_chars)
+        if end < len(text):
+            for separator in ("\n\n", "\n", " "):
+                cut = text.rfind(separator, start + max_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end
+    return chunks
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, (str, list, dict)) and not value) or (isinstance(value, str) and value.strip().lower() in ("null", "n/a", "none", "unknown"))
+
+
+def merge_partial_extractions(partials: List[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Deterministically merge per-chunk extraction results, given in document order (None for failed parts).
+
+    - List fields are concatenated in order, dropping duplicates (required fields by name).
+    - Fees, processing time, submission method and target applicants keep every distinct
+      value, joined with "; ", since different parts often cover different cases.
+    - The Markdown summaries are concatenated, one section per part after the first.
+    - Every other field takes the first non-empty value; identity fields (form name/ID,
+      authority) are most reliable on the first pages.
+    """
+    total_parts = len(partials)
+    numbered = [(number, partial) for number, partial in enumerate(partials, 1) if partial]
+    partials = [partial for _, partial in numbered]
+    merged: Dict[str, Any] = {}
+    for field_name in LIST_FIELDS:
+        items, seen = [], set()
+        for partial in partials:
+            values = partial.get(field_name) or []
+            for item in values if isinstance(values, list) else [values]:
+                key = (item.get("name") or json.dumps(item, sort_keys=True)) if isinstance(item, dict) else str(item)
+                key = key.strip().lower()
+                if key and key not in seen:
+                    seen.add(key)
+                    items.append(item)
+        merged[field_name] = items
+
+    for field_name in COMBINED_TEXT_FIELDS:
+        values = []
+        for partial in partials:
+            value = partial.get(field_name)
+            if not _is_empty(value) and str(value).strip() not in values:
+                values.append(str(value).strip())
+        merged[field_name] = "; ".join(values) if values else None
+
+    sections = []
+    for number, partial in numbered:
+        summary = partial.get("full_markdown_summary")
+        if _is_empty(summary):
+            continue
+        sections.append(summary.strip() if not sections else f"## Part {number} of {total_parts}\n\n{summary.strip()}")
+    merged["full_markdown_summary"] = "\n\n".join(sections)
+
+    for partial in partials:
+        for field_name, value in partial.items():
+            if field_name not in merged and not _is_empty(value):
+                merged[field_name] = value
+    return merged
+
 
 class AIExtractionService:
-    def __init__(self, openai_api_key: str, openrouter_api_key: str = None, gemini_api_key: str = None):
+    def __init__(self, openai_api_key: str, openrouter_api_key: str = None, gemini_api_key: str = None, max_text_length: int = 6000,
+                 long_document_mode: str = "truncate", map_chunk_tokens: int = 3000, map_max_chunks: int = 12, map_workers: int = 4,
+                 response_cache: Optional[TTLCache] = None, provider_monitor: Optional[ProviderMonitor] = None,
+                 hedge_requests: bool = False, hedge_percentile: float = 0.9, hedge_default_delay: float = 15.0, hedge_min_delay: float = 1.0,
+                 validation_mode: str = "separate", rule_extractor: Optional[RuleExtractor] = None, rule_min_confidence: float = 0.8,
+                 provider_limits: Optional[Dict[str, Dict[str, float]]] = None, max_prompt_tokens: Optional[int] = None,
+                 call_metrics: Optional[AICallMetrics] = None):
+        self.max_text_length = max_text_length  # Characters of document text sent to the model
+        self.max_prompt_tokens = max_prompt_tokens  # Estimated system + user prompt tokens for a single-call extraction
+        self.long_document_mode = long_document_mode  # "truncate" or "map_reduce" for text over max_text_length
+        self.map_chunk_tokens = map_chunk_tokens
+        self.map_max_chunks = map_max_chunks
+        self.map_workers = map_workers
+        self.response_cache = response_cache  # Successful completions keyed by prompt_fingerprint
+        self.provider_monitor = provider_monitor or get_provider_monitor()
+        # Hedged mode: start the next provider once the current one is slower than its
+        # `hedge_percentile` latency, instead of waiting for it to fail
+        self.hedge_requests = hedge_requests
+        self.hedge_percentile = hedge_percentile
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_delay = hedge_min_delay
+        # "separate": extraction call then validation call; "combined": one call returns both
+        self.validation_mode = validation_mode
+        # Fields the rule extractor finds with at least `rule_min_confidence` are not asked of the model
+        self.rule_extractor = rule_extractor
+        self.rule_min_confidence = rule_min_confidence
+        # {"openai": {"rpm": ..., "tpm": ...}, ...}: per-provider request/token budgets, shared process-wide
+        self.provider_limits = provider_limits or {}
+        self.call_metrics = call_metrics  # One AICallRecord per provider call, persisted on flush_call_metrics()
         self.openai_client = None
         self.openrouter_client = None
         self.gemini_model = None
@@ -41,12 +273,156 @@ class AIExtractionService:
         if not self.openai_client and not self.openrouter_client and not self.gemini_model:
             st.error("No AI service clients initialized. AI processing will fail.")
     
-    def _call_openai_compatible_service(self, client: openai.OpenAI, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int, response_format: Dict) -> Tuple[Optional[str], Optional[str]]:
-        """Helper to call OpenAI-compatible clients (OpenAI, OpenRouter)."""
+    def _cached_response(self, cache_key: str, bypass_cache: bool) -> Optional[str]:
+        if self.response_cache is None or bypass_cache:
+            return None
+        return self.response_cache.get(cache_key)
+
+    def _store_response(self, cache_key: str, content: Optional[str]):
+        """Cache a completion, unless it is not JSON (a truncated or malformed reply would be served forever)."""
+        if self.response_cache is not None and is_valid_json_response(content):
+            self.response_cache.set(cache_key, content)
+
+    def get_provider_scoreboard(self) -> List[Dict[str, Any]]:
+        """Per-provider health (breaker state, success rate, latency percentiles, last error) for display."""
+        return self.provider_monitor.scoreboard()
+
+    def get_response_cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self.response_cache.stats() if self.response_cache is not None else None
+
+    def clear_response_cache(self):
+        if self.response_cache is not None:
+            self.response_cache.clear()
+
+    def _rate_limits(self, provider: str, system_prompt: str, user_prompt: str, max_tokens: int) -> List[Tuple[TokenBucket, float]]:
+        """(bucket, tokens to take) for the provider's requests-per-minute and tokens-per-minute limits."""
+        limits = self.provider_limits.get(provider) or {}
+        buckets = []
+        if limits.get("rpm"):
+            buckets.append((shared_token_bucket(f"llm-rpm:{provider}", limits["rpm"] / 60.0, limits["rpm"]), 1))
+        if limits.get("tpm"):
+            # Prompt tokens are estimated; the completion is charged at its max_tokens ceiling
+            buckets.append((shared_token_bucket(f"llm-tpm:{provider}", limits["tpm"] / 60.0, limits["tpm"]),
+                            estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + max_tokens))
+        return buckets
+
+    def _throttle(self, provider: str, system_prompt: str, user_prompt: str, max_tokens: int):
+        """Wait for the provider's rate limits, for a call allow_request already let through.
+
+        If waiting is interrupted (e.g. a Streamlit rerun stops the script), the breaker's
+        half-open probe slot is freed before the exception goes on.
+        """
+        try:
+            for bucket, tokens in self._rate_limits(provider, system_prompt, user_prompt, max_tokens):
+                bucket.acquire(tokens)
+        except BaseException:
+            self.provider_monitor.release(provider)
+            raise
+
+    @staticmethod
+    def _openai_cache_key(client: Any, model_name: str, system_prompt: str, user_prompt: str, max_tokens: int, response_format: Dict) -> str:
+        return prompt_fingerprint(str(client.base_url), model_name, system_prompt, user_prompt,
+                                  {"temperature": 0.1, "max_tokens": max_tokens, "response_format": response_format})
+
+    @staticmethod
+    def _gemini_request(model: genai.GenerativeModel, system_prompt: str, user_prompt: str, max_tokens: int) -> Tuple[str, Dict[str, Any], str]:
+        """(combined prompt, generation config, cache key) for a Gemini call."""
+        # Gemini's system instructions are often best integrated into the prompt for JSON output
+        # when using response_mime_type.
+        combined_prompt = f"System Instruction: {system_prompt}\n\nUser Query: {user_prompt}"
+        generation_config = {
+            "temperature": 0.1,
+            "max_output_tokens": max_tokens,
+            "response_mime_type": "application/json" # Enforce JSON output
+        }
+        return combined_prompt, generation_config, prompt_fingerprint("gemini", model.model_name, system_prompt, user_prompt, generation_config)
+
+    @staticmethod
+    def _openai_token_counts(response: Any) -> Tuple[int, int, int]:
+        """(prompt, completion, cached prompt) tokens billed for an OpenAI-compatible response."""
+        if getattr(response, "usage", None) is None:
+            return 0, 0, 0
+        details = getattr(response.usage, "prompt_tokens_details", None)
+        return response.usage.prompt_tokens or 0, response.usage.completion_tokens or 0, getattr(details, "cached_tokens", 0) or 0
+
+    @staticmethod
+    def _gemini_token_counts(response: Any) -> Tuple[int, int, int]:
+        metadata = getattr(response, "usage_metadata", None)
+        if metadata is None:
+            return 0, 0, 0
+        return (metadata.prompt_token_count or 0, metadata.candidates_token_count or 0,
+                getattr(metadata, "cached_content_token_count", 0) or 0)
+
+    @staticmethod
+    def _gemini_model_name(model: genai.GenerativeModel) -> str:
+        return model.model_name.split("/")[-1]
+
+    def _record_call(self, usage: Optional[TokenUsage], provider: str, model: str, task: str, attempt: int, outcome: str,
+                     seconds: Optional[float] = None, tokens: Tuple[int, int, int] = (0, 0, 0), error: Optional[str] = None):
+        """Account one call (or cache hit / breaker refusal) in the document's `usage` and in `call_metrics`."""
+        prompt_tokens, completion_tokens, cached_prompt_tokens = tokens
+        if usage is not None:
+            if outcome == "cache_hit":
+                usage.add_cache_hit()
+            elif outcome == "success":
+                usage.add(prompt_tokens, completion_tokens, cached_prompt_tokens)
+        if self.call_metrics is not None:
+            labels = usage.labels if usage is not None else {}
+            self.call_metrics.record(AICallRecord(
+                provider=provider, model=model, task=task, outcome=outcome,
+                prompt_tokens=prompt_tokens, cached_prompt_tokens=cached_prompt_tokens, completion_tokens=completion_tokens,
+                latency_seconds=round(seconds, 3) if seconds is not None else None, retries=attempt,
+                cache_hit=outcome == "cache_hit", error=error,
+                batch_id=labels.get("batch_id"), country=labels.get("country"), document_url=labels.get("document_url")
+            ))
+
+    def record_batch_call(self, provider: str, model: str, task: str, outcome: str, token_counts: Optional[Dict[str, int]] = None,
+                          error: Optional[str] = None, labels: Optional[Dict[str, Any]] = None):
+        """Record one provider batch API request to `model` in `call_metrics` (billed at the batch discount, no latency)."""
+        if self.call_metrics is None:
+            return
+        labels, token_counts = labels or {}, token_counts or {}
+        self.call_metrics.record(AICallRecord(
+            provider=provider, model=model, task=task, outcome=outcome,
+            prompt_tokens=token_counts.get("prompt_tokens") or 0,
+            cached_prompt_tokens=(token_counts.get("prompt_tokens_details") or {}).get("cached_tokens") or 0,
+            completion_tokens=token_counts.get("completion_tokens") or 0, error=error,
+            batch_id=labels.get("batch_id"), country=labels.get("country"), document_url=labels.get("document_url")
+        ), batch=True)
+
+    def flush_call_metrics(self):
+        if self.call_metrics is not None:
+            self.call_metrics.flush()
+
+    def _call_openai_compatible_service(self, client: openai.OpenAI, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int, response_format: Dict,
+                                        bypass_cache: bool = False, provider: str = "openai", usage: Optional[TokenUsage] = None,
+                                        task: str = "", attempt: int = 0, on_sent: Optional[Callable[[], None]] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Helper to call OpenAI-compatible clients (OpenAI, OpenRouter).
+
+        Responses are served from `response_cache` when possible; `bypass_cache` forces a fresh call (the result is still stored).
+        Real calls wait for the provider's rate limits, are timed into `provider_monitor`
+        under `provider`, and are refused while its circuit breaker is open. Billed tokens are added to `usage`,
+        and every outcome goes to `call_metrics` as `task`, with `attempt` providers tried before this one.
+        `on_sent` is called once the rate limits let the request go out.
+        """
         if not client:
             return None, "AI client not initialized."
-        
+
+        cache_key = self._openai_cache_key(client, model_name, system_prompt, user_prompt, max_tokens, response_format)
+        cached = self._cached_response(cache_key, bypass_cache)
+        if cached is not None:
+            self._record_call(usage, provider, model_name, task, attempt, "cache_hit")
+            return cached, None
+
+        if not self.provider_monitor.allow_request(provider):
+            self._record_call(usage, provider, model_name, task, attempt, "rejected", error="circuit breaker open")
+            return None, f"{provider} skipped: circuit breaker open"
+
+        self._throttle(provider, system_prompt, user_prompt, max_tokens)
+        started = time.monotonic()
         try:
+            if on_sent:
+                on_sent()
             response = client.chat.completions.create(
                 model=model_name,
                 messages=[
@@ -57,34 +433,67 @@ class AIExtractionService:
                 max_tokens=max_tokens,
                 response_format=response_format
             )
-            return response.choices[0].message.content, None
+            content = response.choices[0].message.content
+            seconds = time.monotonic() - started
+            self.provider_monitor.record_success(provider, seconds)
+            self._record_call(usage, provider, model_name, task, attempt, "success", seconds, self._openai_token_counts(response))
+            self._store_response(cache_key, content)
+            return content, None
         except openai.APIStatusError as e:
-            return None, f"API error (Status {e.status_code}): {e.response}"
+            error_message = f"API error (Status {e.status_code}): {e.response}"
         except Exception as e:
-            return None, f"Unexpected error: {e}"
+            error_message = f"Unexpected error: {e}"
+        except BaseException:
+            # Interrupted without an outcome (e.g. a Streamlit rerun): free the breaker's half-open probe slot
+            self.provider_monitor.release(provider)
+            raise
+        seconds = time.monotonic() - started
+        self.provider_monitor.record_failure(provider, seconds, error_message)
+        self._record_call(usage, provider, model_name, task, attempt, "error", seconds, error=error_message)
+        return None, error_message
 
-    def _call_gemini_service(self, model: genai.GenerativeModel, system_prompt: str, user_prompt: str, max_tokens: int) -> Tuple[Optional[str], Optional[str]]:
-        """Helper to call Gemini service."""
+    def _call_gemini_service(self, model: genai.GenerativeModel, system_prompt: str, user_prompt: str, max_tokens: int,
+                             bypass_cache: bool = False, usage: Optional[TokenUsage] = None,
+                             task: str = "", attempt: int = 0, on_sent: Optional[Callable[[], None]] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Helper to call Gemini service, through `response_cache` like _call_openai_compatible_service."""
         if not model:
             return None, "Gemini model not initialized."
-        try:
-            # Gemini's system instructions are often best integrated into the prompt for JSON output
-            # when using response_mime_type.
-            combined_prompt = f"System Instruction: {system_prompt}\n\nUser Query: {user_prompt}"
-            
-            generation_config = {
-                "temperature": 0.1,
-                "max_output_tokens": max_tokens,
-                "response_mime_type": "application/json" # Enforce JSON output
-            }
 
+        combined_prompt, generation_config, cache_key = self._gemini_request(model, system_prompt, user_prompt, max_tokens)
+        model_name = self._gemini_model_name(model)
+        cached = self._cached_response(cache_key, bypass_cache)
+        if cached is not None:
+            self._record_call(usage, "gemini", model_name, task, attempt, "cache_hit")
+            return cached, None
+
+        if not self.provider_monitor.allow_request("gemini"):
+            self._record_call(usage, "gemini", model_name, task, attempt, "rejected", error="circuit breaker open")
+            return None, "gemini skipped: circuit breaker open"
+
+        self._throttle("gemini", system_prompt, user_prompt, max_tokens)
+        started = time.monotonic()
+        try:
+            if on_sent:
+                on_sent()
             response = model.generate_content(
                 combined_prompt,
                 generation_config=generation_config
             )
-            return response.text, None
+            content = response.text
+            seconds = time.monotonic() - started
+            self.provider_monitor.record_success("gemini", seconds)
+            self._record_call(usage, "gemini", model_name, task, attempt, "success", seconds, self._gemini_token_counts(response))
+            self._store_response(cache_key, content)
+            return content, None
         except Exception as e:
-            return None, f"Gemini error: {e}"
+            error_message = f"Gemini error: {e}"
+        except BaseException:
+            self.provider_monitor.release("gemini")
+            raise
+        seconds = time.monotonic() - started
+        self.provider_monitor.record_failure("gemini", seconds, error_message)
+        self._record_call(usage, "gemini", model_name, task, attempt, "error", seconds, error=error_message)
+        return None, error_message
 
     def _extract_json_from_text(self, text: str) -> Optional[str]:
         """
@@ -127,119 +536,265 @@ class AIExtractionService:
         st.error(f"Could not extract valid JSON from AI response after all attempts. Raw response (first 500 chars): {text[:500]}...")
         return None # No valid JSON string found
 
-    def extract_form_data(self, document_text: str, document_info: Dict[str, Any]) -> Dict[str, Any]:
-        """Extract structured form data and a detailed Markdown summary using AI."""
-        
-        if not self.openai_client and not self.openrouter_client and not self.gemini_model:
-            st.error("AI service not initialized due to missing API keys.")
-            return {}
-        
-        json_schema = {
-            "country": "Country name (e.g., USA, Canada)",
-            "visa_category": "Type of visa/immigration category (e.g., Work Visa, Student Visa)",
-            "form_name": "Official form name (e.g., Petition for a Nonimmigrant Worker)",
-            "form_id": "Official form number/ID (e.g., I-129)",
-            "description": "Brief, concise description of the form's purpose.",
-            "governing_authority": "Government agency responsible (e.g., USCIS, IRCC)",
-            "target_applicants": "Who should use this form (e.g., Employers filing for nonimmigrant workers)",
-            "required_fields": [{"name": "field name", "type": "text/number/date/etc", "description": "field description", "example_value": "example data"}],
-            "supporting_documents": ["list of required supporting documents (e.g., Passport, Birth Certificate)"],
-            "submission_method": "How to submit the form (e.g., Online, Mail, In-person)",
-            "processing_time": "Expected processing time (e.g., 6-12 months, 30 days)",
-            "fees": "Required fees (e.g., $460, Varies)",
-            "language": "Primary language of the document (e.g., English, French)",
-            "official_source_url": "URL to the official form or document source (e.g., USCIS website)",
-            "downloaded_file_path": "Local file path where the document was saved (if applicable)",
-            "document_format": "Format of the document (e.g., PDF, DOCX)",
-            "last_fetched": "Timestamp of when the document was last fetched (ISO 8601 format)",
-            "discovered_by_query": "Query or method used to discover this document (e.g., Google Search, API Call)",
-            "extracted_text_length": "Length of the extracted text in characters",
-            "validation_warnings": "List of validation warnings or issues found during extraction",
-            "full_markdown_summary": "A comprehensive Markdown summary of the document, capturing all details, instructions, and nuances.",
-            "full_markdown_summary": "A comprehensive, detailed summary of the document, formatted in Markdown. This field should elaborate on all aspects of the form, including its purpose, detailed instructions, eligibility, process, and any other relevant information found in the document, even if it doesn't fit into the structured fields above. Use Markdown headings (##, ###), lists, and bold text for clarity and readability. Ensure this summary is exhaustive and captures all nuances, acting as the primary source of truth for detailed document intelligence. If information is found that doesn't fit the specific structured keys, include it here."
-        }
+    def _providers(self, system_prompt: str, user_prompt: str, max_tokens: int, bypass_cache: bool,
+                   usage: Optional[TokenUsage] = None, task: str = "") -> List[Tuple[str, str, Callable[..., Tuple[Optional[str], Optional[str]]]]]:
+        """Configured providers in fallback order, as (label, monitor name, call taking the attempt number and an `on_sent` callback)."""
+        providers = []
+        if self.openai_client:
+            providers.append(("OpenAI", "openai", lambda attempt=0, on_sent=None: self._call_openai_compatible_service(
+                self.openai_client, system_prompt, user_prompt, model_name="gpt-4o-mini", max_tokens=max_tokens, response_format={"type": "json_object"},
+                bypass_cache=bypass_cache, provider="openai", usage=usage, task=task, attempt=attempt, on_sent=on_sent
+            )))
+        if self.openrouter_client:
+            providers.append(("OpenRouter", "openrouter", lambda attempt=0, on_sent=None: self._call_openai_compatible_service(
+                self.openrouter_client, system_prompt, user_prompt, model_name="openai/gpt-4o-mini", max_tokens=max_tokens, response_format={"type": "json_object"},
+                bypass_cache=bypass_cache, provider="openrouter", usage=usage, task=task, attempt=attempt, on_sent=on_sent
+            )))
+        if self.gemini_model:
+            providers.append(("Gemini", "gemini", lambda attempt=0, on_sent=None: self._call_gemini_service(
+                self.gemini_model, system_prompt, user_prompt, max_tokens=max_tokens, bypass_cache=bypass_cache, usage=usage,
+                task=task, attempt=attempt, on_sent=on_sent
+            )))
+        return providers
 
-        system_prompt = f"""You are an expert immigration document analyzer. Your task is to extract highly detailed and structured information from immigration forms and documents. You will receive a document's text and metadata, and you must extract all relevant information according to the provided JSON schema. As part of your analysis, you will also generate a comprehensive Markdown summary of the document, capturing all details, instructions, and nuances.I need you to also to be able to handle cases where the document text is very short or empty, inferring necessary fields from the metadata provided.And you must download the document text and metadata from the provided URL, and use that to extract information.
+    def _complete(self, task: str, system_prompt: str, user_prompt: str, max_tokens: int, bypass_cache: bool = False,
+                  usage: Optional[TokenUsage] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Run a JSON completion down the provider chain: OpenAI, then OpenRouter, then Gemini.
 
+        Providers whose circuit breaker is open are skipped without waiting on them. `task` ("extraction", "validation") only labels the status messages.
+        Tokens billed by every attempt (hedges included) are added to `usage`. Returns (content, last_error).
+        With `hedge_requests` the chain is hedged (see _complete_hedged) unless every hedge slot is busy.
+        """
+        providers = []
+        for provider in self._providers(system_prompt, user_prompt, max_tokens, bypass_cache, usage, task):
+            if self.provider_monitor.is_available(provider[1]):
+                providers.append(provider)
+            else:
+                self.provider_monitor.note_skipped(provider[1])
+                st.info(f"Skipping {provider[0]} for {task}: circuit breaker open after recent failures.")
+        if not providers:
+            error_message = "All AI providers are temporarily unavailable (circuit breakers open)."
+            st.error(f"AI {task} failed: {error_message}")
+            return None, error_message
 
-Return a JSON object that strictly adheres to the following schema.
-For the "full_markdown_summary" field, provide an extensive summary of the document, formatted in Markdown, capturing ALL available details, instructions, and nuances. For other fields, be concise.
+        if self.hedge_requests and len(providers) > 1 and _hedge_slots.acquire(blocking=False):
+            return self._complete_hedged(task, providers)
 
-**IMPORTANT:** If the 'Document Text' is empty or very short, you MUST infer the 'country', 'visa_category', 'form_name', 'form_id', 'description', and 'governing_authority' fields primarily from the 'Document Info' (filename, URL, discovered query) provided in the user prompt. Only set these fields to null if absolutely no information can be inferred from any source.
+        response_content = None
+        error_message = None
+        for position, (label, _, call) in enumerate(providers):
+            st.info(f"Attempting AI {task} with {label}...")
+            response_content, error_message = call(position)
+            if response_content:
+                st.success(f"AI {task} successful using {label}{' fallback' if position else ''}.")
+                break
+            if position + 1 < len(providers):
+                st.warning(f"{label} {task} failed: {error_message}. Attempting {providers[position + 1][0]} fallback...")
+            else:
+                st.error(f"{label} {task} also failed: {error_message}." if position else f"{label} {task} failed: {error_message}.")
 
-JSON Schema:
-{json.dumps(json_schema, indent=2)}
+        return response_content, error_message
 
-Be thorough, accurate, and comprehensive. If information is not available for a specific structured field, use null or empty values, but ensure the 'full_markdown_summary' is always populated with meaningful content about the document. Ensure the entire output is a valid JSON object."""
+    def _complete_hedged(self, task: str, providers: List[Tuple[str, str, Callable]]) -> Tuple[Optional[str], Optional[str]]:
+        """Hedged variant of _complete: the first provider to return valid JSON wins.
 
-        max_text_length = 6000
+        The caller must already hold one `_hedge_slots` slot, used by the first call.
+        The next provider starts as soon as the current one fails, or once its request
+        has been out (rate limiting excluded) longer than its hedge delay (its
+        `hedge_percentile` latency, from the monitor) and a slot is free. Calls that lose
+        the race are abandoned, not interrupted: their results are discarded (but still
+        cached) when they finish, and they keep their slot until then.
+        """
+        running = {}  # future -> label
+        sent_at = {}  # position -> when its request went out
+        next_position = 0
+        error_message = None
 
-        # Prepare document text for AI, handling empty/low content gracefully
-        ai_document_text = document_text
-        if not document_text or len(document_text.strip()) < 50:
-            st.warning("AI: Document text is very short or empty. AI will attempt to infer from metadata and provide a summary indicating text was unavailable.")
-            ai_document_text = f"**Note:** Text extraction from the original document failed or yielded very little content. The following information is based primarily on the document's filename, URL, and any other available metadata. The 'full_markdown_summary' will reflect this limitation.\n\n" + ai_document_text
-        
-        if len(ai_document_text) > max_text_length:
-            ai_document_text = ai_document_text[:max_text_length] + "\n... [Document text truncated due to length]"
+        def start_next():
+            nonlocal next_position
+            position = next_position
+            label, _, call = providers[position]
+            future = _hedge_executor.submit(call, position, lambda: sent_at.setdefault(position, time.monotonic()))
+            future.add_done_callback(lambda _: _hedge_slots.release())
+            running[future] = label
+            next_position += 1
+
+        st.info(f"Attempting AI {task} with {providers[0][0]} (hedged)...")
+        start_next()
+        hedge_allowed = True
+        while running:
+            timeout, hedge_at = None, None
+            if hedge_allowed and next_position < len(providers):
+                sent = sent_at.get(next_position - 1)
+                if sent is None:
+                    timeout = HEDGE_POLL_SECONDS  # Still waiting on rate limits: the hedge clock has not started
+                else:
+                    hedge_at = sent + self.provider_monitor.hedge_delay(
+                        providers[next_position - 1][1], self.hedge_percentile, self.hedge_default_delay, self.hedge_min_delay
+                    )
+                    timeout = max(0.0, hedge_at - time.monotonic())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if hedge_at is None or time.monotonic() < hedge_at:
+                    continue
+                if not _hedge_slots.acquire(blocking=False):
+                    st.info(f"{providers[next_position - 1][0]} is slow for {task}, but too many AI calls are in flight to hedge; waiting for it...")
+                    hedge_allowed = False
+                    continue
+                st.info(f"{providers[next_position - 1][0]} is slow for {task}, also trying {providers[next_position][0]}...")
+                start_next()
+                continue
+
+            for future in done:
+                label = running.pop(future)
+                response_content, error = future.result()
+                if is_valid_json_response(response_content):
+                    for other in running:
+                        other.cancel()
+                    st.success(f"AI {task} successful using {label}.")
+                    return response_content, None
+                error_message = error or "Response was not valid JSON"
+                st.warning(f"{label} {task} failed: {error_message}.")
+                if next_position < len(providers):
+                    st.info(f"Attempting AI {task} with {providers[next_position][0]}...")
+                    _hedge_slots.acquire()  # The failed call's slot, unless another request took it first
+                    start_next()
+                    hedge_allowed = True
 
-        user_prompt = f"""Analyze this immigration document and extract structured information and a comprehensive Markdown summary:
+        st.error(f"AI {task} failed on every provider.")
+        return None, error_message
 
-Document Info:
+    def _build_extraction_system_prompt(self, include_validation: bool = False) -> str:
+        return COMBINED_SYSTEM_PROMPT if include_validation else EXTRACTION_SYSTEM_PROMPT
+
+    def _build_extraction_user_prompt(self, ai_document_text: str, document_info: Dict[str, Any], part_note: str = "",
+                                      known_fields: Optional[Dict[str, Any]] = None) -> str:
+        # Instructions live in the static system prompt; only document-specific content goes here
+        user_prompt = f"""Document Info:
 - Filename: {document_info.get('filename', 'Unknown')}
 - Source URL: {document_info.get('download_url', 'Unknown')}
 - File Type: {document_info.get('file_format', 'Unknown')}
 - Discovered by Query: {document_info.get('discovered_by_query', 'Unknown')}
 
 Document Text:
-{ai_document_text}
+{ai_document_text}"""
+        if known_fields:
+            known_lines = "\n".join(f"- {name}: {value}" for name, value in known_fields.items())
+            user_prompt += f"""
 
-Extract all relevant information according to the JSON schema provided in the system prompt. Pay special attention to populating the 'full_markdown_summary' field with all details from the document, using proper Markdown formatting. If the 'Document Text' explicitly states that text extraction failed, ensure the 'full_markdown_summary' clearly communicates this and provides any summary based on available metadata.
-**Remember to infer basic fields like country, visa_category, form_name, form_id, description, and governing_authority from the 'Document Info' if the 'Document Text' is insufficient.**"""
+**Already extracted by exact rules:** these values are reliable. Use them in 'full_markdown_summary' where relevant, but leave these keys out of your JSON; they are filled in automatically.
+{known_lines}"""
+        if part_note:
+            user_prompt = f"{part_note}\n\n{user_prompt}"
+        return user_prompt
 
-        response_content = None
-        error_message = None
+    def build_extraction_prompts(self, document_text: str, document_info: Dict[str, Any], quiet: bool = False,
+                                 include_validation: bool = False, known_fields: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+        """(system_prompt, user_prompt) for a single-call extraction of `document_text`, without calling any provider.
 
-        # Try OpenAI first
-        if self.openai_client:
-            st.info("Attempting AI extraction with OpenAI...")
-            response_content, error_message = self._call_openai_compatible_service(
-                self.openai_client, system_prompt, user_prompt, model_name="gpt-4o-mini", max_tokens=2500, response_format={"type": "json_object"}
-            )
-            if response_content:
-                st.success("AI extraction successful using OpenAI.")
-            else:
-                st.warning(f"OpenAI extraction failed: {error_message}. Attempting OpenRouter fallback...")
+        The document text is cut to `max_text_length` characters, then further if the
+        prompts would exceed `max_prompt_tokens` (estimated).
+        """
+        system_prompt = self._build_extraction_system_prompt(include_validation)
+
+        max_text_length = self.max_text_length
+
+        # Prepare document text for AI, handling empty/low content gracefully
+        ai_document_text = document_text or ""
+        if not document_text or len(document_text.strip()) < 50:
+            if not quiet:
+                st.warning("AI: Document text is very short or empty. AI will attempt to infer from metadata and provide a summary indicating text was unavailable.")
+            ai_document_text = f"**Note:** Text extraction from the original document failed or yielded very little content.\n\n" + ai_document_text
         
-        # Fallback to OpenRouter if OpenAI failed or was not available
-        if not response_content and self.openrouter_client:
-            st.info("Attempting AI extraction with OpenRouter...")
-            response_content, error_message = self._call_openai_compatible_service(
-                self.openrouter_client, system_prompt, user_prompt, model_name="openai/gpt-4o-mini", max_tokens=2500, response_format={"type": "json_object"}
-            )
-            if response_content:
-                st.success("AI extraction successful using OpenRouter fallback.")
-            else:
-                st.warning(f"OpenRouter extraction also failed: {error_message}. Attempting Gemini fallback...")
+        if len(ai_document_text) > max_text_length:
+            ai_document_text = ai_document_text[:max_text_length] + "\n... [Document text truncated due to length]"
+
+        user_prompt = self._build_extraction_user_prompt(ai_document_text, document_info, known_fields=known_fields)
+        excess_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) - (self.max_prompt_tokens or 0)
+        if self.max_prompt_tokens and excess_tokens > 0:
+            marker = "\n... [Document text truncated to the prompt token budget]"
+            keep_chars = max(0, len(ai_document_text) - excess_tokens * CHARS_PER_TOKEN - len(marker))
+            ai_document_text = ai_document_text[:keep_chars] + marker
+            user_prompt = self._build_extraction_user_prompt(ai_document_text, document_info, known_fields=known_fields)
+        return system_prompt, user_prompt
+
+    def _run_rules(self, document_text: str, document_info: Dict[str, Any]) -> Tuple[Optional[RuleExtraction], Dict[str, Any]]:
+        """Rule-based pre-extraction: (full result, the fields confident enough to skip asking the model)."""
+        if self.rule_extractor is None:
+            return None, {}
+        rules = self.rule_extractor.extract(document_text, document_info)
+        known_fields = rules.confident_fields(self.rule_min_confidence)
+        if known_fields:
+            st.info(f"Rules pre-extracted: {', '.join(f'{name}={value}' for name, value in known_fields.items())}")
+        return rules, known_fields
+
+    @staticmethod
+    def _apply_rules(extracted_data: Dict[str, Any], rules: Optional[RuleExtraction], known_fields: Dict[str, Any]) -> Dict[str, Any]:
+        if rules is not None:
+            extracted_data.update(known_fields)
+            extracted_data["rule_extraction"] = rules.to_dict()
+        return extracted_data
+
+    def extract_form_data(self, document_text: str, document_info: Dict[str, Any], bypass_cache: bool = False,
+                          include_validation: bool = False, usage: Optional[TokenUsage] = None) -> Dict[str, Any]:
+        """Extract structured form data and a detailed Markdown summary using AI.
+
+        Text beyond `max_text_length` is truncated, unless `long_document_mode` is
+        "map_reduce", in which case long documents go through _extract_form_data_map_reduce.
+        `bypass_cache` skips cached responses and asks the provider again. With
+        `include_validation`, the model also reviews its own extraction into 'validation_warnings'.
+        The tokens billed (accumulated into `usage` when given) are reported under 'token_usage'.
+        """
         
-        # Fallback to Gemini if OpenRouter failed or was not available
-        if not response_content and self.gemini_model:
-            st.info("Attempting AI extraction with Gemini...")
-            response_content, error_message = self._call_gemini_service(
-                self.gemini_model, system_prompt, user_prompt, max_tokens=2500
-            )
-            if response_content:
-                st.success("AI extraction successful using Gemini fallback.")
-            else:
-                st.error(f"Gemini extraction also failed: {error_message}.")
+        if not self.openai_client and not self.openrouter_client and not self.gemini_model:
+            st.error("AI service not initialized due to missing API keys.")
+            return {}
+
+        usage = usage if usage is not None else self._document_usage(document_info)
+        rules, known_fields = self._run_rules(document_text, document_info)
+
+        if self.uses_map_reduce(document_text):
+            return self._attach_usage(self._extract_form_data_map_reduce(document_text, document_info, bypass_cache, rules, known_fields, usage), usage)
+
+        system_prompt, user_prompt = self.build_extraction_prompts(document_text, document_info, include_validation=include_validation,
+                                                                   known_fields=known_fields)
+
+        task = "extraction & validation" if include_validation else "extraction"
+        response_content, error_message = self._complete(task, system_prompt, user_prompt, max_tokens=2800 if include_validation else 2500,
+                                                         bypass_cache=bypass_cache, usage=usage)
+        extracted_data = self._parse_extraction_response(response_content, error_message, len(document_text or ""), document_info, rules, known_fields)
+        return self._attach_usage(extracted_data, usage)
+
+    @staticmethod
+    def _document_usage(document_info: Dict[str, Any], labels: Optional[Dict[str, Any]] = None) -> TokenUsage:
+        """Fresh TokenUsage for one document; `labels` (batch_id, country) tag its call metrics."""
+        return TokenUsage(labels={"document_url": document_info.get('download_url') or document_info.get('url'), **(labels or {})})
 
+    @staticmethod
+    def _attach_usage(extracted_data: Dict[str, Any], usage: TokenUsage) -> Dict[str, Any]:
+        if extracted_data:
+            extracted_data["token_usage"] = usage.to_dict()
+        return extracted_data
+
+    @staticmethod
+    def _report_usage(usage: TokenUsage):
+        totals = usage.to_dict()
+        if totals["calls"] or totals["response_cache_hits"]:
+            st.info(f"AI tokens for this document: {totals['prompt_tokens']:,} prompt ({totals['cached_prompt_tokens']:,} cached), "
+                    f"{totals['completion_tokens']:,} completion over {totals['calls']} calls"
+                    + (f", {totals['response_cache_hits']} answered from cache" if totals["response_cache_hits"] else ""))
+
+    def _parse_extraction_response(self, response_content: Optional[str], error_message: Optional[str], text_length: int,
+                                   document_info: Dict[str, Any], rules: Optional[RuleExtraction], known_fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a single-call extraction response into the form data dict (or the failure dict)."""
         if not response_content:
             st.error(f"AI extraction failed after trying all available services. Last error: {error_message}")
-            # Even if AI fails completely, return a minimal structure with an error in summary
-            return {
+            # Even if AI fails completely, return a minimal structure with an error in summary (plus any rule-extracted fields)
+            return self._apply_rules({
                 "full_markdown_summary": f"AI extraction failed: {error_message}. No structured data could be extracted.",
                 "validation_warnings": [f"AI extraction failed: {error_message}"]
-            }
+            }, rules, known_fields)
 
         extracted_json_str = self._extract_json_from_text(response_content)
         if not extracted_json_str:
@@ -255,8 +810,9 @@ Extract all relevant information according to the JSON schema provided in the sy
                 "document_format": document_info.get('file_format'),
                 "last_fetched": datetime.now().isoformat(),
                 "discovered_by_query": document_info.get('discovered_by_query', ''),
-                "extracted_text_length": len(document_text)
+                "extracted_text_length": text_length
             })
+            self._apply_rules(extracted_data, rules, known_fields)
             
             st.success(f"AI extraction completed: {extracted_data.get('form_name', 'Unknown Form')}")
             return extracted_data
@@ -275,12 +831,136 @@ Extract all relevant information according to the JSON schema provided in the sy
                 "validation_warnings": [f"Error processing extracted data: {str(e)}"]
             }
     
-    def validate_form_data(self, form_data: Dict[str, Any]) -> List[str]:
+    def _extract_form_data_map_reduce(self, document_text: str, document_info: Dict[str, Any], bypass_cache: bool = False,
+                                      rules: Optional[RuleExtraction] = None, known_fields: Optional[Dict[str, Any]] = None,
+                                      usage: Optional[TokenUsage] = None) -> Dict[str, Any]:
+        """Extract a long document in token-bounded chunks, concurrently, then merge the partial JSON.
+
+        Only the first `map_max_chunks` chunks are sent; the merge is plain code
+        (merge_partial_extractions), so it costs no extra call and is reproducible.
+        """
+        system_prompt, part_prompts, skipped_chunks = self._map_reduce_prompts(document_text, document_info, known_fields)
+
+        def extract_part(task: str, user_prompt: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+            return self._parse_partial_response(*self._complete(task, system_prompt, user_prompt, max_tokens=1500, bypass_cache=bypass_cache, usage=usage))
+
+        with context_thread_pool(self.map_workers, thread_name_prefix="ai-map") as executor:
+            results = list(executor.map(lambda prompt: extract_part(*prompt), part_prompts))
+
+        return self._merge_map_reduce(results, skipped_chunks, document_text, document_info, rules, known_fields)
+
+    def _map_reduce_prompts(self, document_text: str, document_info: Dict[str, Any],
+                            known_fields: Optional[Dict[str, Any]]) -> Tuple[str, List[Tuple[str, str]], int]:
+        """(system_prompt, [(task label, user_prompt) per part], number of chunks left out) for map-reduce extraction."""
+        chunks = split_into_token_chunks(document_text, self.map_chunk_tokens)
+        skipped_chunks = max(0, len(chunks) - self.map_max_chunks)
+        chunks = chunks[:self.map_max_chunks]
+        st.info(f"AI: Long document ({estimate_tokens(document_text):,} tokens est.), extracting in {len(chunks)} parts...")
+
+        part_prompts = []
+        for number, chunk in enumerate(chunks, 1):
+            part_note = (f"**Note:** This is part {number} of {len(chunks)} of a longer document. Extract only what this part "
+                         f"contains and use null for fields it does not cover. Summarize only this part in 'full_markdown_summary'.")
+            part_prompts.append((f"extraction (part {number}/{len(chunks)})",
+                                 self._build_extraction_user_prompt(chunk, document_info, part_note, known_fields)))
+        return self._build_extraction_system_prompt(), part_prompts, skipped_chunks
+
+    def _parse_partial_response(self, response_content: Optional[str], error_message: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        if not response_content:
+            return None, error_message
+        extracted_json_str = self._extract_json_from_text(response_content)
+        try:
+            partial = json.loads(extracted_json_str) if extracted_json_str else None
+        except json.JSONDecodeError:
+            partial = None
+        return (partial, None) if isinstance(partial, dict) else (None, "Could not extract valid JSON")
+
+    def _merge_map_reduce(self, results: List[Tuple[Optional[Dict[str, Any]], Optional[str]]], skipped_chunks: int, document_text: str,
+                          document_info: Dict[str, Any], rules: Optional[RuleExtraction], known_fields: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge the per-part (partial, error) results, in part order, into the form data dict."""
+        chunk_count = len(results)
+        partials = [partial for partial, _ in results]
+        if not any(partials):
+            error_message = next((error for _, error in results if error), "unknown error")
+            st.error(f"AI extraction failed for every part of the document. Last error: {error_message}")
+            return self._apply_rules({
+                "full_markdown_summary": f"AI extraction failed: {error_message}. No structured data could be extracted.",
+                "validation_warnings": [f"AI extraction failed: {error_message}"]
+            }, rules, known_fields or {})
+
+        extracted_data = merge_partial_extractions(partials)
+        failed_parts = [number for number, (partial, _) in enumerate(results, 1) if not partial]
+        if failed_parts:
+            extracted_data["validation_warnings"].append(f"AI extraction failed for document parts {', '.join(map(str, failed_parts))} of {chunk_count}.")
+        if skipped_chunks:
+            extracted_data["validation_warnings"].append(f"Document too long: the last {skipped_chunks} parts were not analyzed.")
+
+        extracted_data.update({
+            "official_source_url": document_info.get('download_url'),
+            "downloaded_file_path": document_info.get('file_path'),
+            "document_format": document_info.get('file_format'),
+            "last_fetched": datetime.now().isoformat(),
+            "discovered_by_query": document_info.get('discovered_by_query', ''),
+            "extracted_text_length": len(document_text),
+            "map_reduce_parts": chunk_count
+        })
+        self._apply_rules(extracted_data, rules, known_fields or {})
+        st.success(f"AI extraction completed from {sum(1 for partial in partials if partial)}/{chunk_count} parts: {extracted_data.get('form_name', 'Unknown Form')}")
+        return extracted_data
+
+    def uses_map_reduce(self, document_text: str) -> bool:
+        return self.long_document_mode == "map_reduce" and bool(document_text) and len(document_text) > self.max_text_length
+
+    def extract_and_validate_form_data(self, document_text: str, document_info: Dict[str, Any], bypass_cache: bool = False,
+                                       labels: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], List[str]]:
+        """Extracted data and validation warnings, in one or two AI calls depending on `validation_mode`.
+
+        "combined" asks for both in a single structured call. "separate" (and map-reduce
+        extraction, whose parts each see only a slice of the document) runs
+        extract_form_data and then validate_form_data. Returns ({}, []) if extraction failed.
+        'token_usage' in the data covers both calls. `labels` (batch_id, country) tag the
+        calls' metrics, which are persisted before returning.
+        """
+        usage = self._document_usage(document_info, labels)
+        try:
+            if self.validation_mode != "combined" or self.uses_map_reduce(document_text):
+                extracted_data = self.extract_form_data(document_text, document_info, bypass_cache=bypass_cache, usage=usage)
+                if not extracted_data:
+                    return {}, []
+                validation_warnings = self.validate_form_data(extracted_data, bypass_cache=bypass_cache, usage=usage)
+                self._report_usage(usage)
+                return self._attach_usage(extracted_data, usage), validation_warnings
+
+            extracted_data = self.extract_form_data(document_text, document_info, bypass_cache=bypass_cache, include_validation=True, usage=usage)
+            self._report_usage(usage)
+            return self._split_combined_result(extracted_data)
+        finally:
+            self.flush_call_metrics()
+
+    @staticmethod
+    def _split_combined_result(extracted_data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """(data, warnings) from a combined extraction & validation response."""
+        if not extracted_data:
+            return {}, []
+        warnings = extracted_data.get("validation_warnings") or []
+        if not isinstance(warnings, list):
+            warnings = [str(warnings)]
+        warnings = [warning if isinstance(warning, str) else json.dumps(warning) for warning in warnings]
+        extracted_data["validation_warnings"] = warnings
+        st.success(f"AI validation completed: {len(warnings)} warnings found")
+        return extracted_data, warnings
+
+    def validate_form_data(self, form_data: Dict[str, Any], bypass_cache: bool = False, usage: Optional[TokenUsage] = None) -> List[str]:
         """Validate extracted form data and return warnings using AI with fallback."""
         
         if not self.openai_client and not self.openrouter_client and not self.gemini_model:
             return ["AI validation skipped due to missing API keys."]
-        
+
+        system_prompt, validation_prompt = self._build_validation_prompts(form_data)
+        response_content, error_message = self._complete("validation", system_prompt, validation_prompt, max_tokens=800, bypass_cache=bypass_cache, usage=usage)
+        return self._parse_validation_response(response_content, error_message)
+
+    def _build_validation_prompts(self, form_data: Dict[str, Any]) -> Tuple[str, str]:
         context_data = form_data.get('full_markdown_summary', json.dumps(form_data, indent=2))
 
         validation_prompt = f"""Review this extracted immigration form data for completeness and accuracy:
@@ -298,55 +978,67 @@ If no issues are found, return an empty array.
 
 Example: ["Fee amount missing", "Processing time not specified", "Submission method unclear"]"""
 
-        response_content = None
-        error_message = None
+        return ("You are an expert immigration document validator. Respond only with a JSON object containing a 'validation_warnings' array.",
+                validation_prompt)
 
-        # Try OpenAI first
-        if self.openai_client:
-            st.info("Attempting AI validation with OpenAI...")
-            response_content, error_message = self._call_openai_compatible_service(
-                self.openai_client, 
-                "You are an expert immigration document validator. Respond only with a JSON object containing a 'validation_warnings' array.", 
-                validation_prompt, 
-                model_name="gpt-4o-mini", 
-                max_tokens=800,
-                response_format={"type": "json_object"}
-            )
-            if response_content:
-                st.success("AI validation successful using OpenAI.")
-            else:
-                st.warning(f"OpenAI validation failed: {error_message}. Attempting OpenRouter fallback...")
-        
-        # Fallback to OpenRouter if OpenAI failed or was not available
-        if not response_content and self.openrouter_client:
-            st.info("Attempting AI validation with OpenRouter...")
-            response_content, error_message = self._call_openai_compatible_service(
-                self.openrouter_client, 
-                "You are an expert immigration document validator. Respond only with a JSON object containing a 'validation_warnings' array.", 
-                validation_prompt, 
-                model_name="openai/gpt-4o-mini", 
-                max_tokens=800,
-                response_format={"type": "json_object"}
-            )
-            if response_content:
-                st.success("AI validation successful using OpenRouter fallback.")
-            else:
-                st.warning(f"OpenRouter validation also failed: {error_message}. Attempting Gemini fallback...")
-        
-        # Fallback to Gemini if OpenRouter failed or was not available
-        if not response_content and self.gemini_model:
-            st.info("Attempting AI validation with Gemini...")
-            response_content, error_message = self._call_gemini_service(
-                self.gemini_model, 
-                "You are an expert immigration document validator. Respond only with a JSON object containing a 'validation_warnings' array.", 
-                validation_prompt, 
-                max_tokens=800
-            )
-            if response_content:
-                st.success("AI validation successful using Gemini fallback.")
-            else:
-                st.error(f"Gemini validation also failed: {error_message}.")
+    @staticmethod
+    def _batch_request_line(custom_id: str, system_prompt: str, user_prompt: str, max_tokens: int) -> Dict[str, Any]:
+        """One JSONL line for the OpenAI Batch API, with the same model and params as the synchronous OpenAI call."""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": "gpt-4o-mini",
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                "temperature": 0.1,
+                "max_tokens": max_tokens,
+                "response_format": {"type": "json_object"}
+            }
+        }
 
+    def batch_extraction_request(self, custom_id: str, document_text: str, document_info: Dict[str, Any],
+                                 include_validation: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """(batch request line, context for parse_batch_extraction) for one document.
+
+        Batch requests are single-call: text beyond `max_text_length` is truncated, whatever `long_document_mode` says.
+        """
+        rules = self.rule_extractor.extract(document_text, document_info) if self.rule_extractor else None
+        known_fields = rules.confident_fields(self.rule_min_confidence) if rules else {}
+        system_prompt, user_prompt = self.build_extraction_prompts(document_text, document_info, quiet=True,
+                                                                   include_validation=include_validation, known_fields=known_fields)
+        line = self._batch_request_line(custom_id, system_prompt, user_prompt, 2800 if include_validation else 2500)
+        context = {
+            "document_info": document_info,
+            "text_length": len(document_text or ""),
+            "rules": rules.to_dict() if rules else None,
+            "known_fields": known_fields,
+            "model": line["body"]["model"]
+        }
+        return line, context
+
+    def parse_batch_extraction(self, response_content: Optional[str], error_message: Optional[str], context: Dict[str, Any]) -> Dict[str, Any]:
+        """Form data from a batch extraction result, as extract_form_data would have returned it."""
+        rules = RuleExtraction(**context["rules"]) if context.get("rules") else None
+        return self._parse_extraction_response(response_content, error_message, context.get("text_length", 0),
+                                               context.get("document_info") or {}, rules, context.get("known_fields") or {})
+
+    def parse_batch_combined(self, response_content: Optional[str], error_message: Optional[str],
+                             context: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """(data, warnings) from a combined extraction & validation batch result."""
+        return self._split_combined_result(self.parse_batch_extraction(response_content, error_message, context))
+
+    def batch_validation_request(self, custom_id: str, form_data: Dict[str, Any]) -> Dict[str, Any]:
+        system_prompt, validation_prompt = self._build_validation_prompts(form_data)
+        return self._batch_request_line(custom_id, system_prompt, validation_prompt, 800)
+
+    def parse_batch_validation(self, response_content: Optional[str], error_message: Optional[str]) -> List[str]:
+        return self._parse_validation_response(response_content, error_message)
+
+    def _parse_validation_response(self, response_content: Optional[str], error_message: Optional[str]) -> List[str]:
         if not response_content:
             st.error(f"AI validation failed after trying all available services. Last error: {error_message}")
             return [f"AI validation failed: {error_message}"]
@@ -374,3 +1066,295 @@ Example: ["Fee amount missing", "Processing time not specified", "Submission met
         except Exception as e:
             st.error(f"Error processing validation data: {e}")
             return [f"Validation error: {str(e)}"]
+
+
+class AsyncAIExtractionService(AIExtractionService):
+    """asyncio variant of AIExtractionService for batch jobs.
+
+    Calls go through AsyncOpenAI and Gemini's generate_content_async, so hundreds of
+    documents can be in flight on one event loop instead of one thread each:
+    `await service.extract_many([(text, info), ...])`. At most `max_concurrency`
+    documents are processed at once, and each provider waits on the same
+    `provider_limits` token buckets as the synchronous service. Prompts, parsing,
+    response cache, rule pre-extraction, circuit breakers and latency statistics are
+    all shared with it. Per-attempt status messages are left out to keep large
+    batches readable; failures are still reported.
+    """
+
+    def __init__(self, openai_api_key: str, openrouter_api_key: str = None, gemini_api_key: str = None, max_concurrency: int = 32, **kwargs):
+        super().__init__(openai_api_key, openrouter_api_key, gemini_api_key, **kwargs)
+        self.max_concurrency = max_concurrency
+        self._openai_api_key = openai_api_key
+        self._openrouter_api_key = openrouter_api_key
+        self._clients_loop = None
+        self._loop_clients: Tuple[Optional[openai.AsyncOpenAI], Optional[openai.AsyncOpenAI]] = (None, None)
+
+    def _async_clients(self) -> Tuple[Optional[openai.AsyncOpenAI], Optional[openai.AsyncOpenAI]]:
+        """(OpenAI, OpenRouter) async clients for the running event loop; their connection pools cannot move between loops."""
+        loop = asyncio.get_running_loop()
+        if self._clients_loop is not loop:
+            stale_loop, stale_clients = self._clients_loop, self._loop_clients
+            if stale_loop is not None and stale_loop.is_running():
+                # Pools bound to another live loop must be closed on that loop
+                for client in stale_clients:
+                    if client is not None:
+                        asyncio.run_coroutine_threadsafe(client.close(), stale_loop)
+            self._clients_loop = loop
+            self._loop_clients = (
+                openai.AsyncOpenAI(api_key=self._openai_api_key) if self.openai_client else None,
+                openai.AsyncOpenAI(base_url="https://openrouter.ai/api/v1", api_key=self._openrouter_api_key) if self.openrouter_client else None
+            )
+        return self._loop_clients
+
+    async def close_async_clients(self):
+        """Close the current loop's AsyncOpenAI clients and their connection pools; await before the loop ends."""
+        clients, self._clients_loop, self._loop_clients = self._loop_clients, None, (None, None)
+        for client in clients:
+            if client is not None:
+                await client.close()
+
+    async def _throttle_async(self, provider: str, system_prompt: str, user_prompt: str, max_tokens: int):
+        for bucket, tokens in self._rate_limits(provider, system_prompt, user_prompt, max_tokens):
+            await bucket.acquire_async(tokens)
+
+    async def _call_openai_compatible_async(self, client: openai.AsyncOpenAI, system_prompt: str, user_prompt: str, model_name: str, max_tokens: int,
+                                            bypass_cache: bool, provider: str, usage: Optional[TokenUsage] = None,
+                                            task: str = "", attempt: int = 0, on_sent: Optional[Callable[[], None]] = None) -> Tuple[Optional[str], Optional[str]]:
+        response_format = {"type": "json_object"}
+        cache_key = self._openai_cache_key(client, model_name, system_prompt, user_prompt, max_tokens, response_format)
+        cached = self._cached_response(cache_key, bypass_cache)
+        if cached is not None:
+            self._record_call(usage, provider, model_name, task, attempt, "cache_hit")
+            return cached, None
+
+        if not self.provider_monitor.allow_request(provider):
+            self._record_call(usage, provider, model_name, task, attempt, "rejected", error="circuit breaker open")
+            return None, f"{provider} skipped: circuit breaker open"
+
+        started = time.monotonic()
+        try:
+            await self._throttle_async(provider, system_prompt, user_prompt, max_tokens)
+            started = time.monotonic()
+            if on_sent:
+                on_sent()
+            response = await client.chat.completions.create(
+                model=model_name,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=0.1,
+                max_tokens=max_tokens,
+                response_format=response_format
+            )
+            content = response.choices[0].message.content
+            seconds = time.monotonic() - started
+            self.provider_monitor.record_success(provider, seconds)
+            self._record_call(usage, provider, model_name, task, attempt, "success", seconds, self._openai_token_counts(response))
+            self._store_response(cache_key, content)
+            return content, None
+        except openai.APIStatusError as e:
+            error_message = f"API error (Status {e.status_code}): {e.response}"
+        except Exception as e:
+            error_message = f"Unexpected error: {e}"
+        except BaseException:
+            # Cancelled (e.g. lost a hedge race) or interrupted: neither a success nor a failure
+            self.provider_monitor.release(provider)
+            raise
+        seconds = time.monotonic() - started
+        self.provider_monitor.record_failure(provider, seconds, error_message)
+        self._record_call(usage, provider, model_name, task, attempt, "error", seconds, error=error_message)
+        return None, error_message
+
+    async def _call_gemini_async(self, system_prompt: str, user_prompt: str, max_tokens: int, bypass_cache: bool,
+                                 usage: Optional[TokenUsage] = None, task: str = "", attempt: int = 0,
+                                 on_sent: Optional[Callable[[], None]] = None) -> Tuple[Optional[str], Optional[str]]:
+        combined_prompt, generation_config, cache_key = self._gemini_request(self.gemini_model, system_prompt, user_prompt, max_tokens)
+        model_name = self._gemini_model_name(self.gemini_model)
+        cached = self._cached_response(cache_key, bypass_cache)
+        if cached is not None:
+            self._record_call(usage, "gemini", model_name, task, attempt, "cache_hit")
+            return cached, None
+
+        if not self.provider_monitor.allow_request("gemini"):
+            self._record_call(usage, "gemini", model_name, task, attempt, "rejected", error="circuit breaker open")
+            return None, "gemini skipped: circuit breaker open"
+
+        started = time.monotonic()
+        try:
+            await self._throttle_async("gemini", system_prompt, user_prompt, max_tokens)
+            started = time.monotonic()
+            if on_sent:
+                on_sent()
+            response = await self.gemini_model.generate_content_async(combined_prompt, generation_config=generation_config)
+            content = response.text
+            seconds = time.monotonic() - started
+            self.provider_monitor.record_success("gemini", seconds)
+            self._record_call(usage, "gemini", model_name, task, attempt, "success", seconds, self._gemini_token_counts(response))
+            self._store_response(cache_key, content)
+            return content, None
+        except Exception as e:
+            error_message = f"Gemini error: {e}"
+        except BaseException:
+            self.provider_monitor.release("gemini")
+            raise
+        seconds = time.monotonic() - started
+        self.provider_monitor.record_failure("gemini", seconds, error_message)
+        self._record_call(usage, "gemini", model_name, task, attempt, "error", seconds, error=error_message)
+        return None, error_message
+
+    def _async_providers(self, system_prompt: str, user_prompt: str, max_tokens: int, bypass_cache: bool,
+                         usage: Optional[TokenUsage] = None, task: str = "") -> List[Tuple[str, str, Callable]]:
+        """Available providers in fallback order, as (label, monitor name, coroutine function); open circuits are left out."""
+        openai_client, openrouter_client = self._async_clients()
+        providers = []
+        if openai_client:
+            providers.append(("OpenAI", "openai", lambda attempt=0, on_sent=None: self._call_openai_compatible_async(
+                openai_client, system_prompt, user_prompt, "gpt-4o-mini", max_tokens, bypass_cache, "openai", usage, task, attempt, on_sent)))
+        if openrouter_client:
+            providers.append(("OpenRouter", "openrouter", lambda attempt=0, on_sent=None: self._call_openai_compatible_async(
+                openrouter_client, system_prompt, user_prompt, "openai/gpt-4o-mini", max_tokens, bypass_cache, "openrouter", usage, task, attempt, on_sent)))
+        if self.gemini_model:
+            providers.append(("Gemini", "gemini", lambda attempt=0, on_sent=None: self._call_gemini_async(system_prompt, user_prompt, max_tokens, bypass_cache,
+                                                                                                         usage, task, attempt, on_sent)))
+        available = []
+        for provider in providers:
+            if self.provider_monitor.is_available(provider[1]):
+                available.append(provider)
+            else:
+                self.provider_monitor.note_skipped(provider[1])
+        return available
+
+    async def _complete_async(self, task: str, system_prompt: str, user_prompt: str, max_tokens: int, bypass_cache: bool = False,
+                              usage: Optional[TokenUsage] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Async _complete: sequential fallback, or hedged when `hedge_requests` is set (losing calls are really cancelled here)."""
+        providers = self._async_providers(system_prompt, user_prompt, max_tokens, bypass_cache, usage, task)
+        if not providers:
+            return None, "All AI providers are temporarily unavailable (circuit breakers open)."
+
+        error_message = None
+        if not self.hedge_requests or len(providers) == 1:
+            for position, (_, _, call) in enumerate(providers):
+                response_content, error_message = await call(position)
+                if response_content:
+                    return response_content, None
+            st.warning(f"AI {task} failed on every provider: {error_message}")
+            return None, error_message
+
+        running = {}  # task -> label
+        sent_at = {}  # position -> when its request went out
+        next_position = 0
+
+        def start_next():
+            nonlocal next_position
+            position = next_position
+            label, _, call = providers[position]
+            running[asyncio.ensure_future(call(position, lambda: sent_at.setdefault(position, time.monotonic())))] = label
+            next_position += 1
+
+        start_next()
+        try:
+            while running:
+                timeout, hedge_at = None, None
+                if next_position < len(providers):
+                    sent = sent_at.get(next_position - 1)
+                    if sent is None:
+                        timeout = HEDGE_POLL_SECONDS  # Still waiting on rate limits: the hedge clock has not started
+                    else:
+                        hedge_at = sent + self.provider_monitor.hedge_delay(
+                            providers[next_position - 1][1], self.hedge_percentile, self.hedge_default_delay, self.hedge_min_delay
+                        )
+                        timeout = max(0.0, hedge_at - time.monotonic())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge_at is not None and time.monotonic() >= hedge_at:
+                        start_next()
+                    continue
+                for finished in done:
+                    running.pop(finished)
+                    response_content, error = finished.result()
+                    if is_valid_json_response(response_content):
+                        return response_content, None
+                    error_message = error or "Response was not valid JSON"
+                    if next_position < len(providers):
+                        start_next()
+        finally:
+            for pending in running:
+                pending.cancel()
+        st.warning(f"AI {task} failed on every provider: {error_message}")
+        return None, error_message
+
+    async def extract_form_data_async(self, document_text: str, document_info: Dict[str, Any], bypass_cache: bool = False,
+                                      include_validation: bool = False, usage: Optional[TokenUsage] = None) -> Dict[str, Any]:
+        """Async extract_form_data; map-reduce parts run concurrently on the event loop."""
+        if not self.openai_client and not self.openrouter_client and not self.gemini_model:
+            st.error("AI service not initialized due to missing API keys.")
+            return {}
+
+        usage = usage if usage is not None else self._document_usage(document_info)
+        rules, known_fields = self._run_rules(document_text, document_info)
+
+        if self.uses_map_reduce(document_text):
+            system_prompt, part_prompts, skipped_chunks = self._map_reduce_prompts(document_text, document_info, known_fields)
+            responses = await asyncio.gather(*(
+                self._complete_async(task, system_prompt, user_prompt, max_tokens=1500, bypass_cache=bypass_cache, usage=usage)
+                for task, user_prompt in part_prompts
+            ))
+            results = [self._parse_partial_response(*response) for response in responses]
+            return self._attach_usage(self._merge_map_reduce(results, skipped_chunks, document_text, document_info, rules, known_fields), usage)
+
+        system_prompt, user_prompt = self.build_extraction_prompts(document_text, document_info, include_validation=include_validation,
+                                                                   known_fields=known_fields)
+        task = "extraction & validation" if include_validation else "extraction"
+        response_content, error_message = await self._complete_async(task, system_prompt, user_prompt, max_tokens=2800 if include_validation else 2500,
+                                                                     bypass_cache=bypass_cache, usage=usage)
+        extracted_data = self._parse_extraction_response(response_content, error_message, len(document_text or ""), document_info, rules, known_fields)
+        return self._attach_usage(extracted_data, usage)
+
+    async def validate_form_data_async(self, form_data: Dict[str, Any], bypass_cache: bool = False, usage: Optional[TokenUsage] = None) -> List[str]:
+        if not self.openai_client and not self.openrouter_client and not self.gemini_model:
+            return ["AI validation skipped due to missing API keys."]
+        system_prompt, validation_prompt = self._build_validation_prompts(form_data)
+        response_content, error_message = await self._complete_async("validation", system_prompt, validation_prompt, max_tokens=800,
+                                                                     bypass_cache=bypass_cache, usage=usage)
+        return self._parse_validation_response(response_content, error_message)
+
+    async def extract_and_validate_form_data_async(self, document_text: str, document_info: Dict[str, Any],
+                                                   bypass_cache: bool = False, labels: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], List[str]]:
+        """Async extract_and_validate_form_data (same `validation_mode` handling and 'token_usage').
+
+        Call metrics are only buffered here; extract_many persists them once the batch is done.
+        """
+        usage = self._document_usage(document_info, labels)
+        if self.validation_mode != "combined" or self.uses_map_reduce(document_text):
+            extracted_data = await self.extract_form_data_async(document_text, document_info, bypass_cache=bypass_cache, usage=usage)
+            if not extracted_data:
+                return {}, []
+            validation_warnings = await self.validate_form_data_async(extracted_data, bypass_cache=bypass_cache, usage=usage)
+            return self._attach_usage(extracted_data, usage), validation_warnings
+        extracted_data = await self.extract_form_data_async(document_text, document_info, bypass_cache=bypass_cache, include_validation=True, usage=usage)
+        return self._split_combined_result(extracted_data)
+
+    async def extract_many(self, docs: List[Tuple[str, Dict[str, Any]]], bypass_cache: bool = False,
+                           labels: Optional[Dict[str, Any]] = None) -> List[Tuple[Dict[str, Any], List[str]]]:
+        """Extract and validate (document_text, document_info) pairs concurrently, returning results in input order.
+
+        At most `max_concurrency` documents are in flight. A document that raises gets
+        ({}, [error]) instead of failing the whole batch. `labels` (batch_id, country) tag
+        every call's metrics, which are persisted at the end, and the async clients are
+        closed so `asyncio.run(service.extract_many(...))` leaves no open connections.
+        """
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def run(document_text: str, document_info: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+            async with semaphore:
+                try:
+                    return await self.extract_and_validate_form_data_async(document_text, document_info, bypass_cache=bypass_cache, labels=labels)
+                except Exception as e:
+                    return {}, [f"AI extraction failed: {e}"]
+
+        try:
+            return list(await asyncio.gather(*(run(document_text, document_info) for document_text, document_info in docs)))
+        finally:
+            await self.close_async_clients()
+            self.flush_call_metrics()
@@ -7,7 +7,6 @@ import traceback
 import psycopg2
 from urllib.parse import urlparse
 import mimetypes
-import time  # Import time for delays
 import html
 import re
 
@@ -16,8 +15,17 @@ from config import config
 from database import DatabaseManager
 from discovery_service import DocumentDiscoveryService
 from document_processor import DocumentProcessor
-from ai_service import AIExtractionService
+from ai_metrics import get_call_metrics
+from ai_service import AsyncAIExtractionService
+from batch_service import BatchJobManager, FakeBatchClient, OpenAIBatchClient
 from export_service import ExportService
+from pipeline import StagedPipeline, PipelineStage
+from cache_store import get_cache
+from http_client import get_http_client
+from provider_health import get_provider_monitor
+from rule_extractor import RuleExtractor
+
+TEXT_PREVIEW_CHARS = 200_000  # Extracted text shown in the viewer; the download has it all
 
 # Utility function to clean HTML tags and entities
 def clean_html_text(text):
@@ -37,12 +45,72 @@ def clean_html_text(text):
 
     return text
 
+@st.cache_resource
+def get_database_manager(database_url: str, pool_size: int, pool_timeout: float, health_check_interval: float):
+    """Create the DatabaseManager once per process so its connection pool survives Streamlit reruns."""
+    return DatabaseManager(database_url, pool_size=pool_size, pool_timeout=pool_timeout, health_check_interval=health_check_interval)
+
 # Initialize services
 def init_services():
-    db = DatabaseManager(config.DATABASE_URL)
-    processor = DocumentProcessor(config.DOWNLOADS_DIR, config.CLOUDINARY_URL)
-    discovery = DocumentDiscoveryService(config.TAVILY_API_KEY, processor, db)
-    ai_service = AIExtractionService(config.OPENAI_API_KEY, config.OPENROUTER_API_KEY, config.GEMINI_API_KEY)
+    db = get_database_manager(config.DATABASE_URL, config.DB_POOL_SIZE, config.DB_POOL_TIMEOUT_SECONDS, config.DB_POOL_HEALTH_CHECK_SECONDS)
+    http_client = get_http_client(
+        pool_size=config.HTTP_POOL_SIZE_PER_HOST,
+        host_pool_sizes=config.HTTP_HOST_POOL_SIZES,
+        host_timeouts=config.HTTP_HOST_TIMEOUTS,
+        max_retries=config.HTTP_MAX_RETRIES,
+        backoff_base=config.HTTP_BACKOFF_BASE_SECONDS,
+        backoff_max=config.HTTP_BACKOFF_MAX_SECONDS
+    )
+    processor = DocumentProcessor(
+        config.DOWNLOADS_DIR, config.CLOUDINARY_URL,
+        extraction_workers=config.EXTRACTION_PROCESS_WORKERS,
+        pdf_min_pages_per_task=config.PDF_MIN_PAGES_PER_TASK,
+        pdf_strategy=config.PDF_EXTRACTION_STRATEGY,
+        validation_workers=config.URL_VALIDATION_WORKERS,
+        validation_per_host=config.URL_VALIDATION_PER_HOST,
+        validation_host_timeout_limit=config.URL_VALIDATION_HOST_TIMEOUT_LIMIT,
+        validation_cache=get_cache("url_validation", config.URL_VALIDATION_CACHE_TTL_SECONDS, config.CACHE_SQLITE_PATH or None),
+        validation_negative_ttl=config.URL_VALIDATION_NEGATIVE_TTL_SECONDS,
+        fetch_validator_cache=get_cache("fetch_validators", config.FETCH_VALIDATOR_TTL_SECONDS, config.CACHE_SQLITE_PATH or None),
+        http_client=http_client,
+        text_cache=get_cache("extracted_text", config.EXTRACTED_TEXT_CACHE_TTL_SECONDS, config.CACHE_SQLITE_PATH or None)
+    )
+    discovery = DocumentDiscoveryService(
+        config.TAVILY_API_KEY, processor, db,
+        max_concurrent_searches=config.TAVILY_MAX_CONCURRENT_SEARCHES,
+        requests_per_minute=config.TAVILY_REQUESTS_PER_MINUTE,
+        burst=config.TAVILY_BURST,
+        search_cache=get_cache("tavily_search", config.TAVILY_CACHE_TTL_SECONDS, config.CACHE_SQLITE_PATH or None),
+        offline=config.TAVILY_OFFLINE_MODE,
+        http_client=http_client
+    )
+    ai_service = AsyncAIExtractionService(
+        config.OPENAI_API_KEY, config.OPENROUTER_API_KEY, config.GEMINI_API_KEY,
+        max_concurrency=config.AI_ASYNC_MAX_CONCURRENCY,
+        max_text_length=config.AI_MAX_TEXT_LENGTH,
+        long_document_mode=config.AI_LONG_DOCUMENT_MODE,
+        map_chunk_tokens=config.AI_MAP_CHUNK_TOKENS,
+        map_max_chunks=config.AI_MAP_MAX_CHUNKS,
+        map_workers=config.AI_MAP_WORKERS,
+        response_cache=get_cache("llm_responses", config.AI_RESPONSE_CACHE_TTL_SECONDS, config.CACHE_SQLITE_PATH or None,
+                                 max_entries=config.AI_RESPONSE_CACHE_MAX_ENTRIES) if config.AI_RESPONSE_CACHE_ENABLED else None,
+        provider_monitor=get_provider_monitor(
+            window=config.AI_BREAKER_WINDOW,
+            min_calls=config.AI_BREAKER_MIN_CALLS,
+            failure_rate=config.AI_BREAKER_FAILURE_RATE,
+            cooldown_seconds=config.AI_BREAKER_COOLDOWN_SECONDS
+        ),
+        hedge_requests=config.AI_HEDGED_REQUESTS,
+        hedge_percentile=config.AI_HEDGE_PERCENTILE,
+        hedge_default_delay=config.AI_HEDGE_DEFAULT_DELAY_SECONDS,
+        hedge_min_delay=config.AI_HEDGE_MIN_DELAY_SECONDS,
+        validation_mode=config.AI_VALIDATION_MODE,
+        rule_extractor=RuleExtractor(DocumentDiscoveryService.COUNTRY_DOMAINS_MAP) if config.AI_RULE_PREEXTRACTION else None,
+        rule_min_confidence=config.AI_RULE_MIN_CONFIDENCE,
+        provider_limits=config.AI_PROVIDER_LIMITS,
+        max_prompt_tokens=config.AI_MAX_PROMPT_TOKENS or None,
+        call_metrics=get_call_metrics(db, config.AI_MODEL_PRICES) if config.AI_CALL_METRICS_ENABLED else None
+    )
     export_service = ExportService(config.OUTPUTS_DIR, db, config.CLOUDINARY_URL)
 
     return db, discovery, processor, ai_service, export_service
@@ -140,6 +208,8 @@ def main():
         st.markdown("### ⚙️ System Controls")
         if st.button("🔄 Clear All Caches", use_container_width=True):
             st.cache_data.clear()
+            # The cached DatabaseManager is dropped by the clear; close its pool so idle connections don't linger until GC
+            get_database_manager(config.DATABASE_URL, config.DB_POOL_SIZE, config.DB_POOL_TIMEOUT_SECONDS, config.DB_POOL_HEALTH_CHECK_SECONDS).close()
             st.cache_resource.clear()
             st.rerun()
 
@@ -190,7 +260,7 @@ def main():
     elif page == "☁️ Cloudinary Document Browser":
         cloudinary_browser_page(db)
     elif page == "🩺 Database Health Check":
-        database_health_check_page(config.DATABASE_URL)
+        database_health_check_page(config.DATABASE_URL, db, ai_service)
 
 def discovery_page(discovery, processor, ai_service, db):
     st.markdown("""
@@ -284,21 +354,64 @@ def discovery_page(discovery, processor, ai_service, db):
     with col2:
         save_to_db = st.checkbox("Save to database", value=True)
         validate_with_ai = st.checkbox("AI extraction & validation", value=True)
+        refresh_existing = st.checkbox("Re-check documents already in the database", value=False,
+                                       help="Refetches known URLs conditionally; only documents that changed are re-processed.")
+        bypass_ai_cache = st.checkbox("Bypass AI response cache", value=False,
+                                      help="Ask the AI providers again even for prompts answered before.")
+
+    with st.expander("🗄️ Search Cache"):
+        cache_stats = discovery.get_search_cache_stats()
+        if cache_stats:
+            if discovery.offline:
+                st.info("Offline mode is on: discovery only uses cached Tavily results.")
+            cache_col1, cache_col2, cache_col3 = st.columns(3)
+            cache_col1.metric("Cached Searches", cache_stats["entries"])
+            cache_col2.metric("Hits / Misses", f"{cache_stats['hits']} / {cache_stats['misses']}")
+            cache_col3.metric("Hit Rate", f"{cache_stats['hit_rate']:.0%}")
+            clear_col1, clear_col2 = st.columns(2)
+            with clear_col1:
+                if st.button("Refresh searches for this country/visa", disabled=not (country and visa_type)):
+                    count = discovery.invalidate_search_cache(country, visa_type)
+                    st.success(f"Invalidated {count} cached searches for {country} - {visa_type}.")
+            with clear_col2:
+                if st.button("Clear entire search cache"):
+                    discovery.invalidate_search_cache()
+                    st.success("Search cache cleared.")
+        else:
+            st.info("Search caching is disabled.")
+
+    with st.expander("🧠 AI Response Cache"):
+        ai_cache_stats = ai_service.get_response_cache_stats()
+        if ai_cache_stats:
+            ai_cache_col1, ai_cache_col2, ai_cache_col3, ai_cache_col4 = st.columns(4)
+            ai_cache_col1.metric("Cached Responses", ai_cache_stats["entries"])
+            ai_cache_col2.metric("Hits / Misses", f"{ai_cache_stats['hits']} / {ai_cache_stats['misses']}")
+            ai_cache_col3.metric("Hit Rate", f"{ai_cache_stats['hit_rate']:.0%}")
+            ai_cache_col4.metric("Evictions", ai_cache_stats["evictions"])
+            if st.button("Clear AI response cache"):
+                ai_service.clear_response_cache()
+                st.success("AI response cache cleared.")
+        else:
+            st.info("AI response caching is disabled.")
 
     st.markdown('</div>', unsafe_allow_html=True)
 
     if st.checkbox("Show AI Prompt Preview"):
-        if ai_service.openai_client or ai_service.openrouter_client or ai_service.gemini_model:
-            dummy_doc_info = {
-                'filename': 'example.pdf',
-                'download_url': 'http://example.com/example.pdf',
-                'file_format': 'PDF',
-                'file_path': '/tmp/example.pdf',
-                'discovered_by_query': 'dummy query'
-            }
-            st.json(ai_service.extract_form_data("dummy text content", dummy_doc_info))
-        else:
-            st.info("AI service not initialized to show prompt preview.")
+        # Only renders the prompts; no provider is called
+        dummy_doc_info = {
+            'filename': 'example.pdf',
+            'download_url': 'http://example.com/example.pdf',
+            'file_format': 'PDF',
+            'file_path': '/tmp/example.pdf',
+            'discovered_by_query': 'dummy query'
+        }
+        system_prompt, user_prompt = ai_service.build_extraction_prompts(
+            "dummy text content", dummy_doc_info, quiet=True, include_validation=ai_service.validation_mode == "combined"
+        )
+        st.markdown("**System prompt:**")
+        st.code(system_prompt, language="markdown")
+        st.markdown("**User prompt:**")
+        st.code(user_prompt, language="markdown")
 
     if st.button("🚀 Start Discovery", type="primary"):
         if country and visa_type:
@@ -321,10 +434,10 @@ def discovery_page(discovery, processor, ai_service, db):
 
                     if auto_process:
                         st.subheader("Step 2: Processing Documents")
-                        process_documents_improved(docs_to_process, country, visa_type, processor, ai_service, db, save_to_db, validate_with_ai)
+                        process_documents_improved(docs_to_process, country, visa_type, processor, ai_service, db, save_to_db, validate_with_ai, refresh_existing, bypass_ai_cache)
                     else:
                         if st.button("📥 Download and Process Selected Documents"):
-                            process_documents_improved(docs_to_process, country, visa_type, processor, ai_service, db, save_to_db, validate_with_ai)
+                            process_documents_improved(docs_to_process, country, visa_type, processor, ai_service, db, save_to_db, validate_with_ai, refresh_existing, bypass_ai_cache)
                 else:
                     st.warning("No documents or relevant information pages found. Try different search terms or broaden your query.")
         else:
@@ -348,7 +461,6 @@ def discovery_page(discovery, processor, ai_service, db):
                 discovered_docs_for_type = discovery.discover_documents(batch_country, vt)
                 all_discovered_docs.extend(discovered_docs_for_type)
                 st.info(f"Found {len(discovered_docs_for_type)} documents for {batch_country} - {vt}.")
-                time.sleep(1)
 
             if all_discovered_docs:
                 st.success(f"Total {len(all_discovered_docs)} unique documents/pages discovered for {batch_country}.")
@@ -360,8 +472,19 @@ def discovery_page(discovery, processor, ai_service, db):
             st.error("Please select a country for batch processing.")
 
 
-def process_documents_improved(discovered_docs, country, visa_type, processor, ai_service, db, save_to_db, validate_with_ai):
-    """Improved document processing with better error handling and progress tracking"""
+def process_documents_improved(discovered_docs, country, visa_type, processor, ai_service, db, save_to_db, validate_with_ai, refresh_existing=False,
+                               bypass_ai_cache=False):
+    """Improved document processing with better error handling and progress tracking.
+
+    Documents flow through a staged pipeline (fetch -> extract -> AI -> save), each stage
+    with its own bounded worker pool, so downloads, text extraction and LLM calls for
+    different documents overlap. Results are still reported in discovery order.
+
+    With `refresh_existing`, URLs already in the database are refetched conditionally
+    instead of skipped: unchanged ones (HTTP 304) stop after the fetch, changed ones
+    are re-processed and update their existing form. `bypass_ai_cache` forces fresh
+    AI calls instead of reusing cached responses.
+    """
 
     st.subheader("📥 Document Processing Pipeline")
 
@@ -378,131 +501,228 @@ def process_documents_improved(discovered_docs, country, visa_type, processor, a
     skipped_duplicates = []
 
     total_docs = len(discovered_docs)
+    # Tags this run's AI call metrics, so cost and latency can be reported per batch
+    ai_metric_labels = {"batch_id": f"{country} / {visa_type} @ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", "country": country}
+
+    def new_job(doc):
+        return {
+            "doc": doc,
+            "outcome": None,  # "processed", "failed" or "skipped"; set once the job leaves the pipeline early or finishes
+            "failures": [],
+            "file_info": None,
+            "extracted_text": "",
+            "low_text_chars": None,  # Set by extract_stage when the text is too short; reported by the consumer loop
+            "form_data": {
+                "country": country,
+                "visa_category": visa_type,
+                "form_name": doc.get('title', 'Unknown Form/Page'),
+                "form_id": "N/A",
+                "description": doc.get('description', ''),
+                "governing_authority": "N/A",
+                "official_source_url": doc.get('url', ''),
+                "discovered_by_query": doc.get('discovered_by_query', ''),
+                "validation_warnings": [],
+                "structured_data": {},
+                "downloaded_file_path": None,
+                "document_format": doc.get('file_type', 'UNKNOWN'),
+                "processing_status": "failed",
+                "last_fetched": datetime.now().isoformat(),
+                "lawyer_review": {}
+            }
+        }
 
-    for i, doc in enumerate(discovered_docs):
-        current_progress = (i + 1) / total_docs
+    def fail(job, error, step):
+        job["failures"].append({"doc": job["doc"], "error": error, "step": step})
+        job["outcome"] = "failed"
+        return job
 
-        with status_container:
-            st.write(f"**Processing {i+1}/{total_docs}:** {doc['title'][:80]}...")
+    def fetch_stage(job):
+        doc = job["doc"]
+        if job["outcome"]:
+            return job  # Already resolved before entering the pipeline (in-batch duplicate)
 
         is_valid_url, status_code, error_msg = processor.validate_url(doc['url'])
         if not is_valid_url:
-            st.error(f"❌ Skipping URL '{doc['url']}' due to validation error (Status: {status_code}, Error: {error_msg}).")
-            failed_docs.append({"doc": doc, "error": f"URL validation failed: {error_msg}", "step": "pre-download validation"})
-            progress_bar.progress(current_progress)
-            continue
+            job["error_detail"] = f"Status: {status_code}, Error: {error_msg}"
+            return fail(job, f"URL validation failed: {error_msg}", "pre-download validation")
 
         if save_to_db:
             existing_form = db.get_form_by_url(doc['url'])
             if existing_form:
-                st.info(f"⏩ Skipping duplicate: '{doc['title'][:50]}...' (already in database with ID: {existing_form['id']}). **Tokens saved!**")
-                skipped_duplicates.append(doc)
-                progress_bar.progress(current_progress)
-                continue
-
-        form_data_to_save = {
-            "country": country,
-            "visa_category": visa_type,
-            "form_name": doc.get('title', 'Unknown Form/Page'),
-            "form_id": "N/A",
-            "description": doc.get('description', ''),
-            "governing_authority": "N/A",
-            "official_source_url": doc.get('url', ''),
-            "discovered_by_query": doc.get('discovered_by_query', ''),
-            "validation_warnings": [],
-            "structured_data": {},
-            "downloaded_file_path": None,
-            "document_format": doc.get('file_type', 'UNKNOWN'),
-            "processing_status": "failed",
-            "last_fetched": datetime.now().isoformat(),
-            "lawyer_review": {}
-        }
-
-        try:
-            status_text.text(f"Step 1/4: Downloading document/page to local storage and Cloudinary...")
-            progress_bar.progress(current_progress * 0.25)
-
-            file_info = processor.download_document(doc['url'], country, visa_type)
-
-            if not file_info:
-                failed_docs.append({"doc": doc, "error": "Download failed or file invalid", "step": "download"})
-                continue
-
-            form_data_to_save["downloaded_file_path"] = file_info['file_path']
-            form_data_to_save["document_format"] = file_info['file_format']
-
-            status_text.text(f"Step 2/4: Extracting text...")
-            progress_bar.progress(current_progress * 0.5)
-
-            extracted_text = processor.extract_text(file_info['file_path'])
-
-            if not extracted_text or len(extracted_text.strip()) < 50:
-                st.warning(f"Low text content ({len(extracted_text.strip())} chars) for '{doc['title'][:50]}...'. Attempting AI processing anyway for summary.")
-                form_data_to_save["processing_status"] = "low_text_content"
-                form_data_to_save["validation_warnings"].append("Document had low text content, AI summary might be limited.")
-
+                job["existing_form_id"] = existing_form['id']
+                if not refresh_existing:
+                    job["outcome"] = "skipped"
+                    return job
+
+        file_info = processor.download_document(
+            doc['url'], country, visa_type,
+            lookup_content_hash=db.get_document_by_content_hash if save_to_db else None
+        )
+        if not file_info:
+            return fail(job, "Download failed or file invalid", "download")
+
+        if file_info.get("not_modified") and job.get("existing_form_id"):
+            job["unchanged"] = True
+            job["outcome"] = "skipped"
+            return job
+
+        known_document = file_info.pop("known_document", None)
+        job["file_info"] = file_info
+        job["form_data"]["downloaded_file_path"] = file_info['file_path']
+        job["form_data"]["document_format"] = file_info['file_format']
+
+        # Same bytes already extracted and validated under another URL/category: reuse that result.
+        known_form = known_document.get("form") if known_document else None
+        if validate_with_ai and known_form and known_form.get("processing_status") in ("validated", "validated_with_warnings"):
+            form_data = job["form_data"]
+            for field in ("form_name", "form_id", "description", "governing_authority", "structured_data", "validation_warnings", "processing_status"):
+                form_data[field] = known_form.get(field) or form_data[field]
+            job["reused_form_id"] = known_form["id"]
+            st.info(f"♻️ Reusing extraction of form ID {known_form['id']} for '{doc['title'][:50]}...' (identical content). **Tokens saved!**")
+        return job
+
+    def extract_stage(job):
+        if job.get("reused_form_id"):
+            return job
+        # DocumentProcessor hands the CPU-bound parsing to its process pool; this thread just waits on it.
+        file_path, content_hash = job["file_info"]['file_path'], job["file_info"].get('content_hash')
+        if validate_with_ai and config.AI_INPUT_MODE in ("budget", "representative") and ai_service.long_document_mode != "map_reduce":
+            # The model only sees ai_service.max_text_length chars; parse just enough pages for that
+            job["extracted_text"], job["extraction_info"] = processor.extract_text_for_ai(
+                file_path, ai_service.max_text_length, content_hash, representative=config.AI_INPUT_MODE == "representative"
+            )
+        else:
+            job["extracted_text"], job["extraction_info"] = processor.extract_text_with_info(file_path, content_hash)
+        extracted_text = job["extracted_text"]
+        if not extracted_text or len(extracted_text.strip()) < 50:
+            job["low_text_chars"] = len(extracted_text.strip()) if extracted_text else 0
+            job["form_data"]["processing_status"] = "low_text_content"
+            job["form_data"]["validation_warnings"].append("Document had low text content, AI summary might be limited.")
+        return job
+
+    def ai_stage(job):
+        if job.get("reused_form_id"):
+            return job
+        doc, file_info, extracted_text = job["doc"], job["file_info"], job["extracted_text"]
+        form_data_to_save = job["form_data"]
+
+        if validate_with_ai:
             doc_info_for_ai = {**doc, **file_info}
+            ai_extracted_data, validation_warnings = ai_service.extract_and_validate_form_data(extracted_text, doc_info_for_ai, bypass_cache=bypass_ai_cache,
+                                                                                               labels=ai_metric_labels)
 
-            if validate_with_ai:
-                status_text.text(f"Step 3/4: AI processing (Extraction & Validation)...")
-                progress_bar.progress(current_progress * 0.75)
-
-                ai_extracted_data = ai_service.extract_form_data(extracted_text, doc_info_for_ai)
+            if not ai_extracted_data:
+                job["failures"].append({"doc": doc, "error": "AI extraction failed or returned invalid data", "step": "ai_extraction"})
+                form_data_to_save["validation_warnings"].append("AI extraction failed or returned invalid data")
+                form_data_to_save["processing_status"] = "ai_extraction_failed"
+            else:
+                form_data_to_save["structured_data"] = ai_extracted_data
 
-                if not ai_extracted_data:
-                    failed_docs.append({"doc": doc, "error": "AI extraction failed or returned invalid data", "step": "ai_extraction"})
-                    form_data_to_save["validation_warnings"].append("AI extraction failed or returned invalid data")
-                    form_data_to_save["processing_status"] = "ai_extraction_failed"
-                else:
-                    form_data_to_save["structured_data"] = ai_extracted_data
+                form_data_to_save['country'] = ai_extracted_data.get('country', country)
+                form_data_to_save['visa_category'] = ai_extracted_data.get('visa_category', visa_type)
 
-                    form_data_to_save['country'] = ai_extracted_data.get('country', country)
-                    form_data_to_save['visa_category'] = ai_extracted_data.get('visa_category', visa_type)
+                form_data_to_save['form_name'] = ai_extracted_data.get('form_name', form_data_to_save['form_name'])
+                form_data_to_save['form_id'] = ai_extracted_data.get('form_id', form_data_to_save['form_id'])
+                form_data_to_save['description'] = ai_extracted_data.get('description', form_data_to_save['description'])
+                form_data_to_save['governing_authority'] = ai_extracted_data.get('governing_authority', form_data_to_save['governing_authority'])
 
-                    form_data_to_save['form_name'] = ai_extracted_data.get('form_name', form_data_to_save['form_name'])
-                    form_data_to_save['form_id'] = ai_extracted_data.get('form_id', form_data_to_save['form_id'])
-                    form_data_to_save['description'] = ai_extracted_data.get('description', form_data_to_save['description'])
-                    form_data_to_save['governing_authority'] = ai_extracted_data.get('governing_authority', form_data_to_save['governing_authority'])
+                form_data_to_save['validation_warnings'] = validation_warnings
+                form_data_to_save["processing_status"] = "validated" if not validation_warnings else "validated_with_warnings"
+        else:
+            form_data_to_save["validation_warnings"].append("AI processing skipped by user")
+            form_data_to_save["processing_status"] = "downloaded_only"
+            form_data_to_save["structured_data"] = {
+                "extracted_text_length": len(extracted_text),
+                "file_info": file_info,
+                "full_markdown_summary": f"Document text extracted (AI processing skipped):\n\n```\n{extracted_text[:1000]}...\n```"
+            }
+        return job
 
-                    validation_warnings = ai_service.validate_form_data(form_data_to_save["structured_data"])
-                    form_data_to_save['validation_warnings'] = validation_warnings
-                    form_data_to_save["processing_status"] = "validated" if not validation_warnings else "validated_with_warnings"
+    def save_stage(job):
+        form_data_to_save = job["form_data"]
+        if job.get("extraction_info"):
+            form_data_to_save["structured_data"] = {**(form_data_to_save["structured_data"] or {}), "text_extraction": job["extraction_info"]}
+        if save_to_db:
+            if job.get("existing_form_id"):
+                # Refreshed document whose content changed: update the form in place
+                form_id = job["existing_form_id"]
+                fields_to_update = {key: value for key, value in form_data_to_save.items() if key not in ("official_source_url", "last_fetched", "lawyer_review")}
+                if not db.update_form_fields(form_id, fields_to_update):
+                    return fail(job, "Database update failed (check logs for details)", "database")
             else:
-                form_data_to_save["validation_warnings"].append("AI processing skipped by user")
-                form_data_to_save["processing_status"] = "downloaded_only"
-                # FIX 1: Removed invalid escape sequences
-                form_data_to_save["structured_data"] = {
-                    "extracted_text_length": len(extracted_text),
-                    "file_info": file_info,
-                    "full_markdown_summary": f"Document text extracted (AI processing skipped):\n\n```\n{extracted_text[:1000]}...\n```"
-                }
-
-            if save_to_db:
-                status_text.text(f"Step 4/4: Saving to database...")
-
                 form_id = db.insert_form(form_data_to_save)
-                if form_id:
-                    form_data_to_save['id'] = form_id
-                    processed_forms.append(form_data_to_save)
-                    st.success(f"✅ Processed and Saved: {form_data_to_save.get('form_name', 'Unknown Form/Page')[:50]}...")
+                if not form_id:
+                    return fail(job, "Database save failed (check logs for details)", "database")
+            form_data_to_save['id'] = form_id
+            db.insert_document(form_id, job["file_info"])
+        job["outcome"] = "processed"
+        return job
+
+    # The same URL can be rediscovered under several visa types; process it once per batch.
+    jobs = []
+    seen_urls = set()
+    for doc in discovered_docs:
+        job = new_job(doc)
+        if doc['url'] in seen_urls:
+            job["outcome"] = "skipped"
+        seen_urls.add(doc['url'])
+        jobs.append(job)
+
+    pipeline = StagedPipeline(
+        [
+            PipelineStage("fetch", fetch_stage, workers=config.PIPELINE_FETCH_WORKERS),
+            PipelineStage("extract", extract_stage, workers=config.EXTRACTION_PROCESS_WORKERS),
+            PipelineStage("ai", ai_stage, workers=config.PIPELINE_AI_WORKERS),
+            PipelineStage("save", save_stage, workers=config.PIPELINE_SAVE_WORKERS),
+        ],
+        queue_size=config.PIPELINE_QUEUE_SIZE,
+        is_finished=lambda job: job["outcome"] is not None
+    )
 
-                    db.insert_document(form_id, file_info)
+    status_text.text(f"Processing {total_docs} documents/pages ({config.PIPELINE_FETCH_WORKERS} download, "
+                     f"{config.EXTRACTION_PROCESS_WORKERS} extraction, {config.PIPELINE_AI_WORKERS} AI workers)...")
 
-                else:
-                    failed_docs.append({"doc": doc, "error": "Database save failed (check logs for details)", "step": "database"})
-            else:
-                processed_forms.append(form_data_to_save)
-                st.success(f"✅ Processed (not saved to DB): {form_data_to_save.get('form_name', 'Unknown Form/Page')[:50]}...")
+    for i, result in enumerate(pipeline.run(jobs)):
+        job = result.item
+        doc = job["doc"]
+        form_data_to_save = job["form_data"]
 
-        except Exception as e:
-            error_msg = f"Unexpected error during processing: {str(e)}"
+        with status_container:
+            st.write(f"**Finished {i+1}/{total_docs}:** {doc['title'][:80]}...")
+
+        if result.error:
+            error_msg = f"Unexpected error during processing: {str(result.error)}"
             st.error(f"❌ Failed: {doc['title'][:50]}... - {error_msg}")
-            failed_docs.append({"doc": doc, "error": error_msg, "step": "unknown"})
+            failed_docs.append({"doc": doc, "error": error_msg, "step": result.stage or "unknown"})
 
             with st.expander(f"Debug Info for {doc['title'][:50]}..."):
-                st.code(traceback.format_exc())
+                st.code(result.traceback)
+        elif job["outcome"] == "skipped":
+            if job.get("unchanged"):
+                st.info(f"⏩ Unchanged since last fetch: '{doc['title'][:50]}...' (HTTP 304, form ID: {job['existing_form_id']}). **Tokens saved!**")
+            elif job.get("existing_form_id"):
+                st.info(f"⏩ Skipping duplicate: '{doc['title'][:50]}...' (already in database with ID: {job['existing_form_id']}). **Tokens saved!**")
+            else:
+                st.info(f"⏩ Skipping duplicate: '{doc['title'][:50]}...' (already processed earlier in this batch). **Tokens saved!**")
+            skipped_duplicates.append(doc)
+        else:
+            if job["low_text_chars"] is not None:
+                st.warning(f"Low text content ({job['low_text_chars']} chars) for '{doc['title'][:50]}...'. Attempting AI processing anyway for summary.")
+            for failure in job["failures"]:
+                if failure["step"] == "pre-download validation":
+                    st.error(f"❌ Skipping URL '{doc['url']}' due to validation error ({job.get('error_detail', '')}).")
+            failed_docs.extend(job["failures"])
+
+            if job["outcome"] == "processed":
+                processed_forms.append(form_data_to_save)
+                if save_to_db:
+                    st.success(f"✅ Processed and Saved: {form_data_to_save.get('form_name', 'Unknown Form/Page')[:50]}...")
+                else:
+                    st.success(f"✅ Processed (not saved to DB): {form_data_to_save.get('form_name', 'Unknown Form/Page')[:50]}...")
+
+        progress_bar.progress((i + 1) / total_docs)
 
-    progress_bar.progress(current_progress)
+    status_text.text(f"Processed {total_docs} documents/pages.")
 
     with results_container:
         st.subheader("📊 Processing Results")
@@ -525,6 +745,7 @@ def process_documents_improved(discovered_docs, country, visa_type, processor, a
 
         if processed_forms:
             st.subheader("✅ Successfully Processed Documents/Pages")
+            documents_by_form_id = db.get_documents_by_form_ids([form['id'] for form in processed_forms if form.get('id')])
             for form in processed_forms:
                 clean_form_name = clean_html_text(form.get('form_name', 'Unknown Form/Page'))
                 clean_form_id = clean_html_text(form.get('form_id', 'N/A'))
@@ -540,12 +761,15 @@ def process_documents_improved(discovered_docs, country, visa_type, processor, a
                     with col2:
                         st.write(f"**Processing Status:** {form.get('processing_status', 'N/A')}")
                         st.write(f"**Downloaded Path (Local):** {form.get('downloaded_file_path', 'N/A')}")
-                        document_info_from_db = db.get_document_by_form_id(form['id'])
+                        document_info_from_db = documents_by_form_id.get(form.get('id'))
                         if document_info_from_db and document_info_from_db.get('cloudinary_url'):
                             st.write(f"**Cloudinary URL:** [Link]({document_info_from_db['cloudinary_url']})")
                         else:
                             st.write(f"**Cloudinary URL:** N/A")
                         st.write(f"**Text Length:** {form.get('structured_data', {}).get('extracted_text_length', 'N/A')} chars")
+                        text_extraction = form.get('structured_data', {}).get('text_extraction')
+                        if text_extraction:
+                            st.write(f"**Text Extraction:** {text_extraction.get('engine') or 'failed'} in {text_extraction.get('seconds', 0):.2f}s")
                         st.write(f"**Fees:** {form.get('structured_data', {}).get('fees', 'N/A')}")
 
                     if form.get('validation_warnings'):
@@ -897,13 +1121,23 @@ def document_viewer_page(db, processor, ai_service):
             st.markdown("### 📝 Extracted Text Content")
             if downloaded_file_path and Path(downloaded_file_path).exists():
                 try:
-                    extracted_text = processor.extract_text(downloaded_file_path)
+                    # Stream the text: statistics are counted per chunk and only a preview is kept in memory
+                    word_count = char_count = line_count = 0
+                    preview_chunks = []
+                    preview_length = 0
+                    for chunk in processor.iter_text_chunks(downloaded_file_path, (document_info_from_db or {}).get('content_hash')):
+                        if not chunk.text:
+                            continue
+                        if char_count:
+                            char_count += 1  # Newline between chunks
+                        word_count += len(chunk.text.split())
+                        char_count += len(chunk.text)
+                        line_count += chunk.text.count('\n') + 1
+                        if preview_length < TEXT_PREVIEW_CHARS:
+                            preview_chunks.append(chunk.text[:TEXT_PREVIEW_CHARS - preview_length])
+                            preview_length += len(preview_chunks[-1])
+                    extracted_text = "\n".join(preview_chunks)
                     if extracted_text:
-                        # Text statistics
-                        word_count = len(extracted_text.split())
-                        char_count = len(extracted_text)
-                        line_count = len(extracted_text.split('\n'))
-
                         col1, col2, col3 = st.columns(3)
                         with col1:
                             st.metric("Words", f"{word_count:,}")
@@ -912,6 +1146,8 @@ def document_viewer_page(db, processor, ai_service):
                         with col3:
                             st.metric("Lines", f"{line_count:,}")
 
+                        if char_count > preview_length:
+                            st.caption(f"Showing the first {preview_length:,} of {char_count:,} characters; download the full text below.")
                         st.text_area(
                             "Full Extracted Text:",
                             value=extracted_text,
@@ -1022,16 +1258,21 @@ def document_viewer_page(db, processor, ai_service):
         with col4:
             if downloaded_file_path and Path(downloaded_file_path).exists():
                 try:
-                    extracted_text = processor.extract_text(downloaded_file_path)
-                    if extracted_text:
-                        st.download_button(
-                            "📝 Text",
-                            data=extracted_text.encode('utf-8'),
-                            file_name=f"{selected_form.get('form_id', 'text')}_extracted.txt",
-                            mime="text/plain"
-                        )
-                    else:
-                        st.info("Not available")
+                    # st.download_button keeps its data in memory, so the text is only assembled on request
+                    text_download_key = f"text_download_{selected_form['id']}"
+                    if st.button("📝 Prepare Text", key=f"{text_download_key}_prepare"):
+                        extracted_text_file = processor.open_extracted_text(downloaded_file_path, (document_info_from_db or {}).get('content_hash'))
+                        if extracted_text_file:
+                            with extracted_text_file:
+                                st.download_button(
+                                    "📝 Text",
+                                    data=extracted_text_file.read(),
+                                    file_name=f"{selected_form.get('form_id', 'text')}_extracted.txt",
+                                    mime="text/plain",
+                                    key=text_download_key
+                                )
+                        else:
+                            st.info("Not available")
                 except:
                     st.info("Not available")
             else:
@@ -1045,10 +1286,17 @@ def document_viewer_page(db, processor, ai_service):
         # Statistics Dashboard
         st.markdown("### 📊 Document Statistics")
 
+        # Fetch document info for every form in one query instead of one per form
+        documents_by_form_id = db.get_documents_by_form_ids([f['id'] for f in forms])
+
+        def form_file_format(form):
+            document_info = documents_by_form_id.get(form['id'])
+            return document_info.get('file_format') if document_info else None
+
         # Calculate statistics
         total_docs = len(forms)
-        pdf_docs = len([f for f in forms if db.get_document_by_form_id(f['id']) and db.get_document_by_form_id(f['id']).get('file_format') == 'PDF'])
-        html_docs = len([f for f in forms if db.get_document_by_form_id(f['id']) and db.get_document_by_form_id(f['id']).get('file_format') == 'HTML'])
+        pdf_docs = len([f for f in forms if form_file_format(f) == 'PDF'])
+        html_docs = len([f for f in forms if form_file_format(f) == 'HTML'])
         ai_processed = len([f for f in forms if f.get('structured_data', {}).get('full_markdown_summary')])
 
         col1, col2, col3, col4 = st.columns(4)
@@ -1097,12 +1345,7 @@ def document_viewer_page(db, processor, ai_service):
 
         with col3:
             # Get all file formats
-            all_formats = set()
-            for f in forms:
-                doc_info = db.get_document_by_form_id(f['id'])
-                if doc_info and doc_info.get('file_format'):
-                    all_formats.add(doc_info['file_format'])
-            all_formats = sorted(list(all_formats))
+            all_formats = sorted(list(set(form_file_format(f) for f in forms if form_file_format(f))))
             selected_format = st.selectbox("📄 Format:", ["All"] + all_formats)
 
         with col4:
@@ -1124,7 +1367,7 @@ def document_viewer_page(db, processor, ai_service):
             filtered_forms = [f for f in filtered_forms if f.get('visa_category') == selected_visa_category]
 
         if selected_format != "All":
-            filtered_forms = [f for f in filtered_forms if db.get_document_by_form_id(f['id']) and db.get_document_by_form_id(f['id']).get('file_format') == selected_format]
+            filtered_forms = [f for f in filtered_forms if form_file_format(f) == selected_format]
 
         if selected_status != "All":
             filtered_forms = [f for f in filtered_forms if f.get('processing_status') == selected_status]
@@ -1151,7 +1394,7 @@ def document_viewer_page(db, processor, ai_service):
                     form_idx = i + j
                     if form_idx < len(filtered_forms):
                         form = filtered_forms[form_idx]
-                        document_info = db.get_document_by_form_id(form['id'])
+                        document_info = documents_by_form_id.get(form['id'])
 
                         with col:
                             # Get status info
@@ -1220,6 +1463,58 @@ def document_viewer_page(db, processor, ai_service):
         else:
             st.info("🔍 No documents match your current filters. Try adjusting the search criteria.")
 
+def batch_reextraction_panel(db, processor, ai_service, forms):
+    """Submit stored forms for offline AI re-extraction as provider batch jobs, and poll/apply those jobs."""
+    with st.expander("🌙 Offline Batch Re-extraction"):
+        if config.AI_BATCH_PROVIDER == "fake":
+            batch_client = FakeBatchClient(config.AI_BATCH_DIR)
+        elif ai_service.openai_client:
+            batch_client = OpenAIBatchClient(ai_service.openai_client)
+        else:
+            st.info("Batch re-extraction needs an OpenAI API key (or AI_BATCH_PROVIDER = \"fake\").")
+            return
+        manager = BatchJobManager(ai_service, processor, db, batch_client, config.AI_BATCH_DIR,
+                                  max_requests_per_job=config.AI_BATCH_MAX_REQUESTS, input_mode=config.AI_INPUT_MODE)
+
+        st.caption("Batch results arrive within 24 hours at a lower price than per-document calls; poll to apply finished jobs. \"Re-extract now\" runs the selection immediately at regular prices.")
+        batch_col1, batch_col2 = st.columns(2)
+        with batch_col1:
+            batch_countries = sorted(set(form['country'] for form in forms if form.get('country')))
+            batch_country = st.selectbox("Country:", ["All"] + batch_countries, key="batch_country")
+        with batch_col2:
+            batch_statuses = sorted(set(form['processing_status'] for form in forms if form.get('processing_status')))
+            batch_status = st.selectbox("Processing status:", ["All"] + batch_statuses, key="batch_status")
+
+        batch_forms = [
+            form for form in forms
+            if (batch_country == "All" or form.get('country') == batch_country)
+            and (batch_status == "All" or form.get('processing_status') == batch_status)
+        ]
+
+        submit_col, poll_col, now_col = st.columns(3)
+        with submit_col:
+            if st.button(f"📤 Submit {len(batch_forms)} forms", disabled=not batch_forms):
+                with st.spinner("Preparing batch requests..."):
+                    job_ids = manager.submit_extraction(batch_forms)
+                st.success(f"Submitted {len(job_ids)} batch jobs.")
+        with poll_col:
+            if st.button("🔄 Poll batch jobs"):
+                with st.spinner("Checking batch jobs..."):
+                    summary = manager.poll()
+                st.info(f"Applied {summary['applied']} jobs, {summary['active']} still running, {summary['failed']} failed.")
+        with now_col:
+            if st.button(f"⚡ Re-extract {len(batch_forms)} now", disabled=not batch_forms):
+                with st.spinner(f"Re-extracting {len(batch_forms)} forms..."):
+                    updated, failed = manager.reextract_now(batch_forms)
+                st.success(f"Re-extracted {updated} forms, {failed} failed.")
+
+        batch_jobs = db.get_batch_jobs()
+        if batch_jobs:
+            st.dataframe(pd.DataFrame(batch_jobs), use_container_width=True)
+        else:
+            st.info("No batch jobs yet.")
+
+
 def validation_panel_page(db, processor, ai_service):
     st.markdown("""
     <style>
@@ -1261,6 +1556,8 @@ def validation_panel_page(db, processor, ai_service):
     if forms:
         st.success(f"✅ Found {len(forms)} documents/pages for review")
 
+        batch_reextraction_panel(db, processor, ai_service, forms)
+
         st.markdown('<div class="filter-section">', unsafe_allow_html=True)
         st.markdown("### 🔍 Filter Documents")
         review_filter = st.selectbox(
@@ -1303,6 +1600,7 @@ def validation_panel_page(db, processor, ai_service):
                 ]
 
         if filtered_forms:
+            documents_by_form_id = db.get_documents_by_form_ids([form['id'] for form in filtered_forms])
             for form in filtered_forms:
                 clean_form_name = clean_html_text(form['form_name'])
                 clean_country = clean_html_text(form['country'])
@@ -1315,7 +1613,7 @@ def validation_panel_page(db, processor, ai_service):
                         st.write(f"**Downloaded Path (Local):** {form.get('downloaded_file_path', 'N/A')}")
                         st.write(f"**Official Source URL:** {form.get('official_source_url', 'N/A')}")
 
-                        document_info_from_db = db.get_document_by_form_id(form['id'])
+                        document_info_from_db = documents_by_form_id.get(form['id'])
                         if document_info_from_db and document_info_from_db.get('cloudinary_url'):
                             st.write(f"**Cloudinary Original URL:** [Link]({document_info_from_db['cloudinary_url']})")
                         else:
@@ -1380,7 +1678,13 @@ def validation_panel_page(db, processor, ai_service):
                                     else:
                                         with st.spinner("Re-running AI processing and validation..."):
                                             try:
-                                                extracted_text = processor.extract_text(form['downloaded_file_path'])
+                                                if config.AI_INPUT_MODE in ("budget", "representative") and ai_service.long_document_mode != "map_reduce":
+                                                    extracted_text, _ = processor.extract_text_for_ai(
+                                                        form['downloaded_file_path'], ai_service.max_text_length,
+                                                        representative=config.AI_INPUT_MODE == "representative"
+                                                    )
+                                                else:
+                                                    extracted_text = processor.extract_text(form['downloaded_file_path'])
 
                                                 if not extracted_text or len(extracted_text.strip()) < 50:
                                                     st.warning("Low text content for AI re-validation. AI summary might be limited.")
@@ -1393,11 +1697,13 @@ def validation_panel_page(db, processor, ai_service):
                                                     'discovered_by_query': form['discovered_by_query']
                                                 }
 
-                                                re_extracted_data = ai_service.extract_form_data(extracted_text, doc_info_for_ai)
+                                                # An explicit re-run should not get the cached answer back
+                                                re_extracted_data, validation_warnings = ai_service.extract_and_validate_form_data(
+                                                    extracted_text, doc_info_for_ai, bypass_cache=True,
+                                                    labels={"batch_id": "Validation Panel re-run", "country": form['country']}
+                                                )
 
                                                 if re_extracted_data:
-                                                    validation_warnings = ai_service.validate_form_data(re_extracted_data)
-
                                                     new_processing_status = "validated" if not validation_warnings else "validated_with_warnings"
                                                     if not extracted_text or len(extracted_text.strip()) < 50:
                                                         new_processing_status = "low_text_content"
@@ -1922,6 +2228,7 @@ def database_viewer_page(db):
 
         st.markdown(f"### ���� Forms/Pages ({len(filtered_forms)} found)")
 
+        documents_by_form_id = db.get_documents_by_form_ids([form['id'] for form in filtered_forms])
         for form in filtered_forms:
             clean_form_name = clean_html_text(form['form_name'])
             clean_form_id = clean_html_text(form['form_id'])
@@ -1946,7 +2253,7 @@ def database_viewer_page(db):
                     source_url = form.get('official_source_url', '')
                     st.write(f"**Source:** {source_url}")
                     st.write(f"**Downloaded Path (Local):** {form.get('downloaded_file_path', 'N/A')}")
-                    document_info_from_db = db.get_document_by_form_id(form['id'])
+                    document_info_from_db = documents_by_form_id.get(form['id'])
                     if document_info_from_db and document_info_from_db.get('cloudinary_url'):
                         st.write(f"**Cloudinary Original URL:** [Link]({document_info_from_db['cloudinary_url']})")
                     else:
@@ -1995,10 +2302,11 @@ def cloudinary_browser_page(db):
     """, unsafe_allow_html=True)
 
     all_forms = db.get_forms()
+    documents_by_form_id = db.get_documents_by_form_ids([form['id'] for form in all_forms])
 
     cloudinary_docs = []
     for form in all_forms:
-        document_info = db.get_document_by_form_id(form['id'])
+        document_info = documents_by_form_id.get(form['id'])
         if document_info and document_info.get('cloudinary_url'):
             cloudinary_docs.append({
                 "form_id": form['id'],
@@ -2057,7 +2365,7 @@ def cloudinary_browser_page(db):
                     </div>
                     """, unsafe_allow_html=True)
 
-def database_health_check_page(database_url: str):
+def database_health_check_page(database_url: str, db=None, ai_service=None):
     st.markdown("""
     <style>
     .health-header {
@@ -2193,6 +2501,72 @@ DROP TABLE IF EXISTS forms CASCADE;
         st.error(f"Failed to connect to database or check schema: {e}")
         st.warning("Please check your `database_url` in `.streamlit/secrets.toml` and ensure your NeonDB project is active.")
 
+    pool_metrics = db.get_pool_metrics() if db else {}
+    if pool_metrics:
+        st.markdown("---")
+        st.subheader("🔌 Connection Pool")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Checkouts", pool_metrics['checkouts'])
+        with col2:
+            st.metric("Connections Created", pool_metrics['connections_created'])
+        with col3:
+            st.metric("In Use / Size", f"{pool_metrics['in_use']} / {pool_metrics['max_size']}")
+        with col4:
+            st.metric("Avg Wait", f"{pool_metrics['avg_wait_seconds'] * 1000:.1f} ms")
+        st.write(f"**Idle connections:** {pool_metrics['idle']} | **Max wait:** {pool_metrics['max_wait_seconds'] * 1000:.1f} ms | "
+                 f"**Discarded:** {pool_metrics['connections_discarded']} (health check failures: {pool_metrics['health_check_failures']}) | "
+                 f"**Timeouts:** {pool_metrics['timeouts']}")
+
+    scoreboard = ai_service.get_provider_scoreboard() if ai_service else []
+    st.markdown("---")
+    st.subheader("🤖 AI Provider Health")
+    if scoreboard:
+        state_labels = {"closed": "🟢 Healthy", "half_open": "🟡 Probing", "open": "🔴 Open"}
+        rows = []
+        for provider in scoreboard:
+            rows.append({
+                "Provider": provider["provider"],
+                "Circuit": state_labels.get(provider["state"], provider["state"]) + (f" (retry in {provider['retry_in_seconds']:.0f}s)" if provider["state"] == "open" else ""),
+                "Calls": provider["calls"],
+                "Success Rate": f"{provider['success_rate']:.0%}" if provider["success_rate"] is not None else "-",
+                "Skipped": provider["rejected"],
+                "p50 Latency": f"≤ {provider['p50_seconds']:g}s" if provider["p50_seconds"] is not None else "-",
+                "p95 Latency": f"≤ {provider['p95_seconds']:g}s" if provider["p95_seconds"] is not None else "-",
+                "Last Error": provider["last_error"] or "",
+                "Last Error At": datetime.fromtimestamp(provider["last_error_at"]).strftime("%Y-%m-%d %H:%M:%S") if provider["last_error_at"] else ""
+            })
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        st.caption("Statistics cover AI calls made by this server process since it started; cached responses are not counted.")
+    else:
+        st.info("No AI provider calls recorded yet.")
+
+    if db:
+        st.subheader("💰 AI Call Metrics")
+        metrics_col1, metrics_col2 = st.columns(2)
+        with metrics_col1:
+            metrics_group = st.selectbox("Group by:", ["day", "batch", "country", "provider", "task"], key="ai_metrics_group")
+        with metrics_col2:
+            metrics_days = st.slider("Last N days:", 1, 90, 30, key="ai_metrics_days")
+
+        metrics_summary = db.get_ai_call_metrics_summary(metrics_group, metrics_days, config.AI_LATENCY_SLO_SECONDS)
+        if metrics_summary:
+            summary_df = pd.DataFrame(metrics_summary)
+            total_col1, total_col2, total_col3, total_col4 = st.columns(4)
+            total_col1.metric("AI Calls", f"{int(summary_df['calls'].sum()):,}")
+            total_col2.metric("Prompt / Completion Tokens", f"{int(summary_df['prompt_tokens'].sum()):,} / {int(summary_df['completion_tokens'].sum()):,}")
+            total_col3.metric("Estimated Cost", f"${float(summary_df['cost_usd'].sum()):,.2f}")
+            total_col4.metric(f"Calls over {config.AI_LATENCY_SLO_SECONDS:g}s", f"{int(summary_df['slo_breaches'].sum()):,}")
+            st.dataframe(summary_df.rename(columns={"group_key": metrics_group}), use_container_width=True, hide_index=True)
+
+            costliest_order = st.radio("Top documents by:", ["cost", "latency"], horizontal=True, key="ai_metrics_order")
+            costliest = db.get_costliest_ai_documents(metrics_days, costliest_order)
+            if costliest:
+                st.dataframe(pd.DataFrame(costliest), use_container_width=True, hide_index=True)
+            st.caption("Costs are estimates from AI_MODEL_PRICES; batch API requests are counted at the batch discount.")
+        else:
+            st.info("No AI call metrics recorded in this period.")
+
 
 if __name__ == "__main__":
       main()
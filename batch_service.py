@@ -0,0 +1,407 @@
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import openai
+import streamlit as st
+
+from ai_service import AsyncAIExtractionService, estimate_tokens
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Provider-side states of a batch that may still change, plus our own "submitted". Our
+# "submitting" (recorded, not yet accepted by the provider), "applying" and "applied" are
+# left out, so poll() never picks a job up twice.
+ACTIVE_STATUSES = ("submitted", "validating", "in_progress", "finalizing", "cancelling")
+FINISHED_STATUSES = ("completed", "expired", "cancelled", "failed")
+LOW_TEXT_CHARS = 50
+
+
+def parse_batch_output(jsonl_text: str) -> Dict[str, Tuple[Optional[str], Optional[str], Optional[Dict[str, Any]]]]:
+    """custom_id -> (completion content, error, token usage) from an OpenAI-format batch output or error file."""
+    results = {}
+    for line in jsonl_text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        custom_id = record.get("custom_id")
+        response = record.get("response") or {}
+        if record.get("error"):
+            results[custom_id] = (None, f"Batch request error: {record['error']}", None)
+        elif response.get("status_code") != 200:
+            results[custom_id] = (None, f"API error (Status {response.get('status_code')}): {response.get('body')}", None)
+        else:
+            body = response.get("body") or {}
+            try:
+                results[custom_id] = (body["choices"][0]["message"]["content"], None, body.get("usage"))
+            except (KeyError, IndexError, TypeError):
+                results[custom_id] = (None, "Batch response has no completion content", body.get("usage"))
+    return results
+
+
+class OpenAIBatchClient:
+    """OpenAI Batch API: JSONL file upload in, JSONL output file back within the 24h completion window."""
+
+    provider = "openai"
+    model = None  # Calls are recorded under the model each request asked for
+
+    def __init__(self, client: openai.OpenAI):
+        self.client = client
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+        return batch.id
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.client.batches.retrieve(batch_id)
+        errors = getattr(batch, "errors", None)
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "error": "; ".join(error.message for error in errors.data) if errors and errors.data else None
+        }
+
+    def download(self, file_id: str) -> str:
+        return self.client.files.content(file_id).text
+
+
+class FakeBatchClient:
+    """Local stand-in for a provider batch endpoint, selected with AI_BATCH_PROVIDER = "fake"
+    to dry-run the whole batch flow from the app without API keys or cost.
+
+    Batches live as JSON files under `work_dir` (so they survive Streamlit reruns) and
+    complete on their `polls_until_complete`-th retrieve, with output in the OpenAI format.
+    `responder` maps a request body to the completion content; the default returns a
+    minimal valid extraction (or an empty warning list for validation requests).
+    """
+
+    provider = "fake"
+    model = "fake"  # Not a priced model, so dry runs add no cost to the per-model aggregates
+
+    def __init__(self, work_dir: str, polls_until_complete: int = 1, responder: Optional[Callable[[Dict[str, Any]], str]] = None):
+        self.work_dir = Path(work_dir) / "fake_batches"
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.polls_until_complete = polls_until_complete
+        self.responder = responder or self._default_response
+
+    @staticmethod
+    def _default_response(body: Dict[str, Any]) -> str:
+        system_prompt = body["messages"][0]["content"]
+        if "'validation_warnings' array" in system_prompt:
+            return json.dumps({"validation_warnings": []})
+        return json.dumps({
+            "form_name": "Fake batch extraction",
+            "full_markdown_summary": "# Fake batch extraction\n\nProduced by FakeBatchClient.",
+            "validation_warnings": []
+        })
+
+    def _state_path(self, batch_id: str) -> Path:
+        return self.work_dir / f"{batch_id}.json"
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"fake_batch_{uuid.uuid4().hex[:12]}"
+        self._state_path(batch_id).write_text(json.dumps({"input_path": input_path, "polls": 0, "output_path": None}))
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        state_path = self._state_path(batch_id)
+        state = json.loads(state_path.read_text())
+        state["polls"] += 1
+        if state["output_path"] is None and state["polls"] >= self.polls_until_complete:
+            state["output_path"] = str(self.work_dir / f"{batch_id}_output.jsonl")
+            with open(state["input_path"], encoding="utf-8") as source, open(state["output_path"], "w", encoding="utf-8") as output:
+                for line in source:
+                    if not line.strip():
+                        continue
+                    request = json.loads(line)
+                    content = self.responder(request["body"])
+                    usage = {
+                        "prompt_tokens": sum(estimate_tokens(message["content"]) for message in request["body"]["messages"]),
+                        "completion_tokens": estimate_tokens(content)
+                    }
+                    output.write(json.dumps({
+                        "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}}], "usage": usage}},
+                        "error": None
+                    }) + "\n")
+        state_path.write_text(json.dumps(state))
+        done = state["output_path"] is not None
+        return {"status": "completed" if done else "in_progress", "output_file_id": state["output_path"], "error_file_id": None, "error": None}
+
+    def download(self, file_id: str) -> str:
+        return Path(file_id).read_text(encoding="utf-8")
+
+
+class BatchJobManager:
+    """Offline (re-)extraction of stored forms through provider batch jobs.
+
+    submit_extraction writes one request per form into JSONL files of at most
+    `max_requests_per_job` lines and records each job in public.ai_batch_jobs. poll()
+    checks the active jobs and, once a job has finished, applies its results with
+    update_form_fields. With `validation_mode` "separate" the extraction results are
+    first sent out again as a validation batch, and the form is updated when that one
+    finishes. A failed request leaves its form untouched. reextract_now does the same
+    for a small selection immediately, without a batch job.
+    """
+
+    def __init__(self, ai_service: AsyncAIExtractionService, processor, db, client, work_dir: str,
+                 max_requests_per_job: int = 5000, input_mode: str = "budget"):
+        self.ai_service = ai_service
+        self.processor = processor
+        self.db = db
+        self.client = client
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.max_requests_per_job = max_requests_per_job
+        self.input_mode = input_mode  # AI_INPUT_MODE: "full", "budget" or "representative"
+
+    def _document_text(self, file_path: str) -> str:
+        if self.input_mode in ("budget", "representative"):
+            text, _ = self.processor.extract_text_for_ai(file_path, self.ai_service.max_text_length,
+                                                         representative=self.input_mode == "representative")
+            return text
+        return self.processor.extract_text(file_path)
+
+    @staticmethod
+    def _document_info(form: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'filename': Path(form['downloaded_file_path']).name,
+            'download_url': form['official_source_url'],
+            'file_format': form['document_format'],
+            'file_path': form['downloaded_file_path'],
+            'discovered_by_query': form['discovered_by_query']
+        }
+
+    def _submit(self, phase: str, lines: List[Dict[str, Any]], contexts: Dict[str, Any]) -> Optional[int]:
+        """Write one JSONL input file, record the job, then submit it. Returns the job id, or None on failure.
+
+        The job is recorded as "submitting" before the provider sees it, so a submitted
+        batch can never be lost without a trace; it only becomes "submitted" (and polled)
+        once its provider batch id is stored.
+        """
+        input_path = self.work_dir / f"{phase}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        job_id = self.db.insert_batch_job(self.client.provider, phase, None, "submitting", contexts, str(input_path))
+        if not job_id:
+            st.error(f"Not submitting {phase} batch ({len(lines)} requests): the job could not be recorded, so its results could never be applied.")
+            return None
+        try:
+            batch_id = self.client.submit(str(input_path))
+        except Exception as e:
+            self.db.update_batch_job(job_id, {"status": "failed", "error": f"Submission failed: {e}", "completed_at": datetime.now()})
+            st.error(f"Error submitting {phase} batch ({len(lines)} requests): {e}")
+            return None
+        if not self.db.update_batch_job(job_id, {"provider_batch_id": batch_id, "status": "submitted"}):
+            st.error(f"{self.client.provider} batch {batch_id} was submitted but could not be linked to batch job {job_id}; "
+                     f"its results will not be applied automatically. Set provider_batch_id = '{batch_id}', status = 'submitted' on job {job_id} to recover it.")
+            return None
+        st.success(f"Submitted {phase} batch {batch_id} with {len(lines)} requests.")
+        return job_id
+
+    def submit_extraction(self, forms: List[Dict[str, Any]]) -> List[int]:
+        """Queue extraction (and, in "combined" mode, validation) of `forms` as batch jobs. Returns the job ids."""
+        phase = "combined" if self.ai_service.validation_mode == "combined" else "extraction"
+        lines, contexts, skipped = [], {}, 0
+        for form in forms:
+            file_path = form.get('downloaded_file_path')
+            if not file_path or not os.path.exists(file_path):
+                skipped += 1
+                continue
+            try:
+                text = self._document_text(file_path)
+            except Exception as e:
+                st.warning(f"Skipping form {form['id']}: text extraction failed: {e}")
+                skipped += 1
+                continue
+            custom_id = f"form-{form['id']}"
+            line, context = self.ai_service.batch_extraction_request(custom_id, text, self._document_info(form),
+                                                                     include_validation=phase == "combined")
+            lines.append(line)
+            contexts[custom_id] = {**context, "form_id": form['id'], "low_text": len(text.strip()) < LOW_TEXT_CHARS,
+                                   "country": form.get('country'), "document_url": form.get('official_source_url')}
+        if skipped:
+            st.warning(f"{skipped} forms skipped: document file missing locally or unreadable.")
+
+        job_ids = []
+        for start in range(0, len(lines), self.max_requests_per_job):
+            chunk = lines[start:start + self.max_requests_per_job]
+            job_id = self._submit(phase, chunk, {line["custom_id"]: contexts[line["custom_id"]] for line in chunk})
+            if job_id:
+                job_ids.append(job_id)
+        return job_ids
+
+    def reextract_now(self, forms: List[Dict[str, Any]], bypass_cache: bool = True) -> Tuple[int, int]:
+        """Re-extract `forms` right away with AsyncAIExtractionService.extract_many instead of a batch job.
+
+        All forms go through one event loop with at most `max_concurrency` in flight,
+        at regular prices. Returns (forms updated, forms failed).
+        """
+        form_ids, docs, low_text = [], [], []
+        for form in forms:
+            file_path = form.get('downloaded_file_path')
+            if not file_path or not os.path.exists(file_path):
+                continue
+            try:
+                text = self._document_text(file_path)
+            except Exception as e:
+                st.warning(f"Skipping form {form['id']}: text extraction failed: {e}")
+                continue
+            form_ids.append(form['id'])
+            docs.append((text, self._document_info(form)))
+            low_text.append(len(text.strip()) < LOW_TEXT_CHARS)
+        if len(docs) < len(forms):
+            st.warning(f"{len(forms) - len(docs)} forms skipped: document file missing locally or unreadable.")
+        if not docs:
+            return 0, 0
+
+        labels = {"batch_id": f"re-extraction @ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"}
+        results = asyncio.run(self.ai_service.extract_many(docs, bypass_cache=bypass_cache, labels=labels))
+        updated, failed = 0, 0
+        for form_id, is_low_text, (extracted_data, validation_warnings) in zip(form_ids, low_text, results):
+            if extracted_data and self.db.update_form_fields(form_id, self._form_fields(extracted_data, validation_warnings, is_low_text)):
+                updated += 1
+            else:
+                failed += 1
+        return updated, failed
+
+    def _download_output(self, batch: Dict[str, Any]) -> str:
+        """The batch's error and output files as one JSONL text (output lines last, so they win in parse_batch_output)."""
+        parts = []
+        for file_id in (batch.get("error_file_id"), batch.get("output_file_id")):
+            if file_id:
+                text = self.client.download(file_id)
+                parts.append(text if not text or text.endswith("\n") else text + "\n")
+        return "".join(parts)
+
+    @staticmethod
+    def _form_fields(extracted_data: Dict[str, Any], validation_warnings: List[str], low_text: bool) -> Dict[str, Any]:
+        fields = {
+            "structured_data": extracted_data,
+            "validation_warnings": validation_warnings,
+            "processing_status": "low_text_content" if low_text else ("validated" if not validation_warnings else "validated_with_warnings")
+        }
+        for key in ("country", "visa_category", "form_name", "form_id", "description", "governing_authority"):
+            if extracted_data.get(key):
+                fields[key] = extracted_data[key]
+        return fields
+
+    def _apply(self, job: Dict[str, Any], results: Dict[str, Tuple[Optional[str], Optional[str], Optional[Dict[str, Any]]]]) -> Tuple[int, int]:
+        """Apply a finished job's results to the forms. Returns (forms updated or handed on, requests failed)."""
+        contexts = job["requests"] or {}
+        applied, failed = 0, 0
+        follow_up_lines, follow_up_contexts = [], {}
+        for custom_id, context in contexts.items():
+            response_content, error_message, token_counts = results.get(custom_id, (None, "No result in batch output", None))
+            # Jobs recorded before contexts carried the model were all sent to gpt-4o-mini
+            model = self.client.model or context.get("model") or "gpt-4o-mini"
+            self.ai_service.record_batch_call(
+                self.client.provider, model, job["phase"], "success" if response_content else "error", token_counts, error_message,
+                {"batch_id": f"ai-batch-job-{job['id']}", "country": context.get("country"), "document_url": context.get("document_url")}
+            )
+            if job["phase"] == "validation":
+                warnings = self.ai_service.parse_batch_validation(response_content, error_message)
+                fields = self._form_fields(context["extracted_data"], warnings, context["low_text"])
+            elif not response_content:
+                failed += 1
+                continue
+            elif job["phase"] == "combined":
+                extracted_data, warnings = self.ai_service.parse_batch_combined(response_content, error_message, context)
+                if not extracted_data:
+                    failed += 1
+                    continue
+                fields = self._form_fields(extracted_data, warnings, context["low_text"])
+            else:
+                extracted_data = self.ai_service.parse_batch_extraction(response_content, error_message, context)
+                if not extracted_data:
+                    failed += 1
+                    continue
+                follow_up_line = self.ai_service.batch_validation_request(custom_id, extracted_data)
+                follow_up_lines.append(follow_up_line)
+                follow_up_contexts[custom_id] = {"form_id": context["form_id"], "low_text": context["low_text"], "extracted_data": extracted_data,
+                                                 "model": follow_up_line["body"]["model"],
+                                                 "country": extracted_data.get("country") or context.get("country"),
+                                                 "document_url": context.get("document_url")}
+                applied += 1
+                continue
+            if self.db.update_form_fields(context["form_id"], fields):
+                applied += 1
+            else:
+                failed += 1
+
+        if follow_up_lines and not self._submit("validation", follow_up_lines, follow_up_contexts):
+            # Keep the extraction rather than lose it; validation can be re-run from the panel
+            for custom_id, context in follow_up_contexts.items():
+                warnings = ["AI validation skipped: validation batch could not be submitted"]
+                if not self.db.update_form_fields(context["form_id"], self._form_fields(context["extracted_data"], warnings, context["low_text"])):
+                    applied -= 1
+                    failed += 1
+        return applied, failed
+
+    def poll(self) -> Dict[str, int]:
+        """Refresh every active job and apply the finished ones. Returns counts of jobs still active, applied and failed."""
+        summary = {"active": 0, "applied": 0, "failed": 0}
+        for job in self.db.get_batch_jobs(statuses=list(ACTIVE_STATUSES), include_requests=True, limit=1000):
+            try:
+                batch = self.client.retrieve(job["provider_batch_id"])
+            except Exception as e:
+                st.warning(f"Could not check batch job {job['id']}: {e}")
+                summary["active"] += 1
+                continue
+
+            status = batch["status"]
+            if status not in FINISHED_STATUSES:
+                if status != job["status"]:
+                    self.db.update_batch_job(job["id"], {"status": status})
+                summary["active"] += 1
+                continue
+
+            try:
+                output_jsonl = self._download_output(batch)
+            except Exception as e:
+                st.error(f"Could not download results of batch job {job['id']}: {e}")
+                summary["active"] += 1
+                continue
+            results = parse_batch_output(output_jsonl)
+            if not results:
+                self.db.update_batch_job(job["id"], {"status": "failed", "error": batch.get("error") or f"Batch {status} without results",
+                                                     "completed_at": datetime.now()})
+                summary["failed"] += 1
+                continue
+
+            # Claim the job first: another session polling at the same time skips it
+            if not self.db.update_batch_job(job["id"], {"status": "applying"}, expected_status=job["status"]):
+                continue
+            output_path = self.work_dir / f"job-{job['id']}-output.jsonl"
+            try:
+                output_path.write_text(output_jsonl, encoding="utf-8")
+                applied, failed = self._apply(job, results)
+            except Exception as e:
+                # Some forms may already be updated; the kept output lets the job be inspected or re-applied by hand
+                self.db.update_batch_job(job["id"], {"status": "failed", "output_file_path": str(output_path),
+                                                     "error": f"Applying results failed: {e}", "completed_at": datetime.now()})
+                self.ai_service.flush_call_metrics()
+                st.error(f"Could not apply results of batch job {job['id']}: {e}")
+                summary["failed"] += 1
+                continue
+            self.db.update_batch_job(job["id"], {
+                "status": "applied",
+                "output_file_path": str(output_path),
+                "error": f"{failed} of {job['request_count']} requests failed ({status})" if failed or status != "completed" else None,
+                "completed_at": datetime.now()
+            })
+            self.ai_service.flush_call_metrics()
+            st.success(f"Batch job {job['id']} ({job['phase']}): {applied} forms updated, {failed} failed.")
+            summary["applied"] += 1
+        return summary
@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class TTLCache:
+    """Thread-safe key/value cache with per-entry expiry, optionally persisted to SQLite.
+
+    Entries live in memory for fast lookups. When `sqlite_path` is set they are also
+    written to a local SQLite file (zlib-compressed JSON), so later runs and other
+    Streamlit sessions can reuse them. Several caches can share one file; each keeps
+    its rows under its own `namespace`. With `max_entries`, the oldest entries are
+    evicted once the namespace grows past that size.
+
+    With SQLite the in-memory copy is only a small LRU: the `memory_entries` most
+    recently used entries, leaving out values over `max_memory_value_bytes` of JSON
+    (such as long extracted texts), which are read from the file each time.
+    """
+
+    def __init__(self, namespace: str, default_ttl: Optional[float] = 3600, sqlite_path: Optional[str] = None,
+                 max_entries: Optional[int] = None, memory_entries: int = 256, max_memory_value_bytes: int = 256 * 1024):
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.sqlite_path = sqlite_path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.max_memory_value_bytes = max_memory_value_bytes
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()  # key -> (value, expires_at or None), least recently used first
+        self._lock = threading.Lock()
+        self._db = None
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        if sqlite_path:
+            directory = os.path.dirname(sqlite_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    expires_at REAL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._db.commit()
+
+    @staticmethod
+    def _is_expired(expires_at: Optional[float]) -> bool:
+        return expires_at is not None and expires_at <= time.time()
+
+    def _remember_locked(self, key: str, entry: Tuple[Any, Optional[float]], size: int = 0):
+        """Keep `entry` in memory; with SQLite only if it is small, and only the most recent `memory_entries`."""
+        self._memory.pop(key, None)
+        if self._db is None:
+            self._memory[key] = entry
+            return
+        if size > self.max_memory_value_bytes:
+            return
+        self._memory[key] = entry
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._db is not None:
+                self._memory.move_to_end(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                ).fetchone()
+                if row:
+                    serialized = zlib.decompress(row[0])
+                    entry = (json.loads(serialized), row[1])
+                    self._remember_locked(key, entry, len(serialized))
+            if entry is None or self._is_expired(entry[1]):
+                if entry is not None:
+                    self._delete_locked(key)
+                self._stats["misses"] += 1
+                return default
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store `value` (JSON-serializable) for `ttl` seconds; the cache default applies when ttl is None."""
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        serialized = json.dumps(value).encode("utf-8") if self._db is not None else b""
+        with self._lock:
+            self._remember_locked(key, (value, expires_at), len(serialized))
+            self._stats["writes"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, zlib.compress(serialized), expires_at, time.time())
+                )
+                self._db.commit()
+            if self.max_entries is not None:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        """Drop the oldest entries beyond `max_entries`."""
+        if self._db is not None:
+            evicted = [row[0] for row in self._db.execute(
+                "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?",
+                (self.namespace, self.max_entries)
+            ).fetchall()]
+            if evicted:
+                self._db.executemany("DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                                     [(self.namespace, key) for key in evicted])
+                self._db.commit()
+            for key in evicted:
+                self._memory.pop(key, None)
+        else:
+            evicted = list(self._memory)[:max(0, len(self._memory) - self.max_entries)]
+            for key in evicted:
+                del self._memory[key]
+        self._stats["evictions"] += len(evicted)
+
+    def _delete_locked(self, key: str):
+        self._memory.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._db.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._delete_locked(key)
+
+    def clear(self):
+        """Drop every entry in this namespace."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            if self._db is not None:
+                stats["entries"] = self._db.execute(
+                    "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+                ).fetchone()[0]
+            else:
+                stats["entries"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_caches: Dict[str, TTLCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(namespace: str, default_ttl: Optional[float] = 3600, sqlite_path: Optional[str] = None,
+              max_entries: Optional[int] = None) -> TTLCache:
+    """Return the process-wide cache for `namespace`, creating it on first use.
+
+    Services are rebuilt on every Streamlit rerun, so caches are kept here to outlive them.
+    """
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        if cache is None or cache.sqlite_path != sqlite_path:
+            cache = TTLCache(namespace, default_ttl=default_ttl, sqlite_path=sqlite_path, max_entries=max_entries)
+            _caches[namespace] = cache
+        cache.default_ttl = default_ttl
+        cache.max_entries = max_entries
+        return cache
@@ -20,6 +20,87 @@ class Config:
     # Processing
     MAX_FILE_SIZE_MB: int = 50
     SUPPORTED_FORMATS: list = None
+
+    # Shared HTTP client (HEAD checks, downloads, Tavily)
+    HTTP_POOL_SIZE_PER_HOST: int = 8
+    HTTP_HOST_POOL_SIZES: dict = None  # e.g. {"uscis.gov": 16}; a domain also covers its subdomains
+    HTTP_HOST_TIMEOUTS: dict = None  # e.g. {"gov.br": 60}; overrides the per-call timeout for slow hosts
+    HTTP_MAX_RETRIES: int = 3  # Retries for 429/5xx responses and connection errors
+    HTTP_BACKOFF_BASE_SECONDS: float = 0.5
+    HTTP_BACKOFF_MAX_SECONDS: float = 30.0
+
+    # Database connection pool
+    DB_POOL_SIZE: int = 5
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_HEALTH_CHECK_SECONDS: float = 60.0
+
+    # Tavily discovery (concurrent searches share one rate limit per API key)
+    TAVILY_MAX_CONCURRENT_SEARCHES: int = 8
+    TAVILY_REQUESTS_PER_MINUTE: float = 100
+    TAVILY_BURST: int = 20
+    TAVILY_CACHE_TTL_SECONDS: float = 7 * 24 * 3600
+    TAVILY_OFFLINE_MODE: bool = False  # Serve discovery only from the search cache (tests, demos, no network)
+
+    # URL validation (HEAD requests)
+    URL_VALIDATION_WORKERS: int = 16
+    URL_VALIDATION_PER_HOST: int = 4
+    URL_VALIDATION_HOST_TIMEOUT_LIMIT: int = 2  # Timeouts before a host's remaining URLs are skipped
+    URL_VALIDATION_CACHE_TTL_SECONDS: float = 6 * 3600
+    URL_VALIDATION_NEGATIVE_TTL_SECONDS: float = 3600  # How long 4xx responses are remembered
+
+    # Local cache file shared by the persistent caches; set to "" to keep caches in memory only
+    CACHE_SQLITE_PATH: str = ".cache/immigration_cache.sqlite3"
+    FETCH_VALIDATOR_TTL_SECONDS: float = 90 * 24 * 3600  # How long ETag/Last-Modified of downloads are kept
+
+    # Document processing pipeline (worker counts per stage)
+    PIPELINE_FETCH_WORKERS: int = 4
+    PIPELINE_AI_WORKERS: int = 3
+    PIPELINE_SAVE_WORKERS: int = 2
+    PIPELINE_QUEUE_SIZE: int = 2  # Max documents waiting between stages (backpressure)
+    EXTRACTION_PROCESS_WORKERS: int = max(1, min(4, (os.cpu_count() or 2) - 1))
+    PDF_MIN_PAGES_PER_TASK: int = 8  # PDFs are split into page ranges of at least this size, one per extraction worker
+    EXTRACTED_TEXT_CACHE_TTL_SECONDS: float = 30 * 24 * 3600  # Texts are keyed by content hash, so this only bounds disk use
+    PDF_EXTRACTION_STRATEGY: str = "fast"  # "fast": PyMuPDF, pdfplumber only for poor pages; "accurate": pdfplumber first
+    # Text extracted for AI prompts: "full" document, "budget" (first pages up to AI_MAX_TEXT_LENGTH)
+    # or "representative" (first pages plus fee/checklist pages); the full text is extracted in the background
+    AI_INPUT_MODE: str = "budget"
+    AI_MAX_TEXT_LENGTH: int = 6000
+    AI_MAX_PROMPT_TOKENS: int = 3000  # Estimated system + user prompt tokens per single-call extraction; 0 for no cap
+    # Documents longer than AI_MAX_TEXT_LENGTH: "truncate", or "map_reduce" (concurrent per-chunk extraction, merged)
+    AI_LONG_DOCUMENT_MODE: str = "truncate"
+    AI_MAP_CHUNK_TOKENS: int = 3000
+    AI_MAP_MAX_CHUNKS: int = 12  # Caps the calls (and cost) per document
+    AI_MAP_WORKERS: int = 4
+    # LLM responses keyed by provider/model/prompts/params, in the CACHE_SQLITE_PATH store
+    AI_RESPONSE_CACHE_ENABLED: bool = True
+    AI_RESPONSE_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    AI_RESPONSE_CACHE_MAX_ENTRIES: int = 5000
+    # Hedged requests: start the next provider once the current one exceeds its latency percentile
+    AI_HEDGED_REQUESTS: bool = False
+    AI_HEDGE_PERCENTILE: float = 0.9
+    AI_HEDGE_DEFAULT_DELAY_SECONDS: float = 15.0  # Until a provider has enough latency samples
+    AI_HEDGE_MIN_DELAY_SECONDS: float = 1.0
+    # Per-provider circuit breaker: open at this failure rate over the last calls, retry after the cooldown
+    AI_BREAKER_WINDOW: int = 20
+    AI_BREAKER_MIN_CALLS: int = 5
+    AI_BREAKER_FAILURE_RATE: float = 0.5
+    AI_BREAKER_COOLDOWN_SECONDS: float = 60.0
+    # "separate": extraction call + validation call per document; "combined": one call returns both
+    AI_VALIDATION_MODE: str = "separate"
+    # Rule-based pre-extraction (form ID, country, authority, edition date, fees, language) before the LLM
+    AI_RULE_PREEXTRACTION: bool = True
+    AI_RULE_MIN_CONFIDENCE: float = 0.8  # Rule fields at or above this are not asked of the model
+    # Requests/tokens per minute per AI provider (match your account tier); shared by all AI calls in the process
+    AI_PROVIDER_LIMITS: dict = None
+    AI_ASYNC_MAX_CONCURRENCY: int = 32  # Documents in flight in AsyncAIExtractionService.extract_many
+    # Offline batch re-extraction (batch_service.py): "openai" Batch API, or "fake" for a local endpoint that costs nothing
+    AI_BATCH_PROVIDER: str = "openai"
+    AI_BATCH_MAX_REQUESTS: int = 5000  # Requests per batch job (JSONL input file)
+    AI_BATCH_DIR: str = "output/ai_batches"
+    # Per-call token/latency/cost records in public.ai_call_metrics (ai_metrics.py)
+    AI_CALL_METRICS_ENABLED: bool = True
+    AI_MODEL_PRICES: dict = None  # {model: {"input", "cached_input", "output"}} USD per 1M tokens; None uses ai_metrics.DEFAULT_MODEL_PRICES
+    AI_LATENCY_SLO_SECONDS: float = 30.0  # Calls slower than this count as SLO breaches on the health page
     
     def __post_init__(self):
         # Attempt to load from Streamlit secrets first (for deployed apps)
@@ -30,9 +111,20 @@ class Config:
         self.GEMINI_API_KEY = st.secrets.get("gemini_api_key", os.getenv("GEMINI_API_KEY", ""))
         self.DATABASE_URL = st.secrets.get("database_url", os.getenv("DATABASE_URL", ""))
         self.CLOUDINARY_URL = st.secrets.get("cloudinary_url", os.getenv("CLOUDINARY_URL", "")) # NEW: Load Cloudinary URL
+        self.TAVILY_OFFLINE_MODE = str(st.secrets.get("tavily_offline_mode", os.getenv("TAVILY_OFFLINE_MODE", self.TAVILY_OFFLINE_MODE))).lower() in ("1", "true", "yes")
         
         if self.SUPPORTED_FORMATS is None:
             self.SUPPORTED_FORMATS = ['.pdf', '.docx', '.xlsx', '.doc', '.xls', '.html', '.htm']
+        if self.HTTP_HOST_POOL_SIZES is None:
+            self.HTTP_HOST_POOL_SIZES = {"uscis.gov": 16, "canada.ca": 16}
+        if self.HTTP_HOST_TIMEOUTS is None:
+            self.HTTP_HOST_TIMEOUTS = {}
+        if self.AI_PROVIDER_LIMITS is None:
+            self.AI_PROVIDER_LIMITS = {
+                "openai": {"rpm": 500, "tpm": 200000},
+                "openrouter": {"rpm": 200, "tpm": 200000},
+                "gemini": {"rpm": 1000, "tpm": 1000000}
+            }
         
         # Create directories
         os.makedirs(self.DOWNLOADS_DIR, exist_ok=True)
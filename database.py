@@ -1,22 +1,188 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor, Json
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor, Json, execute_values
 import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 import streamlit as st
 import uuid # For generating unique export IDs
 
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within the pool timeout."""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections with health checks and usage metrics."""
+
+    def __init__(self, database_url: str, max_size: int = 5, timeout: float = 30.0, health_check_interval: float = 60.0):
+        self.database_url = database_url
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = deque()  # (connection, returned_at) pairs, most recently returned last
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._metrics = {
+            "checkouts": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "health_check_failures": 0,
+            "timeouts": 0,
+            "in_use": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(self.database_url, cursor_factory=RealDictCursor)
+        with self._lock:
+            self._metrics["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn, health_check_failed: bool = False):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._metrics["connections_discarded"] += 1
+            if health_check_failed:
+                self._metrics["health_check_failures"] += 1
+
+    def _is_healthy(self, conn, idle_seconds: float) -> bool:
+        """Cheap checks on every checkout; a round-trip ping only for connections idle past the interval."""
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if idle_seconds < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check out a connection, waiting up to `timeout` seconds for a free slot."""
+        if self._closed:
+            raise PoolTimeoutError("Connection pool is closed.")
+
+        wait_started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._metrics["timeouts"] += 1
+            raise PoolTimeoutError(f"No database connection available after {self.timeout:.1f}s (pool size {self.max_size}).")
+        waited = time.monotonic() - wait_started
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn = self._connect()
+                    break
+                candidate, returned_at = entry
+                if self._is_healthy(candidate, time.monotonic() - returned_at):
+                    conn = candidate
+                else:
+                    self._discard(candidate, health_check_failed=True)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._metrics["checkouts"] += 1
+            self._metrics["in_use"] += 1
+            self._metrics["total_wait_seconds"] += waited
+            self._metrics["max_wait_seconds"] = max(self._metrics["max_wait_seconds"], waited)
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        """Return a connection to the pool, closing it instead if it is broken or the pool is closed."""
+        try:
+            if not discard and not conn.closed:
+                try:
+                    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+            if discard or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self._metrics["in_use"] -= 1
+            self._slots.release()
+
+    def closeall(self):
+        """Close every idle connection; checked-out connections are closed when returned."""
+        self._closed = True
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["idle"] = len(self._idle)
+        metrics["max_size"] = self.max_size
+        metrics["avg_wait_seconds"] = metrics["total_wait_seconds"] / metrics["checkouts"] if metrics["checkouts"] else 0.0
+        return metrics
+
+
 class DatabaseManager:
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, pool_size: int = 5, pool_timeout: float = 30.0, health_check_interval: float = 60.0):
         self.database_url = database_url
+        self.pool = None
         if not self.database_url:
             st.warning("Database URL not configured. Database operations will be skipped.")
+        else:
+            self.pool = ConnectionPool(self.database_url, max_size=pool_size, timeout=pool_timeout, health_check_interval=health_check_interval)
         self.init_tables()
     
+    @contextmanager
     def get_connection(self):
+        """Check out a pooled connection for one transaction.
+
+        Commits when the block succeeds, rolls back when it raises, and always
+        returns the connection to the pool (closing it if it was broken).
+        """
         if not self.database_url:
             raise Exception("Database URL is not configured.")
-        return psycopg2.connect(self.database_url, cursor_factory=RealDictCursor)
+        conn = self.pool.getconn()
+        discard = False
+        try:
+            with conn:
+                yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.pool.putconn(conn, discard=discard)
+
+    def close(self):
+        """Close the pool's connections; the manager cannot be used afterwards."""
+        if self.pool:
+            self.pool.closeall()
+
+    def get_pool_metrics(self) -> Dict[str, Any]:
+        """Return connection pool counters (checkouts, wait time, connections created, ...)."""
+        if not self.pool:
+            return {}
+        return self.pool.get_metrics()
     
     def init_tables(self):
         """Initialize database tables"""
@@ -61,9 +227,12 @@ class DatabaseManager:
                             mime_type VARCHAR(100),
                             download_url TEXT,
                             cloudinary_url TEXT,
+                            content_hash VARCHAR(64),
                             downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                         )
                     """)
+                    # Databases created before content hashing was added
+                    cur.execute("ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
                     
                     # Sources table
                     cur.execute("""
@@ -91,14 +260,60 @@ class DatabaseManager:
                         )
                     """)
                     
+                    # Provider batch jobs for offline AI re-extraction (see batch_service.py)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS public.ai_batch_jobs (
+                            id SERIAL PRIMARY KEY,
+                            provider VARCHAR(50) NOT NULL,
+                            phase VARCHAR(20) NOT NULL,
+                            provider_batch_id VARCHAR(200),
+                            status VARCHAR(30) NOT NULL,
+                            request_count INTEGER,
+                            requests JSONB,
+                            input_file_path TEXT,
+                            output_file_path TEXT,
+                            error TEXT,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            completed_at TIMESTAMP
+                        )
+                    """)
+
+                    # One row per AI provider call, for token/cost/latency reporting (see ai_metrics.py)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS public.ai_call_metrics (
+                            id BIGSERIAL PRIMARY KEY,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            batch_id VARCHAR(200),
+                            country VARCHAR(100),
+                            document_url TEXT,
+                            task VARCHAR(50),
+                            provider VARCHAR(50) NOT NULL,
+                            model VARCHAR(100),
+                            outcome VARCHAR(20) NOT NULL,
+                            prompt_tokens INTEGER DEFAULT 0,
+                            cached_prompt_tokens INTEGER DEFAULT 0,
+                            completion_tokens INTEGER DEFAULT 0,
+                            latency_seconds REAL,
+                            retries INTEGER DEFAULT 0,
+                            cache_hit BOOLEAN DEFAULT FALSE,
+                            error TEXT,
+                            cost_usd NUMERIC(12, 6) DEFAULT 0
+                        )
+                    """)
+
                     # Create indexes
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_forms_country ON public.forms(country)")
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_forms_visa_category ON public.forms(visa_category)")
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_forms_form_name ON public.forms(form_name)")
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_form_id ON public.documents(form_id)")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON public.documents(content_hash)")
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_sources_domain ON public.sources(domain)")
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_forms_processing_status ON public.forms(processing_status)")
                     cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_forms_official_source_url ON public.forms(official_source_url)")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_ai_batch_jobs_status ON public.ai_batch_jobs(status)")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_ai_call_metrics_created_at ON public.ai_call_metrics(created_at)")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_ai_call_metrics_batch_id ON public.ai_call_metrics(batch_id)")
                     
                     # Create JSONB indexes
                     cur.execute("CREATE INDEX IF NOT EXISTS idx_forms_structured_data ON public.forms USING GIN(structured_data)")
@@ -183,8 +398,8 @@ class DatabaseManager:
                 with conn.cursor() as cur:
                     cur.execute("""
                         INSERT INTO public.documents (
-                            form_id, filename, file_path, file_format, file_size_bytes, mime_type, download_url, cloudinary_url, downloaded_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                            form_id, filename, file_path, file_format, file_size_bytes, mime_type, download_url, cloudinary_url, content_hash, downloaded_at
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                         RETURNING id
                     """, (
                         form_id,
@@ -195,6 +410,7 @@ class DatabaseManager:
                         file_info.get('mime_type'),
                         file_info.get('download_url'),
                         file_info.get('cloudinary_url'),
+                        file_info.get('content_hash'),
                         datetime.now()
                     ))
                     inserted_id = cur.fetchone()['id']
@@ -246,18 +462,64 @@ class DatabaseManager:
             return None
     
     def get_document_by_form_id(self, form_id: int) -> Optional[Dict]:
-        """Retrieve document info by form ID."""
+        """Retrieve the latest document info by form ID."""
         if not self.database_url:
             return None
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("SELECT * FROM public.documents WHERE form_id = %s", (form_id,))
+                    cur.execute("SELECT * FROM public.documents WHERE form_id = %s ORDER BY id DESC LIMIT 1", (form_id,))
                     return cur.fetchone()
         except Exception as e:
             st.error(f"Error retrieving document by form ID: {e}")
             return None
 
+    def get_document_by_content_hash(self, content_hash: str) -> Optional[Dict]:
+        """Retrieve the document stored with these exact bytes, with its form under the "form" key.
+
+        Prefers a document whose form passed AI validation, then the earliest one.
+        """
+        if not self.database_url or not content_hash:
+            return None
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT d.*, row_to_json(f) AS form
+                        FROM public.documents d
+                        JOIN public.forms f ON f.id = d.form_id
+                        WHERE d.content_hash = %s
+                        ORDER BY (f.processing_status IN ('validated', 'validated_with_warnings')) DESC, d.id
+                        LIMIT 1
+                    """, (content_hash,))
+                    return cur.fetchone()
+        except Exception as e:
+            st.error(f"Error retrieving document by content hash: {e}")
+            return None
+
+    def get_documents_by_form_ids(self, form_ids: List[int]) -> Dict[int, Dict]:
+        """Retrieve document info for many forms in one query, keyed by form ID.
+
+        Mirrors get_document_by_form_id: forms without a document are absent
+        from the result, and when a form has several documents (a refetched file
+        that changed) the latest one wins.
+        """
+        if not self.database_url or not form_ids:
+            return {}
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT DISTINCT ON (form_id) *
+                        FROM public.documents
+                        WHERE form_id = ANY(%s)
+                        ORDER BY form_id, id DESC
+                    """, (list(form_ids),))
+                    return {row['form_id']: row for row in cur.fetchall()}
+        except Exception as e:
+            st.error(f"Error retrieving documents for {len(form_ids)} forms: {e}")
+            return {}
+
     def update_lawyer_review(self, form_id: int, review_data: Dict[str, Any]) -> bool:
         """Update lawyer review for a form"""
         if not self.database_url:
@@ -357,3 +619,150 @@ class DatabaseManager:
         except Exception as e:
             st.error(f"Error inserting export log: {e}")
             return None
+
+    def insert_batch_job(self, provider: str, phase: str, provider_batch_id: Optional[str], status: str,
+                         requests: Dict[str, Any], input_file_path: str) -> Optional[int]:
+        """Record a provider batch job; `requests` maps each custom_id to what is needed to apply its result."""
+        if not self.database_url:
+            return None
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO public.ai_batch_jobs (provider, phase, provider_batch_id, status, request_count, requests, input_file_path)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id
+                    """, (provider, phase, provider_batch_id, status, len(requests), Json(requests), input_file_path))
+                    inserted_id = cur.fetchone()['id']
+                    conn.commit()
+                    return inserted_id
+        except Exception as e:
+            st.error(f"Error inserting batch job: {e}")
+            return None
+
+    def update_batch_job(self, job_id: int, fields_to_update: Dict[str, Any], expected_status: Optional[str] = None) -> bool:
+        """Update specific fields of a batch job record; with `expected_status`, only if the job is still in that status."""
+        if not self.database_url:
+            return False
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    set_clauses = [f"{key} = %s" for key in fields_to_update]
+                    params = [Json(value) if isinstance(value, (dict, list)) else value for value in fields_to_update.values()]
+                    set_clauses.append("updated_at = CURRENT_TIMESTAMP")
+                    params.append(job_id)
+                    query = f"UPDATE public.ai_batch_jobs SET {', '.join(set_clauses)} WHERE id = %s"
+                    if expected_status is not None:
+                        query += " AND status = %s"
+                        params.append(expected_status)
+                    cur.execute(query, params)
+                    conn.commit()
+                    return cur.rowcount > 0
+        except Exception as e:
+            st.error(f"Error updating batch job {job_id}: {e}")
+            return False
+
+    def get_batch_jobs(self, statuses: Optional[List[str]] = None, include_requests: bool = False, limit: int = 100) -> List[Dict]:
+        """Most recent batch jobs, optionally only those in `statuses`. The bulky `requests` column is left out unless asked for."""
+        if not self.database_url:
+            return []
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    columns = "*" if include_requests else (
+                        "id, provider, phase, provider_batch_id, status, request_count, input_file_path, "
+                        "output_file_path, error, created_at, updated_at, completed_at"
+                    )
+                    query = f"SELECT {columns} FROM public.ai_batch_jobs"
+                    params = []
+                    if statuses:
+                        query += " WHERE status = ANY(%s)"
+                        params.append(list(statuses))
+                    query += " ORDER BY id DESC LIMIT %s"
+                    params.append(limit)
+                    cur.execute(query, params)
+                    return cur.fetchall()
+        except Exception as e:
+            st.error(f"Error retrieving batch jobs: {e}")
+            return []
+
+    AI_CALL_METRIC_COLUMNS = ("created_at", "batch_id", "country", "document_url", "task", "provider", "model", "outcome",
+                              "prompt_tokens", "cached_prompt_tokens", "completion_tokens", "latency_seconds", "retries",
+                              "cache_hit", "error", "cost_usd")
+    # Grouping expressions for get_ai_call_metrics_summary
+    AI_CALL_METRIC_GROUPS = {"batch": "batch_id", "country": "country", "day": "DATE(created_at)", "provider": "provider", "task": "task"}
+
+    def insert_ai_call_metrics(self, records: List[Dict[str, Any]]) -> int:
+        """Bulk-insert AI call records (dicts keyed by AI_CALL_METRIC_COLUMNS). Returns the number written."""
+        if not self.database_url or not records:
+            return 0
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    execute_values(
+                        cur,
+                        f"INSERT INTO public.ai_call_metrics ({', '.join(self.AI_CALL_METRIC_COLUMNS)}) VALUES %s",
+                        [tuple(record.get(column) for column in self.AI_CALL_METRIC_COLUMNS) for record in records]
+                    )
+                    conn.commit()
+                    return len(records)
+        except Exception as e:
+            st.error(f"Error inserting AI call metrics: {e}")
+            return 0
+
+    def get_ai_call_metrics_summary(self, group_by: str = "day", days: int = 30, latency_slo_seconds: float = 30.0) -> List[Dict]:
+        """Calls, tokens, cost and latency of the last `days` days, per batch, country, day, provider or task."""
+        if not self.database_url:
+            return []
+        group_expression = self.AI_CALL_METRIC_GROUPS.get(group_by)
+        if group_expression is None:
+            st.error(f"Unknown AI metrics grouping: {group_by}")
+            return []
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT {group_expression} AS group_key,
+                               COUNT(*) AS calls,
+                               SUM(prompt_tokens) AS prompt_tokens,
+                               SUM(cached_prompt_tokens) AS cached_prompt_tokens,
+                               SUM(completion_tokens) AS completion_tokens,
+                               SUM(cost_usd) AS cost_usd,
+                               AVG(latency_seconds) AS avg_latency_seconds,
+                               percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_seconds) AS p95_latency_seconds,
+                               COUNT(*) FILTER (WHERE latency_seconds > %s) AS slo_breaches,
+                               AVG(retries) AS avg_retries,
+                               AVG(CASE WHEN cache_hit THEN 1 ELSE 0 END) AS cache_hit_rate,
+                               AVG(CASE WHEN outcome = 'error' THEN 1 ELSE 0 END) AS error_rate
+                        FROM public.ai_call_metrics
+                        WHERE created_at >= NOW() - %s * INTERVAL '1 day'
+                        GROUP BY 1
+                        ORDER BY {"1 DESC" if group_by == "day" else "cost_usd DESC"}
+                    """, (latency_slo_seconds, days))
+                    return cur.fetchall()
+        except Exception as e:
+            st.error(f"Error retrieving AI call metrics: {e}")
+            return []
+
+    def get_costliest_ai_documents(self, days: int = 30, order_by: str = "cost", limit: int = 20) -> List[Dict]:
+        """Documents with the highest AI cost (or total latency with order_by="latency") over the last `days` days."""
+        if not self.database_url:
+            return []
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT document_url, MAX(country) AS country, COUNT(*) AS calls,
+                               SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens,
+                               SUM(cost_usd) AS cost_usd, SUM(latency_seconds) AS total_latency_seconds,
+                               MAX(latency_seconds) AS max_latency_seconds, SUM(retries) AS retries
+                        FROM public.ai_call_metrics
+                        WHERE created_at >= NOW() - %s * INTERVAL '1 day' AND document_url IS NOT NULL
+                        GROUP BY document_url
+                        ORDER BY {"total_latency_seconds" if order_by == "latency" else "cost_usd"} DESC NULLS LAST
+                        LIMIT %s
+                    """, (days, limit))
+                    return cur.fetchall()
+        except Exception as e:
+            st.error(f"Error retrieving costliest AI documents: {e}")
+            return []
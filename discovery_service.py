@@ -1,11 +1,16 @@
-import requests
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 import streamlit as st
 from urllib.parse import urlparse
 import os
-import time
+import hashlib
+import json
+from typing import Optional
 from document_processor import DocumentProcessor
 from database import DatabaseManager
+from pipeline import context_thread_pool
+from throttling import shared_token_bucket
+from cache_store import TTLCache
+from http_client import HttpClient, get_http_client
 
 class DocumentDiscoveryService:
     # Comprehensive mapping of countries to their primary official immigration/government domains
@@ -66,38 +71,43 @@ class DocumentDiscoveryService:
         # Continue adding more countries and their key official domains here
     }
 
-    def __init__(self, api_key: str, processor: DocumentProcessor, db_manager: DatabaseManager):
+    def __init__(self, api_key: str, processor: DocumentProcessor, db_manager: DatabaseManager,
+                 max_concurrent_searches: int = 8, requests_per_minute: float = 100, burst: int = 20,
+                 search_cache: Optional[TTLCache] = None, offline: bool = False, http_client: Optional[HttpClient] = None):
         self.api_key = api_key
         self.base_url = "https://api.tavily.com/search"
         self.processor = processor
         self.db_manager = db_manager
+        self.max_concurrent_searches = max_concurrent_searches
+        self.search_cache = search_cache
+        self.http = http_client or get_http_client()
+        self.offline = offline  # Serve searches from the cache only, never calling Tavily
+        # One bucket per API key, shared by every service instance and rerun in this process
+        key_fingerprint = hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+        self.rate_limiter = shared_token_bucket(f"tavily:{key_fingerprint}", rate=requests_per_minute / 60.0, capacity=burst)
     
     def discover_documents(self, country: str, visa_type: str) -> List[Dict[str, Any]]:
         """Discover immigration documents and relevant informational pages using Tavily API"""
         
-        if not self.api_key:
+        if self.offline:
+            if not self.search_cache:
+                st.error("Offline mode needs the Tavily search cache, which is not configured!")
+                return []
+            st.info("Offline mode: serving search results from the local cache only.")
+        elif not self.api_key:
             st.error("Tavily API key not configured!")
             return []
         
         queries = self._generate_search_queries(country, visa_type)
         
-        all_results = []
-        
-        for query in queries:
-            try:
-                st.info(f"Searching: {query}")
-                # Pass country to the search method to allow dynamic domain filtering
-                results = self._search_tavily(query, country) 
-                
-                # Filter for relevant links and validate URLs
-                document_results = self._filter_document_results(results, query)
-                all_results.extend(document_results)
-                
-                # Add small delay to avoid rate limiting
-                time.sleep(0.5)
-                
-            except Exception as e:
-                st.error(f"Error searching '{query}': {e}")
+        # Fan the queries out concurrently; the token bucket, not a fixed sleep, keeps us under the Tavily rate limit.
+        with context_thread_pool(self.max_concurrent_searches, thread_name_prefix="tavily") as executor:
+            futures = [executor.submit(self._run_search_query, query, country) for query in queries]
+            results_per_query = [future.result() for future in futures]
+
+        # Merge in query order so deduplication stays deterministic
+        search_hits = [(query, result) for query, results in zip(queries, results_per_query) for result in results]
+        all_results = self._filter_document_results(search_hits)
         
         # Deduplicate and filter results
         unique_results = self._deduplicate_and_filter_results(all_results)
@@ -117,6 +127,16 @@ class DocumentDiscoveryService:
 
         return unique_results
     
+    def _run_search_query(self, query: str, country: str) -> List[Dict]:
+        """Search one query; errors are reported and yield no results."""
+        try:
+            st.info(f"Searching: {query}")
+            # Pass country to the search method to allow dynamic domain filtering
+            return self._search_tavily(query, country)
+        except Exception as e:
+            st.error(f"Error searching '{query}': {e}")
+            return []
+
     def _generate_search_queries(self, country: str, visa_type: str) -> List[str]:
         """Generate comprehensive search queries targeting ALL critical document formats equally."""
 
@@ -167,7 +187,7 @@ class DocumentDiscoveryService:
             ])
 
         # Prioritize diversity and limit to reasonable number
-        return list(set(queries))[:18]  # Increased to capture more format diversity
+        return list(dict.fromkeys(queries))[:18]  # Deduplicated in insertion order, so the same queries run every time
     
     def _search_tavily(self, query: str, country: str) -> List[Dict]: # Now accepts country
         """Execute search using Tavily API, with dynamic domain filtering."""
@@ -194,33 +214,92 @@ class DocumentDiscoveryService:
             # For "Other" countries or those not in map, search broadly with a warning
             st.warning(f"Country '{country}' not in predefined official domains map. Searching broadly without domain filter, results may be less precise.")
             # No 'include_domains' key in payload means Tavily searches all domains
-        
-        response = requests.post(self.base_url, json=payload, headers=headers, timeout=30)
+
+        cache_key = self._search_cache_key(query, payload.get("include_domains", []), payload["search_depth"])
+        if self.search_cache:
+            cached_results = self.search_cache.get(cache_key)
+            if cached_results is not None:
+                return cached_results
+        if self.offline:
+            st.warning(f"Offline mode: no cached results for '{query}'.")
+            return []
+
+        self.rate_limiter.acquire()
+        response = self.http.post(self.base_url, json=payload, headers=headers, timeout=30)
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        
-        return response.json().get("results", [])
+
+        results = response.json().get("results", [])
+        if self.search_cache:
+            self.search_cache.set(cache_key, results)
+        return results
+
+    @staticmethod
+    def _search_cache_key(query: str, include_domains: List[str], search_depth: str) -> str:
+        """Cache key for a Tavily search: normalized query text, domain list and search depth."""
+        key_fields = {
+            "query": " ".join(query.lower().split()),
+            "include_domains": sorted(include_domains),
+            "search_depth": search_depth,
+        }
+        return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def invalidate_search_cache(self, country: Optional[str] = None, visa_type: Optional[str] = None) -> int:
+        """Drop cached searches for one country/visa type, or the whole search cache when either is omitted.
+
+        Returns the number of queries invalidated (0 when the whole cache was cleared).
+        """
+        if not self.search_cache:
+            return 0
+        if not country or not visa_type:
+            self.search_cache.clear()
+            return 0
+        queries = self._generate_search_queries(country, visa_type)
+        include_domains = self.COUNTRY_DOMAINS_MAP.get(country, [])
+        for query in queries:
+            self.search_cache.delete(self._search_cache_key(query, include_domains, "advanced"))
+        return len(queries)
+
+    def get_search_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and entry count of the search cache (empty if caching is off)."""
+        return self.search_cache.stats() if self.search_cache else {}
     
-    def _filter_document_results(self, results: List[Dict], query: str) -> List[Dict[str, Any]]:
-        """Filter results to find downloadable documents and relevant informational pages, validating their URLs."""
+    def _filter_document_results(self, search_hits: List[Tuple[str, Dict]]) -> List[Dict[str, Any]]:
+        """Filter (query, result) hits to relevant documents and informational pages with reachable URLs.
+
+        Relevance is scored first because it is local and cheap, so irrelevant URLs never
+        get a HEAD request; the survivors are then validated concurrently, once per URL.
+        """
         
+        candidates = []
+        seen_urls = set()
+        for query, result in search_hits:
+            url = result.get("url", "")
+            if url in seen_urls:
+                continue
+            # This relevance check acts as a filter on the content, even if domain was correct
+            if not self._is_relevant_page(url, result.get("title", ""), result.get("content", "")):
+                continue
+            seen_urls.add(url)
+            candidates.append((query, result))
+
+        candidate_urls = [result.get("url", "") for _, result in candidates]
+        # Offline mode sends no requests: only URLs already known to be broken are dropped
+        validation_results = (self.processor.cached_url_validations(candidate_urls) if self.offline
+                              else self.processor.validate_urls(candidate_urls))
+
         document_results = []
         
-        for result in results:
+        for query, result in candidates:
             url = result.get("url", "")
             title = result.get("title", "")
             content = result.get("content", "")
             
-            # Validate URL accessibility before considering it
-            is_valid, status_code, error_msg = self.processor.validate_url(url)
+            # Skip URLs that are inaccessible or invalid
+            is_valid, status_code, error_msg = validation_results[url]
             if not is_valid:
                 st.warning(f"Skipping inaccessible or invalid URL '{url}' (Status: {status_code}, Error: {error_msg})")
                 continue
             
-            # Now, determine if it's a relevant document or informational page
-            # This relevance check acts as a final filter on the content, even if domain was correct
-            if not self._is_relevant_page(url, title, content):
-                continue
-            
             document_results.append({
                 "id": f"doc_{abs(hash(url))}",
                 "title": title,
@@ -1,23 +1,104 @@
 import os
+import hashlib
+import shutil
+import tempfile
+import threading
 import requests
 from pathlib import Path
-import PyPDF2
-import pdfplumber
-import fitz  # PyMuPDF
-import docx
-import pandas as pd
-from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import IO, Callable, Dict, Any, Iterator, List, Optional, Tuple
 import streamlit as st
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 import mimetypes
 import time
-from bs4 import BeautifulSoup
 import cloudinary # NEW: Import Cloudinary
 import cloudinary.uploader # NEW: Import Cloudinary uploader
+from text_extraction import (
+    EXTRACTOR_VERSION, SECTION_CHARS, TextChunk, engine_label, extract_text_from_file, iter_text_chunks, extract_pdf_text_parallel, extract_pdf_text_within_budget,
+    get_extraction_pool, split_text_chunks
+)
+from cache_store import TTLCache
+from http_client import HttpClient, get_http_client
+
+URL_TIMEOUT_ERROR = "Request timed out."
+MAX_DOWNLOAD_BYTES = 50 * 1024 * 1024
+BLOBS_DIRNAME = "blobs"  # Content-addressed store under downloads_dir: blobs/<sha256[:2]>/<sha256>
+
+# Background full extractions (see extract_text_for_ai); module-level so they outlive Streamlit reruns
+_warmup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="text-warmup")
+_warmup_pending = set()
+_warmup_lock = threading.Lock()
+PART_TTL_SLACK_SECONDS = 3600  # Text parts outlive their manifest, so a live manifest never points at expired parts
+
+
+class _TextCacheWriter:
+    """Writes a document's text to the text cache in parts of about SECTION_CHARS, then the manifest.
+
+    The manifest under `cache_key` is {"parts": n, "info": {...}}; part i is stored under
+    "<cache_key>:<i>". Only one part is buffered at a time, so filling the cache never
+    needs the whole text in memory. Without finish() no manifest is written and the
+    parts simply expire.
+    """
+
+    def __init__(self, cache: TTLCache, cache_key: str):
+        self.cache = cache
+        self.cache_key = cache_key
+        self.part_ttl = None if cache.default_ttl is None else cache.default_ttl + PART_TTL_SLACK_SECONDS
+        self.parts = 0
+        self.chars = 0
+        self._buffer: List[str] = []
+        self._size = 0
+
+    def add(self, text: str):
+        if not text:
+            return
+        self._buffer.append(text)
+        self._size += len(text) + 1
+        self.chars += len(text.strip())
+        if self._size >= SECTION_CHARS:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self.cache.set(f"{self.cache_key}:{self.parts}", "\n".join(self._buffer), ttl=self.part_ttl)
+            self.parts += 1
+            self._buffer, self._size = [], 0
+
+    def finish(self, info: Dict[str, Any]):
+        self._flush()
+        self.cache.set(self.cache_key, {"parts": self.parts, "info": info})
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL for cache keys: lower-case scheme/host, no default port, sorted query, no fragment."""
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    if parsed.port and not ((scheme == "http" and parsed.port == 80) or (scheme == "https" and parsed.port == 443)):
+        host = f"{host}:{parsed.port}"
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((scheme, host, parsed.path or "/", parsed.params, query, ""))
 
 class DocumentProcessor:
-    def __init__(self, downloads_dir: str, cloudinary_url: Optional[str] = None): # NEW: Added cloudinary_url parameter
+    def __init__(self, downloads_dir: str, cloudinary_url: Optional[str] = None, extraction_workers: int = 2, pdf_min_pages_per_task: int = 8, pdf_strategy: str = "fast",
+                 validation_workers: int = 16, validation_per_host: int = 4, validation_host_timeout_limit: int = 2,
+                 validation_cache: Optional[TTLCache] = None, validation_negative_ttl: float = 3600,
+                 fetch_validator_cache: Optional[TTLCache] = None, http_client: Optional[HttpClient] = None,
+                 text_cache: Optional[TTLCache] = None): # NEW: Added cloudinary_url parameter
         self.downloads_dir = downloads_dir
+        self.extraction_workers = extraction_workers
+        self.pdf_min_pages_per_task = pdf_min_pages_per_task
+        self.pdf_strategy = pdf_strategy  # "fast": PyMuPDF, pdfplumber for poor pages; "accurate": pdfplumber first
+        self.validation_workers = validation_workers
+        self.validation_per_host = validation_per_host
+        self.validation_host_timeout_limit = validation_host_timeout_limit
+        self.validation_cache = validation_cache
+        self.validation_negative_ttl = validation_negative_ttl
+        self.http = http_client or get_http_client()
+        self.text_cache = text_cache  # "<sha256>:<strategy>:v<EXTRACTOR_VERSION>" -> extracted text and info
+        self.fetch_validator_cache = fetch_validator_cache  # URL -> ETag/Last-Modified of the last full download
         self.cloudinary_url = cloudinary_url # NEW: Store Cloudinary URL
         if self.cloudinary_url:
             try:
@@ -41,20 +122,38 @@ class DocumentProcessor:
         Validates a URL by making a HEAD request to check its accessibility and status code.
         It will now only skip URLs that lead to HTTP errors (4xx, 5xx) or network issues.
         Returns (is_valid, status_code, error_message).
+
+        Results are cached by normalized URL: successes for the cache TTL, 4xx responses
+        for `validation_negative_ttl`. 5xx and network errors are transient and never cached.
         """
+        if not self.validation_cache:
+            return self._check_url(url)
+
+        cache_key = normalize_url(url)
+        cached = self.validation_cache.get(cache_key)
+        if cached is not None:
+            return tuple(cached)
+
+        result = self._check_url(url)
+        is_valid, status_code, _ = result
+        if is_valid:
+            self.validation_cache.set(cache_key, list(result))
+        elif status_code is not None and 400 <= status_code < 500:
+            self.validation_cache.set(cache_key, list(result), ttl=self.validation_negative_ttl)
+        return result
+
+    def _check_url(self, url: str) -> Tuple[bool, Optional[int], Optional[str]]:
+        """Uncached HEAD request behind validate_url."""
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': '*/*' # Accept all content types
-            }
-            response = requests.head(url, headers=headers, timeout=10, allow_redirects=True)
+            # The shared client sends browser-like headers and retries 429/5xx with backoff
+            response = self.http.head(url, timeout=10, allow_redirects=True)
             
             if 200 <= response.status_code < 400: # Success or redirection
                 return True, response.status_code, None
             else:
                 return False, response.status_code, f"HTTP Error: {response.status_code}"
         except requests.exceptions.Timeout:
-            return False, None, "Request timed out."
+            return False, None, URL_TIMEOUT_ERROR
         except requests.exceptions.ConnectionError:
             return False, None, "Connection error (DNS, network unreachable, etc.)."
         except requests.exceptions.RequestException as e:
@@ -62,6 +161,54 @@ class DocumentProcessor:
         except Exception as e:
             return False, None, f"Unexpected error during URL validation: {e}"
 
+    def cached_url_validations(self, urls: List[str]) -> Dict[str, Tuple[bool, Optional[int], Optional[str]]]:
+        """validate_url's cached result for each unique URL, without any network request; URLs not in the cache count as valid."""
+        results = {}
+        for url in dict.fromkeys(urls):
+            cached = self.validation_cache.get(normalize_url(url)) if self.validation_cache else None
+            results[url] = tuple(cached) if cached is not None else (True, None, None)
+        return results
+
+    def validate_urls(self, urls: List[str]) -> Dict[str, Tuple[bool, Optional[int], Optional[str]]]:
+        """Validate many URLs concurrently, returning validate_url's result for each unique URL.
+
+        At most `validation_per_host` requests run against one host at a time, and once a
+        host has timed out `validation_host_timeout_limit` times its remaining URLs fail
+        fast, so one slow government site cannot hold up the rest of the batch.
+        """
+        results = {}
+        pending_by_host = OrderedDict()
+        for url in dict.fromkeys(urls):
+            pending_by_host.setdefault(urlparse(url).netloc.lower(), deque()).append(url)
+
+        in_flight = {}  # future -> (host, url)
+        active_by_host = defaultdict(int)
+        timeouts_by_host = defaultdict(int)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.validation_workers), thread_name_prefix="validate") as executor:
+            def schedule():
+                for host, pending in pending_by_host.items():
+                    while pending and active_by_host[host] < self.validation_per_host:
+                        url = pending.popleft()
+                        if timeouts_by_host[host] >= self.validation_host_timeout_limit:
+                            results[url] = (False, None, f"Skipped: {host} timed out {timeouts_by_host[host]} times.")
+                            continue
+                        in_flight[executor.submit(self.validate_url, url)] = (host, url)
+                        active_by_host[host] += 1
+
+            schedule()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host, url = in_flight.pop(future)
+                    active_by_host[host] -= 1
+                    results[url] = future.result()
+                    if results[url][2] == URL_TIMEOUT_ERROR:
+                        timeouts_by_host[host] += 1
+                schedule()
+
+        return results
+
     def _upload_to_cloudinary(self, file_path: str, folder: str = "immigration_documents") -> Optional[str]: # NEW: Cloudinary upload method
         """Uploads a file to Cloudinary and returns its URL."""
         if not self.cloudinary_url:
@@ -90,11 +237,22 @@ class DocumentProcessor:
             st.error(f"Error uploading to Cloudinary: {e}")
             return None
 
-    def download_document(self, url: str, country: str, category: str) -> Optional[Dict[str, Any]]:
-        """Download document, save locally, and upload to Cloudinary. Return local file info and Cloudinary URL."""
+    def download_document(self, url: str, country: str, category: str,
+                          lookup_content_hash: Optional[Callable[[str], Optional[Dict]]] = None) -> Optional[Dict[str, Any]]:
+        """Download document, save locally, and upload to Cloudinary. Return local file info and Cloudinary URL.
+
+        The bytes are hashed while streaming and stored once under `blobs/<sha256>`; the
+        `<country>/<category>/<filename>` path is only a link to that blob. When
+        `lookup_content_hash` knows the hash (a document saved earlier), its record is
+        returned as `file_info["known_document"]` and its Cloudinary URL is reused.
+
+        Refetches are conditional (If-None-Match / If-Modified-Since from the last full
+        download); on HTTP 304 the stored blob is used and `file_info["not_modified"]` is True.
+        """
         
         local_file_path = None
         cloudinary_url = None # NEW: Initialize Cloudinary URL
+        temp_path = None
         try:
             # Create directory structure for local storage
             save_dir = Path(self.downloads_dir) / country.lower() / category.lower().replace(" ", "_")
@@ -118,46 +276,81 @@ class DocumentProcessor:
             # Download file locally
             st.info(f"Downloading: {filename} to local storage...")
             
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': '*/*'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=30, stream=True)
-            response.raise_for_status()
-            
-            content_length = int(response.headers.get('content-length', 0))
-            if content_length > 50 * 1024 * 1024:  # 50MB limit
-                st.warning(f"File too large: {content_length / 1024 / 1024:.1f}MB")
-                return None
+            headers = {}
             
-            with open(local_file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            # Add a small delay to ensure file handle is released, especially on Windows
-            time.sleep(0.1) # Wait for 100 milliseconds
+            # Ask the server to skip the body if the copy we already hold is still current
+            validators = self._get_fetch_validators(url)
+            if validators:
+                if validators.get('etag'):
+                    headers['If-None-Match'] = validators['etag']
+                if validators.get('last_modified'):
+                    headers['If-Modified-Since'] = validators['last_modified']
 
-            if not local_file_path.exists() or local_file_path.stat().st_size == 0:
-                st.error(f"Failed to save file or file is empty: {filename}")
-                return None
-            
-            # Specific check for PDF magic bytes, if it's supposed to be a PDF
-            if local_file_path.suffix.lower() == '.pdf':
-                with open(local_file_path, 'rb') as f:
-                    first_bytes = f.read(4)
-                    if first_bytes != b'%PDF':
-                        st.warning(f"Downloaded file is not a valid PDF (magic bytes mismatch): {filename}. It might be HTML or another format. Attempting to rename to .html")
-                        new_local_path = local_file_path.with_suffix('.html')
-                        try:
-                            os.rename(local_file_path, new_local_path)
-                            local_file_path = new_local_path # Update path for subsequent steps
-                        except OSError as e:
-                            st.error(f"Failed to rename file {local_file_path} to {new_local_path}: {e}. The file might still be in use.")
-                            return None # Stop processing this file if rename fails
-
-            # NEW: Upload to Cloudinary after successful local download
-            cloudinary_url = self._upload_to_cloudinary(str(local_file_path), folder=f"immigration_documents/originals/{country.lower()}/{category.lower().replace(' ', '_')}")
+            response = self.http.get(url, headers=headers, timeout=30, stream=True)
+            not_modified = bool(validators) and response.status_code == 304
+            if not_modified:
+                response.close()
+                content_hash = validators['content_hash']
+                blob_path = self._blob_path(content_hash)
+                filename = validators['filename']
+                local_file_path = save_dir / filename
+                size = blob_path.stat().st_size
+                st.info(f"Unchanged since last fetch (HTTP 304): {filename}")
+            else:
+                response.raise_for_status()
+
+                content_length = int(response.headers.get('content-length', 0))
+                if content_length > MAX_DOWNLOAD_BYTES:
+                    st.warning(f"File too large: {content_length / 1024 / 1024:.1f}MB")
+                    return None
+
+                blobs_dir = Path(self.downloads_dir) / BLOBS_DIRNAME
+                blobs_dir.mkdir(parents=True, exist_ok=True)
+                hasher = hashlib.sha256()
+                first_bytes = b""
+                size = 0
+                with tempfile.NamedTemporaryFile(dir=blobs_dir, prefix=".incoming-", delete=False) as f:
+                    temp_path = Path(f.name)
+                    for chunk in response.iter_content(chunk_size=8192):
+                        if not chunk:
+                            continue
+                        size += len(chunk)
+                        if size > MAX_DOWNLOAD_BYTES:
+                            st.warning(f"File too large: over {MAX_DOWNLOAD_BYTES / 1024 / 1024:.0f}MB")
+                            return None
+                        if len(first_bytes) < 4:
+                            first_bytes += chunk[:4 - len(first_bytes)]
+                        hasher.update(chunk)
+                        f.write(chunk)
+
+                if size == 0:
+                    st.error(f"Failed to save file or file is empty: {filename}")
+                    return None
+
+                content_hash = hasher.hexdigest()
+                blob_path = self._store_blob(temp_path, content_hash)
+                temp_path = None
+
+                # Specific check for PDF magic bytes, if it's supposed to be a PDF
+                if local_file_path.suffix.lower() == '.pdf' and first_bytes != b'%PDF':
+                    st.warning(f"Downloaded file is not a valid PDF (magic bytes mismatch): {filename}. It might be HTML or another format. Saving it as .html")
+                    local_file_path = local_file_path.with_suffix('.html')
+                    filename = local_file_path.name
+
+            self._link_blob(blob_path, local_file_path)
+
+            known_document = lookup_content_hash(content_hash) if lookup_content_hash else None
+            if known_document and known_document.get('cloudinary_url'):
+                cloudinary_url = known_document['cloudinary_url']
+                st.info(f"Content of {filename} already stored (sha256 {content_hash[:12]}); reusing its Cloudinary upload.")
+            elif not_modified and validators.get('cloudinary_url'):
+                cloudinary_url = validators['cloudinary_url']
+            else:
+                # NEW: Upload to Cloudinary after successful local download
+                cloudinary_url = self._upload_to_cloudinary(str(local_file_path), folder=f"immigration_documents/originals/{country.lower()}/{category.lower().replace(' ', '_')}")
+
+            if not not_modified:
+                self._save_fetch_validators(url, response.headers, content_hash, filename, size, cloudinary_url)
 
             # Return file info with the local file path AND Cloudinary URL
             final_file_format = Path(local_file_path).suffix.upper().replace('.', '') or 'UNKNOWN'
@@ -166,11 +359,14 @@ class DocumentProcessor:
             file_info = {
                 "filename": filename,
                 "file_path": str(local_file_path), # Store local file path here
-                "file_size_bytes": local_file_path.stat().st_size,
+                "file_size_bytes": size,
                 "mime_type": mimetypes.guess_type(filename)[0] or "application/octet-stream",
                 "download_url": url, # Original source URL
                 "cloudinary_url": cloudinary_url, # NEW: Add Cloudinary URL
-                "file_format": final_file_format
+                "file_format": final_file_format,
+                "content_hash": content_hash,
+                "known_document": known_document,
+                "not_modified": not_modified
             }
             
             st.success(f"Ready: {filename} (Stored locally and on Cloudinary)")
@@ -183,133 +379,217 @@ class DocumentProcessor:
             st.error(f"Error downloading {url}: {e}")
             return None
         finally:
-            # No cleanup needed here, as files are intended to be stored locally
-            pass
+            # Drop a partial download; stored blobs are kept
+            if temp_path is not None and temp_path.exists():
+                temp_path.unlink()
 
-    def extract_text(self, file_path: str) -> str:
+    def _get_fetch_validators(self, url: str) -> Optional[Dict[str, Any]]:
+        """Validators saved by the last full download of `url`, if its blob is still on disk."""
+        if not self.fetch_validator_cache:
+            return None
+        validators = self.fetch_validator_cache.get(normalize_url(url))
+        if not validators or not (validators.get('etag') or validators.get('last_modified')):
+            return None
+        if not self._blob_path(validators['content_hash']).exists():
+            return None
+        return validators
+
+    def _save_fetch_validators(self, url: str, response_headers, content_hash: str, filename: str, size: int, cloudinary_url: Optional[str]):
+        """Remember ETag/Last-Modified/Content-Length of a full download for the next conditional GET."""
+        if not self.fetch_validator_cache:
+            return
+        self.fetch_validator_cache.set(normalize_url(url), {
+            "etag": response_headers.get('ETag'),
+            "last_modified": response_headers.get('Last-Modified'),
+            "content_length": size,
+            "content_hash": content_hash,
+            "filename": filename,
+            "cloudinary_url": cloudinary_url
+        })
+
+    def _blob_path(self, content_hash: str) -> Path:
+        return Path(self.downloads_dir) / BLOBS_DIRNAME / content_hash[:2] / content_hash
+
+    def _store_blob(self, temp_path: Path, content_hash: str) -> Path:
+        """Move a finished download into the content-addressed store, keeping any existing copy."""
+        blob_path = self._blob_path(content_hash)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        if blob_path.exists():
+            temp_path.unlink()
+        else:
+            os.replace(temp_path, blob_path)
+        return blob_path
+
+    def _link_blob(self, blob_path: Path, reference_path: Path):
+        """Point a category path at a blob: hard link if possible, else symlink, else copy."""
+        if reference_path.exists() and os.path.samefile(reference_path, blob_path):
+            return
+        if reference_path.is_symlink() or reference_path.exists():
+            reference_path.unlink()
+        try:
+            os.link(blob_path, reference_path)
+        except OSError:
+            try:
+                os.symlink(os.path.abspath(blob_path), reference_path)
+            except OSError:
+                shutil.copy2(blob_path, reference_path)
+
+    def extract_text(self, file_path: str, content_hash: Optional[str] = None) -> str:
         """Extract text from document using multiple methods.
         This method now expects a local file path.
         """
-        return self._extract_text_from_local_file(file_path)
+        return self.extract_text_with_info(file_path, content_hash)[0]
 
-    def _extract_text_from_local_file(self, local_file_path: str) -> str:
-        """Helper to extract text from a local file."""
-        try:
-            if not os.path.exists(local_file_path):
-                st.error(f"Local file not found for text extraction: {local_file_path}")
-                return ""
-            
-            file_ext = Path(local_file_path).suffix.lower()
-            
-            if file_ext == '.pdf':
-                return self._extract_pdf_text_robust(local_file_path)
-            elif file_ext in ['.docx', '.doc']:
-                return self._extract_word_text(local_file_path)
-            elif file_ext in ['.xlsx', '.xls']:
-                return self._extract_excel_text(local_file_path)
-            elif file_ext in ['.html', '.htm']:
-                return self._extract_html_text(local_file_path)
-            else:
-                st.warning(f"Unsupported file type for text extraction: {file_ext}")
-                return ""
-                
-        except Exception as e:
-            st.error(f"Error extracting text from {local_file_path}: {e}")
-            return ""
+    def extract_text_with_info(self, file_path: str, content_hash: Optional[str] = None, quiet: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Like extract_text, also returning how the text was obtained: engine, pages, seconds, strategy.
 
-    def _extract_pdf_text_robust(self, file_path: str) -> str:
-        """Extract text from PDF using multiple methods"""
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                text = ""
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-                if len(text.strip()) > 100:
-                    st.success(f"Extracted text using pdfplumber: {len(text.strip())} chars")
-                    return text.strip()
-        except Exception as e:
-            st.warning(f"pdfplumber failed for {Path(file_path).name}: {e}")
-        
-        try:
-            doc = fitz.open(file_path)
-            text = ""
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                page_text = page.get_text()
-                text += page_text + "\n"
-            doc.close()
-            if len(text.strip()) > 100:
-                st.success(f"Extracted text using PyMuPDF: {len(text.strip())} chars")
-                return text.strip()
-        except Exception as e:
-            st.warning(f"PyMuPDF failed for {Path(file_path).name}: {e}")
-        
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                if pdf_reader.is_encrypted:
-                    st.warning(f"PDF is encrypted, skipping PyPDF2: {Path(file_path).name}")
-                    return ""
-                text = ""
-                for page_num, page in enumerate(pdf_reader.pages):
+        With a text cache, results are stored per content hash (computed from the file if
+        not given), extraction strategy and EXTRACTOR_VERSION, so the same bytes are only
+        parsed once; cache hits are marked with info["cache_hit"].
+        """
+        started = time.perf_counter()
+        strategy = self.pdf_strategy if Path(file_path).suffix.lower() == '.pdf' else None
+
+        cache_key = None
+        if self.text_cache:
+            content_hash = content_hash or self._file_content_hash(file_path)
+            if content_hash:
+                cache_key = self._text_cache_key(content_hash, strategy)
+                cached = self.text_cache.get(cache_key)
+                if cached is not None:
                     try:
-                        page_text = page.extract_text()
-                        text += page_text + "\n"
-                    except Exception as e:
-                        st.warning(f"PyPDF2: Error reading page {page_num + 1} of {Path(file_path).name}: {e}")
-                        continue
-                if len(text.strip()) > 50:
-                    st.success(f"Extracted text using PyPDF2: {len(text.strip())} chars")
-                    return text.strip()
-        except Exception as e:
-            st.error(f"PyPDF2 failed for {Path(file_path).name}: {e}")
-        
-        st.error(f"All PDF extraction methods failed for: {Path(file_path).name}. Content might be image-based or severely corrupted.")
-        return ""
+                        text = "\n".join(chunk.text for chunk in self._iter_cached_text(cache_key, cached)).strip()
+                        info = {**cached["info"], "cache_hit": True, "seconds": round(time.perf_counter() - started, 3)}
+                        return text, info
+                    except KeyError:
+                        pass  # Parts missing: extract again
+
+        text, info = self._extract_text_from_local_file(file_path, quiet)
+        info["seconds"] = round(time.perf_counter() - started, 3)
+        info["strategy"] = strategy
+        info["version"] = EXTRACTOR_VERSION
+        if cache_key and text:
+            writer = _TextCacheWriter(self.text_cache, cache_key)
+            for chunk in split_text_chunks(text):
+                writer.add(chunk.text)
+            writer.finish(info)
+        return text, info
 
-    def _extract_word_text(self, file_path: str) -> str:
-        """Extract text from Word document"""
+    def _iter_cached_text(self, cache_key: str, cached: Dict[str, Any]) -> Iterator[TextChunk]:
+        """Chunks of a text cache entry, one stored part at a time. Raises KeyError (and drops the entry) if a part is gone."""
+        engine = cached["info"].get("engine")
+        if "text" in cached:
+            # Entry from before texts were stored in parts
+            yield from split_text_chunks(cached["text"], engine)
+            return
+        for index in range(cached["parts"]):
+            part = self.text_cache.get(f"{cache_key}:{index}")
+            if part is None:
+                self.text_cache.delete(cache_key)
+                raise KeyError(f"Cached text part {index} of {cache_key} is missing")
+            yield TextChunk(part, section=f"part {index + 1} of {cached['parts']}", engine=engine)
+
+    @staticmethod
+    def _text_cache_key(content_hash: str, strategy: Optional[str]) -> str:
+        return f"{content_hash}:{strategy or '-'}:v{EXTRACTOR_VERSION}"
+
+    @staticmethod
+    def _file_content_hash(file_path: str) -> Optional[str]:
+        """SHA-256 of a local file, or None if it cannot be read."""
         try:
-            doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            st.success(f"Extracted text from Word doc: {len(text.strip())} chars")
-            return text.strip()
-        except Exception as e:
-            st.error(f"Error reading Word document {file_path}: {e}")
-            return ""
+            hasher = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+            return hasher.hexdigest()
+        except OSError:
+            return None
+
+    def extract_text_for_ai(self, file_path: str, max_chars: int, content_hash: Optional[str] = None,
+                            representative: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Text for an AI prompt of `max_chars`: only the pages needed, not the whole document.
 
-    def _extract_excel_text(self, file_path: str) -> str:
-        """Extract text from Excel file"""
+        PDFs stop being parsed once the budget is met (or, with `representative`, contribute
+        their first pages plus the fee/checklist-heavy ones). The full extraction is then
+        queued in the background so the text cache is warm for the viewer and re-validation.
+        Cached full text is used directly; other formats are cheap and always read in full.
+        """
+        if Path(file_path).suffix.lower() != '.pdf':
+            return self.extract_text_with_info(file_path, content_hash)
+        content_hash = content_hash or (self._file_content_hash(file_path) if self.text_cache else None)
+        if self.text_cache and content_hash and self.text_cache.get(self._text_cache_key(content_hash, self.pdf_strategy)) is not None:
+            return self.extract_text_with_info(file_path, content_hash)
+
+        started = time.perf_counter()
         try:
-            df = pd.read_excel(file_path, sheet_name=None)
-            text = ""
-            for sheet_name, sheet_df in df.items():
-                text += f"Sheet: {sheet_name}\n"
-                text += sheet_df.to_string() + "\n\n"
-            st.success(f"Extracted text from Excel: {len(text.strip())} chars")
-            return text.strip()
+            pool = get_extraction_pool(self.extraction_workers)
+            text, messages, info = pool.submit(
+                extract_pdf_text_within_budget, file_path, max_chars, self.pdf_strategy, representative
+            ).result()
         except Exception as e:
-            st.error(f"Error reading Excel file {file_path}: {e}")
-            return ""
+            text, messages, info = "", [("warning", f"Budgeted extraction failed for {Path(file_path).name}: {e}")], {}
+        self._show_messages(messages)
+        if not text:
+            # Let the full cascade (with its fallback engines) have a go
+            return self.extract_text_with_info(file_path, content_hash)
+
+        info.update({"seconds": round(time.perf_counter() - started, 3), "strategy": self.pdf_strategy, "version": EXTRACTOR_VERSION})
+        if info.get("partial"):
+            self.extract_text_in_background(file_path, content_hash)
+        return text, info
+
+    def extract_text_in_background(self, file_path: str, content_hash: Optional[str]):
+        """Queue a full, quiet extraction that only fills the text cache (no-op without one)."""
+        if not self.text_cache or not content_hash:
+            return
+        with _warmup_lock:
+            if content_hash in _warmup_pending:
+                return
+            _warmup_pending.add(content_hash)
+
+        def warm_up():
+            try:
+                self.extract_text_with_info(file_path, content_hash, quiet=True)
+            finally:
+                with _warmup_lock:
+                    _warmup_pending.discard(content_hash)
+
+        _warmup_executor.submit(warm_up)
 
-    def _extract_html_text(self, file_path: str) -> str:
-        """Basic extraction of text from HTML file (strips tags)."""
+    def _extract_text_from_local_file(self, local_file_path: str, quiet: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Helper to extract text from a local file in the shared extraction process pool.
+
+        Long PDFs are split into page ranges that the pool extracts in parallel.
+        `quiet` suppresses st.* output, for background threads without a Streamlit context.
+        """
+        if not os.path.exists(local_file_path):
+            if not quiet:
+                st.error(f"Local file not found for text extraction: {local_file_path}")
+            return "", {"engine": None}
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                soup = BeautifulSoup(f, 'html.parser')
-                text = soup.get_text(separator='\n', strip=True)
-            st.success(f"Extracted text from HTML: {len(text.strip())} chars")
-            return text.strip()
-        except ImportError:
-            st.error("BeautifulSoup4 not installed. Cannot extract text from HTML. Please run `pip install beautifulsoup4`.")
-            return ""
+            pool = get_extraction_pool(self.extraction_workers)
+            if Path(local_file_path).suffix.lower() == '.pdf':
+                text, messages, info = extract_pdf_text_parallel(
+                    pool, local_file_path, self.extraction_workers, self.pdf_min_pages_per_task, self.pdf_strategy
+                )
+            else:
+                text, messages, info = pool.submit(extract_text_from_file, local_file_path, self.pdf_strategy).result()
+        except BrokenProcessPool as e:
+            if not quiet:
+                st.warning(f"Extraction worker crashed ({e}); retrying {Path(local_file_path).name} in-process.")
+            text, messages, info = extract_text_from_file(local_file_path, self.pdf_strategy)
         except Exception as e:
-            st.error(f"Error reading HTML file {file_path}: {e}")
-            return ""
+            if not quiet:
+                st.error(f"Error extracting text from {local_file_path}: {e}")
+            return "", {"engine": None}
+        if not quiet:
+            self._show_messages(messages)
+        return text, info
+
+    def _show_messages(self, messages: List[Tuple[str, str]]):
+        """Replay log messages collected in an extraction worker process."""
+        for level, message in messages:
+            getattr(st, level, st.info)(message)
 
     def get_file_content_bytes_from_path(self, file_path: str) -> Optional[bytes]:
         """Reads a file from the given local file path and returns its content as bytes."""
@@ -323,9 +603,80 @@ class DocumentProcessor:
             st.error(f"Error reading file from local path for download: {e}")
             return None
 
-    def get_extracted_text_bytes(self, file_path: str) -> Optional[bytes]:
-        """Extracts text from a document (from local path) and returns it as UTF-8 encoded bytes (for Markdown/TXT)."""
-        extracted_text = self.extract_text(file_path)
-        if extracted_text:
-            return extracted_text.encode('utf-8')
-        return None
+    def iter_text_chunks(self, file_path: str, content_hash: Optional[str] = None) -> Iterator[TextChunk]:
+        """Stream a document's text chunk by chunk (PDF page, sheet, group of paragraphs).
+
+        Cached text is read back one stored part (about SECTION_CHARS) at a time.
+        Otherwise the file is parsed lazily in this thread and each chunk is written to
+        the text cache as it goes by, so memory stays at about one part whatever the
+        document's length. The cache entry only becomes visible if the consumer reads
+        every chunk; if it stops early, a full extraction is queued in the background.
+        """
+        strategy = self.pdf_strategy if Path(file_path).suffix.lower() == '.pdf' else None
+        cache_key = None
+        if self.text_cache:
+            content_hash = content_hash or self._file_content_hash(file_path)
+            if content_hash:
+                cache_key = self._text_cache_key(content_hash, strategy)
+                cached = self.text_cache.get(cache_key)
+                if cached is not None:
+                    yield from self._iter_cached_text(cache_key, cached)
+                    return
+        if cache_key is None:
+            yield from iter_text_chunks(file_path, self.pdf_strategy)
+            return
+
+        started = time.perf_counter()
+        writer = _TextCacheWriter(self.text_cache, cache_key)
+        engines: Dict[str, int] = {}
+        finished = False
+        try:
+            for chunk in iter_text_chunks(file_path, self.pdf_strategy):
+                writer.add(chunk.text)
+                if chunk.engine:
+                    engines[chunk.engine] = engines.get(chunk.engine, 0) + 1
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                self.extract_text_in_background(file_path, content_hash)
+
+        if strategy and writer.chars <= 100:
+            # Too little for the PDF cascade to accept; the full extraction also tries its fallback engines
+            self.extract_text_in_background(file_path, content_hash)
+        elif writer.chars:
+            info = {"engine": engine_label(engines) if strategy else next(iter(engines), None),
+                    "seconds": round(time.perf_counter() - started, 3), "strategy": strategy, "version": EXTRACTOR_VERSION}
+            if strategy:
+                info.update({"pages": sum(engines.values()), "engine_pages": engines})
+            writer.finish(info)
+
+    def open_extracted_text(self, file_path: str, content_hash: Optional[str] = None) -> Optional[IO[bytes]]:
+        """Extracted text as a UTF-8 file object (spooled to disk past 8 MB), built chunk by chunk; None if empty."""
+        output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        try:
+            written = False
+            for chunk in self.iter_text_chunks(file_path, content_hash):
+                if not chunk.text:
+                    continue
+                if written:
+                    output.write(b"\n")
+                output.write(chunk.text.encode('utf-8'))
+                written = True
+        except Exception as e:
+            output.close()
+            st.error(f"Error extracting text from {file_path}: {e}")
+            return None
+        if not written:
+            output.close()
+            return None
+        output.seek(0)
+        return output
+
+    def get_extracted_text_bytes(self, file_path: str, content_hash: Optional[str] = None) -> Optional[bytes]:
+        """Extracted text as UTF-8 bytes (for Markdown/TXT); prefer open_extracted_text for large documents."""
+        extracted_text_file = self.open_extracted_text(file_path, content_hash)
+        if extracted_text_file is None:
+            return None
+        with extracted_text_file:
+            return extracted_text_file.read()
@@ -276,6 +276,8 @@ class ExportService:
             if visa_cat not in grouped_by_visa:
                 grouped_by_visa[visa_cat] = []
             grouped_by_visa[visa_cat].append(form)
+
+        documents_by_form_id = self.db_manager.get_documents_by_form_ids([form['id'] for form in forms if form.get('id')])
         
         for visa_category, category_forms in sorted(grouped_by_visa.items()):
             report_content_lines.append(f"### {visa_category} ({len(category_forms)} Forms)\n\n")
@@ -285,7 +287,7 @@ class ExportService:
                 description = form.get('description', 'No description available.')
                 official_source_url = form.get('official_source_url', 'N/A')
                 
-                original_doc_info = self.db_manager.get_document_by_form_id(form['id'])
+                original_doc_info = documents_by_form_id.get(form.get('id'))
                 original_cloudinary_url = original_doc_info.get('cloudinary_url') if original_doc_info else 'N/A'
 
                 # Generate JSON and Markdown summary exports to ensure they exist on Cloudinary
@@ -353,6 +355,7 @@ class ExportService:
 
             # Flatten all data including structured_data fields with error handling
             flattened_data = []
+            documents_by_form_id = self.db_manager.get_documents_by_form_ids([form['id'] for form in all_forms if form.get('id')])
 
             st.info(f"Processing {len(all_forms)} forms for export...")
 
@@ -485,7 +488,7 @@ class ExportService:
                     # Get document information with error handling
                     try:
                         if form.get('id'):
-                            document_info = self.db_manager.get_document_by_form_id(form['id'])
+                            document_info = documents_by_form_id.get(form['id'])
                             if document_info and isinstance(document_info, dict):
                                 row['document_filename'] = document_info.get('filename', '')
                                 row['document_file_format'] = document_info.get('file_format', '')
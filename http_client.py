@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+Timeout = Union[float, Tuple[float, float]]  # seconds, or (connect, read) as accepted by requests
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': '*/*'
+}
+
+
+def _match_domain(host: str, domains: Dict[str, object]) -> Optional[str]:
+    """Most specific configured domain that `host` equals or is a subdomain of."""
+    matches = [domain for domain in domains if host == domain or host.endswith("." + domain)]
+    return max(matches, key=len) if matches else None
+
+
+class HostPoolAdapter(HTTPAdapter):
+    """Default adapter that hands requests for configured domains to their own, differently sized pools.
+
+    All adapters are built up front, so nothing is mounted on the Session once it is in
+    use by several threads; a domain's adapter also serves its subdomains.
+    """
+
+    def __init__(self, pool_size: int, host_pool_sizes: Dict[str, int]):
+        super().__init__(pool_connections=32, pool_maxsize=pool_size)
+        self.host_adapters = {domain: HTTPAdapter(pool_connections=8, pool_maxsize=size) for domain, size in host_pool_sizes.items()}
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        domain = _match_domain((urlparse(request.url).hostname or "").lower(), self.host_adapters)
+        if domain is None:
+            return super().send(request, **kwargs)
+        return self.host_adapters[domain].send(request, **kwargs)
+
+    def close(self):
+        super().close()
+        for adapter in self.host_adapters.values():
+            adapter.close()
+
+
+class HttpClient:
+    """Pooled, keep-alive HTTP client shared by every outbound fetch (HEAD checks, downloads, Tavily).
+
+    One requests.Session keeps connections open between calls, so a HEAD followed by a
+    GET to the same host reuses the TCP/TLS connection. Hosts listed in `host_pool_sizes`
+    (a domain also matches its subdomains) get their own connection pool size and
+    `host_timeouts` override the caller's timeout. Responses with a status in
+    `retry_statuses`, and connection failures, are retried with jittered exponential
+    backoff; a numeric or HTTP-date Retry-After header is honoured up to `backoff_max`.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_size: int = 8, host_pool_sizes: Optional[Dict[str, int]] = None,
+                 default_timeout: Timeout = (10, 30), host_timeouts: Optional[Dict[str, Timeout]] = None,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 retry_statuses: Tuple[int, ...] = RETRY_STATUSES):
+        self.pool_size = pool_size
+        self.host_pool_sizes = {domain.lower(): size for domain, size in (host_pool_sizes or {}).items()}
+        self.default_timeout = default_timeout
+        self.host_timeouts = {domain.lower(): timeout for domain, timeout in (host_timeouts or {}).items()}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = retry_statuses
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HostPoolAdapter(pool_size, self.host_pool_sizes)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def timeout_for(self, url: str, timeout: Optional[Timeout] = None) -> Timeout:
+        """Per-host timeout if one is configured, else the caller's, else the client default."""
+        domain = _match_domain((urlparse(url).hostname or "").lower(), self.host_timeouts)
+        if domain is not None:
+            return self.host_timeouts[domain]
+        return timeout if timeout is not None else self.default_timeout
+
+    def _backoff_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    return min(self.backoff_max, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        # "Full jitter": spreads out retries from concurrent workers hitting the same host
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None, **kwargs) -> requests.Response:
+        timeout = self.timeout_for(url, timeout)
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                # Timeouts (ConnectTimeout is also a ConnectionError) are not retried:
+                # callers count them to give up on slow hosts
+                if isinstance(e, requests.exceptions.Timeout) or attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff_delay(attempt, None))
+                attempt += 1
+                continue
+            if response.status_code not in self.retry_statuses or attempt >= self.max_retries:
+                return response
+            delay = self._backoff_delay(attempt, response)
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+
+_client: Optional[HttpClient] = None
+_client_settings = None
+_client_lock = threading.Lock()
+
+
+def get_http_client(**settings) -> HttpClient:
+    """Return the process-wide HttpClient, rebuilding it only when `settings` change.
+
+    Called without settings it returns the existing client as configured (a default one
+    if none exists yet). Kept at module level so the connection pool survives Streamlit reruns.
+    """
+    global _client, _client_settings
+    with _client_lock:
+        if _client is None or (settings and _client_settings != settings):
+            _client = HttpClient(**settings)
+            _client_settings = settings
+        return _client
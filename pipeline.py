@@ -0,0 +1,146 @@
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:  # Older/newer Streamlit layouts; worker output is simply not rendered
+    add_script_run_ctx = None
+    get_script_run_ctx = None
+
+_STOP = object()
+
+
+def start_thread(target: Callable, *args, name: Optional[str] = None) -> threading.Thread:
+    """Start a daemon thread that inherits the current Streamlit script context, so st.* calls made in it still render."""
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    ctx = get_script_run_ctx(suppress_warning=True) if get_script_run_ctx else None
+    if ctx is not None:
+        add_script_run_ctx(thread, ctx)
+    thread.start()
+    return thread
+
+
+def context_thread_pool(max_workers: int, thread_name_prefix: str = "") -> ThreadPoolExecutor:
+    """ThreadPoolExecutor whose workers inherit the current Streamlit script context."""
+    ctx = get_script_run_ctx(suppress_warning=True) if get_script_run_ctx else None
+
+    def attach_context():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+    return ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix=thread_name_prefix, initializer=attach_context)
+
+
+@dataclass
+class PipelineStage:
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+
+@dataclass
+class PipelineResult:
+    index: int
+    item: Any
+    stage: Optional[str] = None  # Stage that raised, if any
+    error: Optional[BaseException] = None
+    traceback: str = ""
+
+
+class StagedPipeline:
+    """Run items through a fixed sequence of stages, each with its own bounded worker pool.
+
+    Stages are connected by bounded queues: when a downstream stage falls behind,
+    upstream workers block on `put` instead of piling up finished work (backpressure).
+    Results are yielded in input order, regardless of which item finishes first.
+    Once the consumer stops (or abandons the generator), the feeder stops and workers
+    drain their inboxes without processing what is left.
+    """
+
+    def __init__(self, stages: List[PipelineStage], queue_size: int = 2, is_finished: Optional[Callable[[Any], bool]] = None):
+        if not stages:
+            raise ValueError("StagedPipeline needs at least one stage.")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.is_finished = is_finished or (lambda item: False)
+
+    @staticmethod
+    def _put(target: queue.Queue, entry: Any, cancelled: threading.Event) -> bool:
+        """Blocking put that gives up once the run is cancelled. Returns whether the entry was queued."""
+        while not cancelled.is_set():
+            try:
+                target.put(entry, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, stage_index: int, inbox: queue.Queue, outbox: Optional[queue.Queue], results: queue.Queue,
+                cancelled: threading.Event):
+        stage = self.stages[stage_index]
+        while True:
+            entry = inbox.get()
+            if entry is _STOP:
+                return
+            if cancelled.is_set():
+                continue  # Drain: nobody is waiting for this item any more
+            index, item = entry
+            try:
+                item = stage.func(item)
+            except BaseException as e:
+                # BaseException too (e.g. a Streamlit stop/rerun exception): every item must get a
+                # result or run() waits forever, and the worker has to live on for the rest of its inbox
+                results.put(PipelineResult(index, item, stage.name, e, traceback.format_exc()))
+                continue
+            if cancelled.is_set():
+                continue
+            if outbox is not None and not self.is_finished(item):
+                self._put(outbox, (index, item), cancelled)  # Blocks while the next stage is saturated
+            else:
+                results.put(PipelineResult(index, item))
+
+    def _feed(self, items: List[Any], inbox: queue.Queue, cancelled: threading.Event):
+        for index, item in enumerate(items):
+            if not self._put(inbox, (index, item), cancelled):
+                return
+
+    def run(self, items: Iterable[Any]) -> Iterator[PipelineResult]:
+        items = list(items)
+        if not items:
+            return
+
+        inboxes = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = queue.Queue()
+        cancelled = threading.Event()
+        for stage_index, stage in enumerate(self.stages):
+            outbox = inboxes[stage_index + 1] if stage_index + 1 < len(self.stages) else None
+            for worker_number in range(max(1, stage.workers)):
+                start_thread(
+                    self._worker, stage_index, inboxes[stage_index], outbox, results, cancelled,
+                    name=f"pipeline-{stage.name}-{worker_number}"
+                )
+        start_thread(self._feed, items, inboxes[0], cancelled, name="pipeline-feeder")
+
+        pending = {}
+        next_index = 0
+        try:
+            while next_index < len(items):
+                result = results.get()
+                pending[result.index] = result
+                while next_index in pending:
+                    yield pending.pop(next_index)
+                    next_index += 1
+        finally:
+            # Stop feeding and processing; then release the workers from a helper thread,
+            # since if the consumer stopped early (e.g. a Streamlit rerun) the inboxes may still be full.
+            cancelled.set()
+            start_thread(self._shutdown, inboxes, name="pipeline-shutdown")
+
+    def _shutdown(self, inboxes: List[queue.Queue]):
+        for stage_index, stage in enumerate(self.stages):
+            for _ in range(max(1, stage.workers)):
+                inboxes[stage_index].put(_STOP)
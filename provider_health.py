@@ -0,0 +1,237 @@
+import bisect
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# Upper bounds (seconds) of the latency buckets; the last one catches everything slower
+LATENCY_BUCKETS = (0.25, 0.5, 1, 1.5, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120, float("inf"))
+
+
+class LatencyHistogram:
+    """Bucketed latency distribution that slowly forgets old samples.
+
+    Once `max_samples` observations have accumulated, every bucket is halved, so the
+    percentiles follow a provider whose latency changes instead of its all-time history.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, max_samples: int = 500):
+        self.buckets = buckets
+        self.max_samples = max_samples
+        self.counts = [0.0] * len(buckets)
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += 1
+        if self.total >= self.max_samples:
+            self.counts = [count / 2 for count in self.counts]
+            self.total /= 2
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the `fraction` quantile (0-1), or None without samples."""
+        if not self.total:
+            return None
+        threshold = fraction * self.total
+        cumulative = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= threshold and count:
+                return bound
+        return self.buckets[-1]
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker over the last `window` calls. Not thread-safe; ProviderMonitor locks around it.
+
+    closed: calls go through. Once at least `min_calls` of the window are recorded and
+    the failure rate reaches `failure_rate`, it opens: calls are refused for
+    `cooldown_seconds`. Then it is half-open: a single probe call is let through, and
+    its outcome closes the breaker again (with a fresh window) or re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5, cooldown_seconds: float = 60.0):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self.outcomes = deque(maxlen=window)  # True for success
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def _refresh(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            self.state = self.HALF_OPEN
+            self.probe_in_flight = False
+
+    def is_available(self) -> bool:
+        """Whether a call would currently be allowed (without reserving the half-open probe)."""
+        self._refresh()
+        return self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self.probe_in_flight)
+
+    def allow_request(self) -> bool:
+        """Like is_available, but claims the half-open probe; the call's outcome must then be recorded."""
+        if not self.is_available():
+            return False
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = True
+        return True
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probe_in_flight = False
+
+    def record(self, success: bool):
+        self._refresh()
+        if self.state == self.HALF_OPEN:
+            if success:
+                self.state = self.CLOSED
+                self.outcomes.clear()
+            else:
+                self._open()
+            self.probe_in_flight = False
+            return
+        if self.outcomes.maxlen != self.window:
+            self.outcomes = deque(self.outcomes, maxlen=self.window)
+        self.outcomes.append(success)
+        if self.state == self.CLOSED and len(self.outcomes) >= self.min_calls:
+            failures = sum(1 for outcome in self.outcomes if not outcome)
+            if failures / len(self.outcomes) >= self.failure_rate:
+                self._open()
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker turns half-open (0 otherwise)."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.cooldown_seconds - (time.monotonic() - self.opened_at))
+
+
+class ProviderMonitor:
+    """Thread-safe per-provider call statistics (latency histogram, outcome counts, last error) and circuit breakers."""
+
+    def __init__(self, breaker_settings: Optional[Dict[str, Any]] = None):
+        self._lock = threading.Lock()
+        self.breaker_settings = dict(breaker_settings or {})
+        self._latencies: Dict[str, LatencyHistogram] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._last_errors: Dict[str, Optional[Tuple[float, str]]] = {}  # provider -> (wall-clock time, message)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def configure_breakers(self, **settings):
+        """Apply CircuitBreaker settings (window, min_calls, failure_rate, cooldown_seconds) to every provider."""
+        with self._lock:
+            self.breaker_settings.update(settings)
+            for breaker in self._breakers.values():
+                for name, value in settings.items():
+                    setattr(breaker, name, value)
+
+    def _entry(self, provider: str) -> Tuple[LatencyHistogram, Dict[str, int]]:
+        if provider not in self._latencies:
+            self._latencies[provider] = LatencyHistogram()
+            self._counts[provider] = {"successes": 0, "failures": 0, "rejected": 0}
+            self._last_errors[provider] = None
+            self._breakers[provider] = CircuitBreaker(**self.breaker_settings)
+        return self._latencies[provider], self._counts[provider]
+
+    def is_available(self, provider: str) -> bool:
+        """False while the provider's breaker is open (or its half-open probe is already running)."""
+        with self._lock:
+            self._entry(provider)
+            return self._breakers[provider].is_available()
+
+    def allow_request(self, provider: str) -> bool:
+        """Call right before a real provider call; a True answer must be followed by record_success/record_failure."""
+        with self._lock:
+            _, counts = self._entry(provider)
+            allowed = self._breakers[provider].allow_request()
+            if not allowed:
+                counts["rejected"] += 1
+            return allowed
+
+    def note_skipped(self, provider: str):
+        """Count a call that was not even attempted because is_available said no, like a rejected allow_request."""
+        with self._lock:
+            _, counts = self._entry(provider)
+            counts["rejected"] += 1
+
+    def release(self, provider: str):
+        """A call allowed by allow_request ended without an outcome (e.g. cancelled): free the half-open probe slot."""
+        with self._lock:
+            self._entry(provider)
+            self._breakers[provider].probe_in_flight = False
+
+    def record_success(self, provider: str, seconds: float):
+        with self._lock:
+            histogram, counts = self._entry(provider)
+            histogram.observe(seconds)
+            counts["successes"] += 1
+            self._breakers[provider].record(True)
+
+    def record_failure(self, provider: str, seconds: float, error: str):
+        with self._lock:
+            _, counts = self._entry(provider)
+            counts["failures"] += 1
+            self._last_errors[provider] = (time.time(), error)
+            self._breakers[provider].record(False)
+
+    def latency_percentile(self, provider: str, fraction: float) -> Optional[float]:
+        with self._lock:
+            histogram = self._latencies.get(provider)
+            return histogram.percentile(fraction) if histogram else None
+
+    def hedge_delay(self, provider: str, fraction: float, default: float, minimum: float, min_samples: int = 10) -> float:
+        """Seconds to wait for `provider` before starting a backup request.
+
+        The `fraction` latency percentile of its successful calls, never below `minimum`;
+        `default` until the provider has `min_samples` successes.
+        """
+        with self._lock:
+            histogram = self._latencies.get(provider)
+            if histogram is None or histogram.total < min_samples:
+                return default
+            return max(minimum, histogram.percentile(fraction))
+
+    def providers(self) -> List[str]:
+        with self._lock:
+            return sorted(self._latencies)
+
+    def scoreboard(self) -> List[Dict[str, Any]]:
+        """One row per provider: breaker state, success rate, p50/p95 latency and the last error."""
+        rows = []
+        with self._lock:
+            for provider in sorted(self._latencies):
+                histogram, counts = self._latencies[provider], self._counts[provider]
+                breaker = self._breakers[provider]
+                breaker._refresh()
+                calls = counts["successes"] + counts["failures"]
+                last_error = self._last_errors[provider]
+                rows.append({
+                    "provider": provider,
+                    "state": breaker.state,
+                    "retry_in_seconds": round(breaker.retry_in(), 1),
+                    "calls": calls,
+                    "success_rate": counts["successes"] / calls if calls else None,
+                    "rejected": counts["rejected"],
+                    "p50_seconds": histogram.percentile(0.5),
+                    "p95_seconds": histogram.percentile(0.95),
+                    "last_error": last_error[1] if last_error else None,
+                    "last_error_at": last_error[0] if last_error else None
+                })
+        return rows
+
+
+_monitor = ProviderMonitor()
+
+
+def get_provider_monitor(**breaker_settings) -> ProviderMonitor:
+    """Process-wide monitor; module level so the statistics and breaker states survive Streamlit reruns.
+
+    `breaker_settings` (CircuitBreaker arguments) are applied to it when given.
+    """
+    if breaker_settings:
+        _monitor.configure_breakers(**breaker_settings)
+    return _monitor
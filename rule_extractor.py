@@ -0,0 +1,211 @@
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# Agency behind each official domain, with how sure the domain alone makes us.
+# Shared government portals (gov.uk, canada.ca) host many departments, hence the lower scores.
+DOMAIN_AUTHORITIES = {
+    "uscis.gov": ("U.S. Citizenship and Immigration Services (USCIS)", 0.95),
+    "state.gov": ("U.S. Department of State", 0.9),
+    "travel.state.gov": ("U.S. Department of State", 0.95),
+    "cbp.gov": ("U.S. Customs and Border Protection (CBP)", 0.95),
+    "ice.gov": ("U.S. Immigration and Customs Enforcement (ICE)", 0.95),
+    "dhs.gov": ("U.S. Department of Homeland Security (DHS)", 0.85),
+    "dol.gov": ("U.S. Department of Labor (DOL)", 0.9),
+    "justice.gov": ("U.S. Department of Justice (DOJ)", 0.85),
+    "canada.ca": ("Immigration, Refugees and Citizenship Canada (IRCC)", 0.7),
+    "cic.gc.ca": ("Immigration, Refugees and Citizenship Canada (IRCC)", 0.95),
+    "ircc.canada.ca": ("Immigration, Refugees and Citizenship Canada (IRCC)", 0.95),
+    "gov.uk": ("UK Visas and Immigration (Home Office)", 0.6),
+    "homeoffice.gov.uk": ("Home Office", 0.9),
+    "homeaffairs.gov.au": ("Department of Home Affairs", 0.95),
+    "immi.homeaffairs.gov.au": ("Department of Home Affairs", 0.95),
+    "bamf.de": ("Federal Office for Migration and Refugees (BAMF)", 0.95),
+    "auswaertiges-amt.de": ("Federal Foreign Office", 0.9),
+    "france-visas.gouv.fr": ("France-Visas", 0.9),
+    "interieur.gouv.fr": ("Ministry of the Interior", 0.9),
+    "diplomatie.gouv.fr": ("Ministry for Europe and Foreign Affairs", 0.9),
+    "mohre.gov.ae": ("Ministry of Human Resources and Emiratisation (MOHRE)", 0.95),
+    "gdrfad.gov.ae": ("General Directorate of Residency and Foreigners Affairs (GDRFA)", 0.95),
+    "mofaic.gov.ae": ("Ministry of Foreign Affairs (MOFA)", 0.9),
+    "indianvisaonline.gov.in": ("Ministry of Home Affairs", 0.8),
+    "mea.gov.in": ("Ministry of External Affairs", 0.9),
+    "mha.gov.in": ("Ministry of Home Affairs", 0.9),
+    "boi.gov.in": ("Bureau of Immigration", 0.95),
+    "inm.gob.mx": ("National Migration Institute (INM)", 0.95),
+    "gob.mx/inm": ("National Migration Institute (INM)", 0.95),
+    "nia.gov.cn": ("National Immigration Administration", 0.95),
+    "moj.go.jp/isa": ("Immigration Services Agency of Japan", 0.95),
+    "immigration.go.kr": ("Korea Immigration Service", 0.95),
+    "dha.gov.za": ("Department of Home Affairs", 0.95),
+    "immigration.govt.nz": ("Immigration New Zealand", 0.95),
+    "ica.gov.sg": ("Immigration & Checkpoints Authority (ICA)", 0.95),
+    "immigration.gov.ph": ("Bureau of Immigration", 0.95),
+    "dfa.gov.ph": ("Department of Foreign Affairs", 0.9),
+}
+
+# (pattern, country or None for any); matched against the text and the upper-cased URL/filename
+FORM_ID_PATTERNS = [
+    (re.compile(r"\b([IGN]-\d{2,4}[A-Z]{0,2})\b"), "USA"),      # I-129, I-129F, N-400, G-1145
+    (re.compile(r"\b(DS-\d{3,4}[A-Z]?)\b"), "USA"),             # DS-160
+    (re.compile(r"\b(ETA[- ]\d{3,4}[A-Z]?)\b"), "USA"),         # ETA-9089
+    (re.compile(r"\b(IMM ?\d{4}[A-Z]{0,2})\b"), "Canada"),      # IMM5894E, IMM 5257
+    (re.compile(r"\b(VAF ?\d{1,2}[A-Z]?)\b"), "UK"),            # VAF1A
+    (re.compile(r"\bForm (\d{2,4}[A-Z]?)\b"), "Australia"),     # Form 80, Form 1419
+]
+
+EDITION_PATTERNS = [
+    (re.compile(r"\bEdition(?: Date)?[:.]?\s*(\d{1,2}/\d{1,2}/\d{2,4})", re.IGNORECASE), 0.9),  # USCIS: Edition 04/01/24
+    (re.compile(r"\bIMM ?\d{4}\s*\((\d{2}-\d{4})\)"), 0.9),                                      # IRCC: IMM 5257 (03-2023) E
+    (re.compile(r"\((?:Rev\.?|Revised)\s*(\d{1,2}/(?:\d{1,2}/)?\d{2,4})\)", re.IGNORECASE), 0.8),  # DS forms: (Rev. 01/2024)
+]
+
+AMOUNT_PATTERN = re.compile(r"(?:US\$|CAD ?\$?|C\$|AUD ?\$?|A\$|NZ\$|S\$|\$|£|€)\s?\d{1,3}(?:,\d{3})*(?:\.\d{2})?(?!\d)")
+FEE_LINE_PATTERN = re.compile(r"\bfees?\b", re.IGNORECASE)
+
+LANGUAGE_STOPWORDS = {
+    "English": {"the", "and", "of", "to", "you", "must", "for", "your", "this", "with"},
+    "French": {"le", "la", "les", "et", "des", "vous", "pour", "est", "une", "du"},
+    "Spanish": {"el", "los", "las", "y", "para", "usted", "que", "del", "una", "por"},
+    "German": {"der", "die", "und", "das", "sie", "für", "ist", "nicht", "mit", "ein"},
+}
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+HEAD_CHARS = 1500  # A form's own ID nearly always appears on its first page
+LANGUAGE_SAMPLE_CHARS = 20000
+
+
+@dataclass
+class RuleExtraction:
+    """Fields recovered by rules, each with a confidence between 0 and 1."""
+    fields: Dict[str, Any] = field(default_factory=dict)
+    confidence: Dict[str, float] = field(default_factory=dict)
+
+    def add(self, name: str, value: Any, confidence: float):
+        if value and confidence > self.confidence.get(name, 0.0):
+            self.fields[name] = value
+            self.confidence[name] = round(min(confidence, 0.99), 2)
+
+    def confident_fields(self, min_confidence: float) -> Dict[str, Any]:
+        return {name: value for name, value in self.fields.items() if self.confidence[name] >= min_confidence}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"fields": dict(self.fields), "confidence": dict(self.confidence)}
+
+
+class RuleExtractor:
+    """Deterministic pre-extraction of form ID, country, governing authority, edition date, fees and language.
+
+    Runs before the LLM: fields it is confident about are handed to the model as known
+    values instead of being asked for, and override the model's output afterwards.
+    """
+
+    def __init__(self, country_domains: Dict[str, List[str]]):
+        # Most specific (longest) entries first, so "travel.state.gov" wins over "state.gov"
+        self.domain_entries: List[Tuple[str, str]] = sorted(
+            ((entry.lower(), country) for country, entries in country_domains.items() for entry in entries),
+            key=lambda item: len(item[0]), reverse=True
+        )
+
+    @staticmethod
+    def _matches_domain(host: str, path: str, entry: str) -> bool:
+        domain, _, prefix = entry.partition("/")
+        if not (host == domain or host.endswith("." + domain)):
+            return False
+        return not prefix or path.lower().lstrip("/").startswith(prefix)
+
+    def _extract_source(self, url: str, result: RuleExtraction):
+        parsed = urlparse(url or "")
+        host, path = (parsed.hostname or "").lower(), parsed.path or ""
+        if not host:
+            return
+        country = next((country for entry, country in self.domain_entries if self._matches_domain(host, path, entry)), None)
+        if country:
+            result.add("country", country, 0.95)
+        authority = max(
+            (entry for entry in DOMAIN_AUTHORITIES if self._matches_domain(host, path, entry)),
+            key=len, default=None
+        )
+        if authority:
+            name, confidence = DOMAIN_AUTHORITIES[authority]
+            result.add("governing_authority", name, confidence)
+
+    @staticmethod
+    def _normalize_form_id(form_id: str) -> str:
+        form_id = form_id.upper().replace("ETA ", "ETA-")
+        return re.sub(r"^(IMM|VAF) ", r"\1", form_id)
+
+    def _extract_form_id(self, text: str, name_and_url: str, country: Optional[str], result: RuleExtraction):
+        counts: Counter = Counter()
+        in_head, in_name = set(), set()
+        for pattern, pattern_country in FORM_ID_PATTERNS:
+            if country and pattern_country and pattern_country != country:
+                continue
+            for match in pattern.finditer(text):
+                form_id = self._normalize_form_id(match.group(1))
+                counts[form_id] += 1
+                if match.start() < HEAD_CHARS:
+                    in_head.add(form_id)
+            # Official file names and URLs are usually lower-case: i-129.pdf, imm5257e.pdf
+            for match in pattern.finditer(name_and_url.upper()):
+                in_name.add(self._normalize_form_id(match.group(1)))
+        # The file name may carry a language suffix the text omits: imm5257e.pdf for "IMM 5257"
+        in_name |= {form_id for form_id in counts for name_id in in_name if name_id.startswith(form_id) and len(name_id) - len(form_id) <= 2}
+        candidates = set(counts) | in_name
+        if not candidates:
+            return
+        total = sum(counts.values()) or 1
+
+        def score(form_id: str) -> float:
+            share = counts[form_id] / total
+            return 0.5 * share + (0.35 if form_id in in_head else 0.0) + (0.4 if form_id in in_name else 0.0)
+
+        best = max(sorted(candidates), key=score)
+        result.add("form_id", best, score(best))
+
+    @staticmethod
+    def _extract_edition(text: str, result: RuleExtraction):
+        for pattern, confidence in EDITION_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                result.add("edition_date", match.group(1), confidence)
+                return
+
+    @staticmethod
+    def _extract_fees(text: str, result: RuleExtraction):
+        amounts = []
+        for line in text.splitlines():
+            if FEE_LINE_PATTERN.search(line):
+                for match in AMOUNT_PATTERN.finditer(line):
+                    amount = re.sub(r"\s+", "", match.group(0))
+                    if amount not in amounts:
+                        amounts.append(amount)
+        if amounts:
+            # One amount next to "fee" is usually the fee; several depend on context the LLM handles better
+            result.add("fees", "; ".join(amounts[:5]), 0.7 if len(amounts) == 1 else 0.5)
+
+    @staticmethod
+    def _extract_language(text: str, result: RuleExtraction):
+        words = [word.lower() for word in WORD_PATTERN.findall(text[:LANGUAGE_SAMPLE_CHARS])]
+        hits = {language: sum(1 for word in words if word in stopwords) for language, stopwords in LANGUAGE_STOPWORDS.items()}
+        total = sum(hits.values())
+        if total < 30:
+            return
+        language, count = max(hits.items(), key=lambda item: item[1])
+        share = count / total
+        if share >= 0.6:
+            result.add("language", language, 0.6 + 0.35 * share)
+
+    def extract(self, document_text: str, document_info: Dict[str, Any]) -> RuleExtraction:
+        result = RuleExtraction()
+        url = document_info.get('download_url') or document_info.get('url') or ""
+        self._extract_source(url, result)
+        text = document_text or ""
+        name_and_url = f"{document_info.get('filename', '')} {url}"
+        self._extract_form_id(text, name_and_url, result.fields.get("country"), result)
+        self._extract_edition(text, result)
+        self._extract_fees(text, result)
+        self._extract_language(text, result)
+        return result
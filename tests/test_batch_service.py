@@ -0,0 +1,172 @@
+import json
+import os
+import tempfile
+import unittest
+
+from ai_service import AsyncAIExtractionService
+from batch_service import BatchJobManager, FakeBatchClient, parse_batch_output
+
+
+class StubDatabase:
+    """In-memory stand-in for the DatabaseManager batch job and form update calls."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.form_updates = {}
+
+    def insert_batch_job(self, provider, phase, provider_batch_id, status, requests, input_file_path):
+        job_id = len(self.jobs) + 1
+        self.jobs[job_id] = {"id": job_id, "provider": provider, "phase": phase, "provider_batch_id": provider_batch_id,
+                             "status": status, "request_count": len(requests), "requests": json.loads(json.dumps(requests)),
+                             "input_file_path": input_file_path, "error": None}
+        return job_id
+
+    def update_batch_job(self, job_id, fields, expected_status=None):
+        if expected_status is not None and self.jobs[job_id]["status"] != expected_status:
+            return False
+        self.jobs[job_id].update(fields)
+        return True
+
+    def get_batch_jobs(self, statuses=None, include_requests=False, limit=100):
+        return [dict(job) for job in self.jobs.values() if not statuses or job["status"] in statuses][:limit]
+
+    def update_form_fields(self, form_id, fields):
+        self.form_updates[form_id] = fields
+        return True
+
+
+class StubProcessor:
+    def extract_text(self, file_path):
+        with open(file_path, encoding="utf-8") as f:
+            return f.read()
+
+
+class StubCallMetrics:
+    def __init__(self):
+        self.records = []
+
+    def record(self, record, batch=False):
+        self.records.append((record, batch))
+
+    def flush(self):
+        pass
+
+
+class BatchFlowTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = StubDatabase()
+        self.metrics = StubCallMetrics()
+        self.ai_service = AsyncAIExtractionService(None, call_metrics=self.metrics)
+        self.forms = []
+        for form_id in (1, 2):
+            path = os.path.join(self.tmp.name, f"form-{form_id}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("Form I-129 Petition for a Nonimmigrant Worker. The filing fee is $460. " * 5)
+            self.forms.append({"id": form_id, "downloaded_file_path": path, "official_source_url": f"https://www.uscis.gov/i-129?v={form_id}",
+                               "document_format": "TXT", "discovered_by_query": "i-129", "country": "USA"})
+        self.forms.append({"id": 3, "downloaded_file_path": os.path.join(self.tmp.name, "missing.pdf"), "official_source_url": "",
+                           "document_format": "PDF", "discovered_by_query": ""})
+
+    def manager(self, polls_until_complete=1, responder=None):
+        client = FakeBatchClient(self.tmp.name, polls_until_complete=polls_until_complete, responder=responder)
+        return BatchJobManager(self.ai_service, StubProcessor(), self.db, client, self.tmp.name, max_requests_per_job=1, input_mode="full")
+
+    def test_separate_mode_submits_validation_then_updates_forms(self):
+        def responder(body):
+            if "'validation_warnings' array" in body["messages"][0]["content"]:
+                return json.dumps({"validation_warnings": ["Processing time not specified"]})
+            return json.dumps({"form_name": "Petition for a Nonimmigrant Worker", "form_id": "I-129", "full_markdown_summary": "# I-129"})
+
+        manager = self.manager(polls_until_complete=2, responder=responder)
+        job_ids = manager.submit_extraction(self.forms)
+        self.assertEqual(len(job_ids), 2)  # form 3 has no local file
+        self.assertEqual({self.db.jobs[i]["status"] for i in job_ids}, {"submitted"})
+
+        self.assertEqual(manager.poll(), {"active": 2, "applied": 0, "failed": 0})
+        self.assertEqual(manager.poll(), {"active": 0, "applied": 2, "failed": 0})
+        self.assertEqual(self.db.form_updates, {})
+        validation_jobs = [job for job in self.db.jobs.values() if job["phase"] == "validation"]
+        self.assertEqual(len(validation_jobs), 2)
+
+        manager.poll()
+        self.assertEqual(manager.poll(), {"active": 0, "applied": 2, "failed": 0})
+        self.assertEqual({job["status"] for job in self.db.jobs.values()}, {"applied"})
+        self.assertEqual(sorted(self.db.form_updates), [1, 2])
+        fields = self.db.form_updates[1]
+        self.assertEqual(fields["processing_status"], "validated_with_warnings")
+        self.assertEqual(fields["validation_warnings"], ["Processing time not specified"])
+        self.assertEqual(fields["form_id"], "I-129")
+        self.assertEqual(len(self.metrics.records), 4)
+        self.assertTrue(all(batch and record.outcome == "success" and record.model == "fake" for record, batch in self.metrics.records))
+
+        # Applied jobs are not picked up again
+        self.assertEqual(manager.poll(), {"active": 0, "applied": 0, "failed": 0})
+
+    def test_combined_mode_updates_forms_in_one_job(self):
+        self.ai_service.validation_mode = "combined"
+        manager = self.manager()
+        manager.submit_extraction(self.forms[:1])
+        self.assertEqual(manager.poll(), {"active": 0, "applied": 1, "failed": 0})
+        self.assertEqual(self.db.form_updates[1]["processing_status"], "validated")
+        self.assertEqual(self.db.jobs[1]["status"], "applied")
+
+    def test_calls_recorded_under_requested_model(self):
+        manager = self.manager()
+        manager.client.model = None  # As OpenAIBatchClient
+        manager.submit_extraction(self.forms[:1])
+        self.assertEqual(self.db.jobs[1]["requests"]["form-1"]["model"], "gpt-4o-mini")
+        manager.poll()
+        manager.poll()
+        self.assertEqual([record.model for record, _ in self.metrics.records], ["gpt-4o-mini", "gpt-4o-mini"])
+
+    def test_failed_request_leaves_form_untouched(self):
+        manager = self.manager(responder=lambda body: "not json")
+        manager.submit_extraction(self.forms[:1])
+        self.assertEqual(manager.poll(), {"active": 0, "applied": 1, "failed": 0})
+        self.assertEqual(self.db.form_updates, {})
+        self.assertEqual(self.db.jobs[1]["error"], "1 of 1 requests failed (completed)")
+
+    def test_apply_error_marks_job_failed(self):
+        def update_form_fields(form_id, fields):
+            raise RuntimeError("connection lost")
+
+        self.ai_service.validation_mode = "combined"
+        self.db.update_form_fields = update_form_fields
+        manager = self.manager()
+        manager.submit_extraction(self.forms[:1])
+        self.assertEqual(manager.poll(), {"active": 0, "applied": 0, "failed": 1})
+        job = self.db.jobs[1]
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "Applying results failed: connection lost")
+        self.assertTrue(os.path.exists(job["output_file_path"]))
+
+
+class ParseBatchOutputTest(unittest.TestCase):
+    def test_success_error_and_non_200_lines(self):
+        output = "\n".join([
+            json.dumps({"custom_id": "form-1", "error": None, "response": {"status_code": 200, "body": {
+                "choices": [{"message": {"content": "{}"}}], "usage": {"prompt_tokens": 10, "completion_tokens": 2}}}}),
+            json.dumps({"custom_id": "form-2", "response": None, "error": {"code": "batch_expired", "message": "Expired"}}),
+            json.dumps({"custom_id": "form-3", "error": None, "response": {"status_code": 429, "body": {"error": "rate limited"}}}),
+            "not json",
+            ""
+        ])
+        results = parse_batch_output(output)
+        self.assertEqual(sorted(results), ["form-1", "form-2", "form-3"])
+        self.assertEqual(results["form-1"], ("{}", None, {"prompt_tokens": 10, "completion_tokens": 2}))
+        content, error, usage = results["form-2"]
+        self.assertIsNone(content)
+        self.assertTrue(error.startswith("Batch request error:"))
+        self.assertIn("batch_expired", error)
+        self.assertIsNone(usage)
+        self.assertEqual(results["form-3"], (None, "API error (Status 429): {'error': 'rate limited'}", None))
+
+    def test_missing_completion_content(self):
+        line = json.dumps({"custom_id": "form-1", "response": {"status_code": 200, "body": {"choices": [], "usage": None}}})
+        self.assertEqual(parse_batch_output(line), {"form-1": (None, "Batch response has no completion content", None)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,492 @@
+"""
+Text extraction routines that are safe to run inside worker processes.
+
+Nothing here touches Streamlit: every function appends (level, message) pairs to a
+`messages` list instead, and DocumentProcessor replays them with st.* in the
+Streamlit process once the worker returns.
+"""
+
+import os
+import re
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import PyPDF2
+import pdfplumber
+import fitz  # PyMuPDF
+import docx
+import pandas as pd
+from bs4 import BeautifulSoup
+
+Messages = List[Tuple[str, str]]  # (level, message), level is one of success/info/warning/error
+ExtractionInfo = Dict[str, Any]  # How the text was obtained: engine, pages, ...
+
+# Bump when extraction output changes, so texts cached by content hash are re-extracted
+EXTRACTOR_VERSION = 2
+
+POOR_PAGE_MIN_CHARS = 40  # Pages with fewer visible characters are re-read by the slower engine
+SECTION_CHARS = 8000  # Target size of non-PDF chunks from iter_text_chunks
+REPRESENTATIVE_PAGE_TERMS = ("fee", "checklist", "supporting document", "required document", "eligib",
+                             "where to file", "how to file", "processing time", "evidence")
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_extraction_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Return the process-wide extraction pool, (re)creating it if it is missing, resized or broken.
+
+    The pool is module-level rather than owned by DocumentProcessor because Streamlit
+    rebuilds the processor on every rerun, and worker processes are expensive to spawn.
+    """
+    global _pool, _pool_workers
+    max_workers = max(1, int(max_workers))
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers or getattr(_pool, "_broken", False):
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # "spawn" avoids forking the multi-threaded Streamlit server
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = max_workers
+        return _pool
+
+
+def extract_text_from_file(local_file_path: str, pdf_strategy: str = "fast") -> Tuple[str, Messages, ExtractionInfo]:
+    """Extract text from a local file, dispatching on extension. Returns (text, messages, info).
+
+    `info` describes how the text was obtained, e.g. {"engine": "pymupdf+pdfplumber", "pages": 12}.
+    """
+    messages: Messages = []
+    info: ExtractionInfo = {"engine": None}
+    try:
+        if not os.path.exists(local_file_path):
+            messages.append(("error", f"Local file not found for text extraction: {local_file_path}"))
+            return "", messages, info
+
+        file_ext = Path(local_file_path).suffix.lower()
+
+        if file_ext == '.pdf':
+            return extract_pdf_text(local_file_path, messages, pdf_strategy, info), messages, info
+        elif file_ext in ['.docx', '.doc']:
+            info["engine"] = "python-docx"
+            return extract_word_text(local_file_path, messages), messages, info
+        elif file_ext in ['.xlsx', '.xls']:
+            info["engine"] = "pandas"
+            return extract_excel_text(local_file_path, messages), messages, info
+        elif file_ext in ['.html', '.htm']:
+            info["engine"] = "beautifulsoup"
+            return extract_html_text(local_file_path, messages), messages, info
+        else:
+            messages.append(("warning", f"Unsupported file type for text extraction: {file_ext}"))
+            return "", messages, info
+
+    except Exception as e:
+        messages.append(("error", f"Error extracting text from {local_file_path}: {e}"))
+        return "", messages, info
+
+
+def page_text_is_poor(text: str) -> bool:
+    """Heuristic for a page the fast engine handled badly: almost no text, or mostly glyph garbage.
+
+    Garbage shows up as U+FFFD replacement characters, "(cid:NN)" placeholders for
+    unmapped glyphs, or a low share of letters and digits among the visible characters.
+    """
+    visible = "".join(text.split())
+    if len(visible) < POOR_PAGE_MIN_CHARS:
+        return True
+    garbled = visible.count("\ufffd") + 6 * visible.count("(cid:")
+    if garbled / len(visible) > 0.05:
+        return True
+    alphanumeric = sum(1 for char in visible if char.isalnum())
+    return alphanumeric / len(visible) < 0.5
+
+
+def _is_better_page_text(candidate: str, current: str) -> bool:
+    """Whether pdfplumber's `candidate` should replace a poor PyMuPDF page."""
+    return len(candidate.strip()) > len(current.strip()) or bool(candidate.strip() and not page_text_is_poor(candidate))
+
+
+def _pdfplumber_pages(file_path: str, page_numbers: Optional[List[int]] = None) -> List[str]:
+    """pdfplumber text per page for 0-based `page_numbers` (all pages if None)."""
+    pages = [number + 1 for number in page_numbers] if page_numbers is not None else None
+    with pdfplumber.open(file_path, pages=pages) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
+
+
+def _pymupdf_pages(file_path: str, start: int = 0, end: Optional[int] = None) -> List[str]:
+    """PyMuPDF text per page for pages [start, end) (to the last page if end is None)."""
+    with fitz.open(file_path) as doc:
+        end = len(doc) if end is None else end
+        return [doc.load_page(number).get_text() for number in range(start, end)]
+
+
+def extract_pdf_page_range(file_path: str, start: int = 0, end: Optional[int] = None,
+                           strategy: str = "fast") -> Tuple[Optional[List[str]], Dict[str, int], Messages]:
+    """Text of pages [start, end) (0-based), one string per page, plus pages handled per engine.
+
+    "fast" reads every page with PyMuPDF and re-reads only poor pages (see page_text_is_poor)
+    with pdfplumber, keeping whichever text is better. "accurate" uses pdfplumber for every
+    page, as the original cascade did. Returns None for the pages if the range failed.
+    """
+    messages: Messages = []
+    name = Path(file_path).name
+    if strategy == "accurate":
+        try:
+            pages = _pdfplumber_pages(file_path, list(range(start, end)) if end is not None else None)
+            return pages, {"pdfplumber": len(pages)}, messages
+        except Exception as e:
+            messages.append(("warning", f"pdfplumber failed for {name}: {e}"))
+            return None, {}, messages
+
+    try:
+        pages = _pymupdf_pages(file_path, start, end)
+    except Exception as e:
+        messages.append(("warning", f"PyMuPDF failed for {name}: {e}"))
+        pages, engines, accurate_messages = extract_pdf_page_range(file_path, start, end, "accurate")
+        return pages, engines, messages + accurate_messages
+    engines = {"pymupdf": len(pages)}
+
+    poor_pages = [index for index, page_text in enumerate(pages) if page_text_is_poor(page_text)]
+    if poor_pages:
+        try:
+            retried = _pdfplumber_pages(file_path, [start + index for index in poor_pages])
+            for index, page_text in zip(poor_pages, retried):
+                if _is_better_page_text(page_text, pages[index]):
+                    pages[index] = page_text
+                    engines["pymupdf"] -= 1
+                    engines["pdfplumber"] = engines.get("pdfplumber", 0) + 1
+        except Exception as e:
+            messages.append(("warning", f"pdfplumber failed on {len(poor_pages)} poor pages of {name}: {e}"))
+    return pages, engines, messages
+
+
+def _pypdf2_text(file_path: str, messages: Messages) -> str:
+    try:
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            if pdf_reader.is_encrypted:
+                messages.append(("warning", f"PDF is encrypted, skipping PyPDF2: {Path(file_path).name}"))
+                return ""
+            page_texts = []
+            for page_num, page in enumerate(pdf_reader.pages):
+                try:
+                    page_texts.append(page.extract_text())
+                except Exception as e:
+                    messages.append(("warning", f"PyPDF2: Error reading page {page_num + 1} of {Path(file_path).name}: {e}"))
+                    continue
+            return "\n".join(page_texts).strip()
+    except Exception as e:
+        messages.append(("error", f"PyPDF2 failed for {Path(file_path).name}: {e}"))
+        return ""
+
+
+def engine_label(engines: Dict[str, int]) -> str:
+    """"pymupdf", "pdfplumber" or "pymupdf+pdfplumber", depending on which engines produced pages."""
+    return "+".join(engine for engine in ("pymupdf", "pdfplumber") if engines.get(engine))
+
+
+def finish_pdf_text(file_path: str, parts: List[Tuple[Optional[List[str]], Dict[str, int], Messages]],
+                    messages: Messages, strategy: str = "fast", info: Optional[ExtractionInfo] = None) -> str:
+    """Join page-range results in order; fall back to the remaining engines if they came up short."""
+    info = info if info is not None else {}
+    name = Path(file_path).name
+    pages: List[str] = []
+    engines: Dict[str, int] = {}
+    failed = False
+    for range_pages, range_engines, range_messages in parts:
+        messages.extend(range_messages)
+        if range_pages is None:
+            failed = True
+            continue
+        pages.extend(range_pages)
+        for engine, count in range_engines.items():
+            engines[engine] = engines.get(engine, 0) + count
+
+    text = "\n".join(page for page in pages if page).strip()
+    if not failed and len(text) > 100:
+        label = engine_label(engines)
+        detail = f", {engines['pdfplumber']} of {len(pages)} pages via pdfplumber" if strategy == "fast" and engines.get("pdfplumber") else ""
+        messages.append(("success", f"Extracted text using {label}: {len(text)} chars{detail}"))
+        info.update({"engine": label, "pages": len(pages), "engine_pages": engines})
+        return text
+
+    # The engine the strategy did not lead with, over the whole document, then PyPDF2
+    if strategy == "accurate":
+        try:
+            text = "\n".join(_pymupdf_pages(file_path)).strip()
+            if len(text) > 100:
+                messages.append(("success", f"Extracted text using PyMuPDF: {len(text)} chars"))
+                info.update({"engine": "pymupdf", "pages": len(pages)})
+                return text
+        except Exception as e:
+            messages.append(("warning", f"PyMuPDF failed for {name}: {e}"))
+
+    text = _pypdf2_text(file_path, messages)
+    if len(text) > 50:
+        messages.append(("success", f"Extracted text using PyPDF2: {len(text)} chars"))
+        info.update({"engine": "pypdf2", "pages": len(pages)})
+        return text
+
+    messages.append(("error", f"All PDF extraction methods failed for: {name}. Content might be image-based or severely corrupted."))
+    return ""
+
+
+def extract_pdf_text(file_path: str, messages: Messages, strategy: str = "fast", info: Optional[ExtractionInfo] = None) -> str:
+    """Extract text from PDF using multiple methods, ordered by `strategy` ("fast" or "accurate")."""
+    return finish_pdf_text(file_path, [extract_pdf_page_range(file_path, strategy=strategy)], messages, strategy, info)
+
+
+def iter_pdf_pages(file_path: str, strategy: str = "fast", page_indices: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, str, str]]:
+    """Yield (page_index, text, engine) one page at a time, with the same engine choice as extract_pdf_page_range.
+
+    Pages are only parsed when the consumer asks for them, so callers can stop early.
+    `page_indices` (0-based) limits the walk to those pages, in the order given.
+    """
+    with fitz.open(file_path) as doc:
+        plumber = None
+        try:
+            for index in (range(len(doc)) if page_indices is None else page_indices):
+                text, engine = doc.load_page(index).get_text(), "pymupdf"
+                if strategy == "accurate" or page_text_is_poor(text):
+                    if plumber is None:
+                        plumber = pdfplumber.open(file_path)
+                    alternative = plumber.pages[index].extract_text() or ""
+                    if strategy == "accurate" or _is_better_page_text(alternative, text):
+                        text, engine = alternative, "pdfplumber"
+                yield index, text, engine
+        finally:
+            if plumber is not None:
+                plumber.close()
+
+
+def _representative_score(text: str) -> int:
+    """How much a page looks like the parts an extraction needs most: fees, checklists, eligibility."""
+    lowered = text.lower()
+    return sum(lowered.count(term) for term in REPRESENTATIVE_PAGE_TERMS) + 3 * len(re.findall(r"\$\s?\d", text))
+
+
+def extract_pdf_text_within_budget(file_path: str, max_chars: int, strategy: str = "fast",
+                                   representative: bool = False) -> Tuple[str, Messages, ExtractionInfo]:
+    """Extract only as much of a PDF as an AI prompt of `max_chars` can use.
+
+    Default: read pages in order and stop as soon as the budget is met. With
+    `representative`, the first pages fill half the budget and the rest goes to the
+    later pages that score highest for fees/checklists/eligibility (kept in page order,
+    each marked with its page number). Pages are sized and scored on a cheap raw PyMuPDF
+    pass, and only the chosen ones go through the full per-page engine choice.
+    info["partial"] tells whether pages were left out.
+    """
+    messages: Messages = []
+    name = Path(file_path).name
+    engines: Dict[str, int] = {}
+    selected: List[Tuple[int, str]] = []
+    page_count = 0
+    try:
+        if not representative:
+            total = 0
+            for index, text, engine in iter_pdf_pages(file_path, strategy):
+                selected.append((index, text))
+                engines[engine] = engines.get(engine, 0) + 1
+                total += len(text) + 1
+                if total >= max_chars:
+                    break
+            page_count = count_pdf_pages(file_path)
+        else:
+            with fitz.open(file_path) as doc:
+                page_count = len(doc)
+                # (chars, score) per page; no pdfplumber fallback here, it is only for choosing pages
+                sized = [(len(text), _representative_score(text)) for text in (doc.load_page(index).get_text() for index in range(page_count))]
+            chosen = []
+            total = 0
+            for index, (chars, _) in enumerate(sized):
+                if total >= max_chars // 2:
+                    break
+                chosen.append(index)
+                total += chars + 1
+            ranked = sorted(range(len(chosen), page_count), key=lambda index: sized[index][1], reverse=True)
+            for index in ranked:
+                if total >= max_chars or sized[index][1] == 0:
+                    break
+                chosen.append(index)
+                total += sized[index][0] + 1
+            for index, text, engine in iter_pdf_pages(file_path, strategy, sorted(chosen)):
+                selected.append((index, text))
+                engines[engine] = engines.get(engine, 0) + 1
+    except Exception as e:
+        messages.append(("warning", f"Budgeted extraction failed for {name}: {e}"))
+        return "", messages, {"engine": None}
+
+    if representative:
+        text = "\n".join(f"[Page {index + 1}]\n{page_text}" for index, page_text in selected if page_text).strip()
+    else:
+        text = "\n".join(page_text for _, page_text in selected if page_text).strip()
+    info: ExtractionInfo = {
+        "engine": engine_label(engines),
+        "pages": page_count,
+        "pages_used": [index + 1 for index, _ in selected],
+        "partial": len(selected) < page_count,
+        "mode": "representative" if representative else "budget",
+    }
+    messages.append(("success", f"Extracted {len(text)} chars from {len(selected)} of {page_count} pages for AI input ({info['mode']})"))
+    return text, messages, info
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """Page count via PyMuPDF (cheap: no page content is parsed). 0 if the file cannot be opened."""
+    try:
+        with fitz.open(file_path) as doc:
+            return len(doc)
+    except Exception:
+        return 0
+
+
+def split_page_ranges(page_count: int, workers: int, min_pages_per_task: int) -> List[Tuple[int, int]]:
+    """Split [0, page_count) into at most `workers` contiguous (start, end) ranges of at least `min_pages_per_task` pages."""
+    tasks = max(1, min(workers, page_count // max(1, min_pages_per_task)))
+    size, remainder = divmod(page_count, tasks)
+    ranges = []
+    start = 0
+    for task in range(tasks):
+        end = start + size + (1 if task < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def extract_pdf_text_parallel(pool: Executor, file_path: str, workers: int, min_pages_per_task: int = 8,
+                              strategy: str = "fast") -> Tuple[str, Messages, ExtractionInfo]:
+    """Extract page ranges of one PDF in parallel on `pool`, reassembling pages in order.
+
+    Called from the parent process (it only submits work). Small PDFs go to a single
+    worker unchanged; the fallback engines run in the parent only if the ranges fail.
+    """
+    ranges = split_page_ranges(count_pdf_pages(file_path), workers, min_pages_per_task)
+    if len(ranges) <= 1:
+        return pool.submit(extract_text_from_file, file_path, strategy).result()
+
+    futures = [pool.submit(extract_pdf_page_range, file_path, start, end, strategy) for start, end in ranges]
+    messages: Messages = []
+    info: ExtractionInfo = {"engine": None, "parallel_parts": len(ranges)}
+    text = finish_pdf_text(file_path, [future.result() for future in futures], messages, strategy, info)
+    return text, messages, info
+
+
+def extract_word_text(file_path: str, messages: Messages) -> str:
+    """Extract text from Word document"""
+    try:
+        text = join_chunks(iter_word_chunks(file_path))
+        messages.append(("success", f"Extracted text from Word doc: {len(text)} chars"))
+        return text
+    except Exception as e:
+        messages.append(("error", f"Error reading Word document {file_path}: {e}"))
+        return ""
+
+
+def extract_excel_text(file_path: str, messages: Messages) -> str:
+    """Extract text from Excel file"""
+    try:
+        text = join_chunks(iter_excel_chunks(file_path))
+        messages.append(("success", f"Extracted text from Excel: {len(text)} chars"))
+        return text
+    except Exception as e:
+        messages.append(("error", f"Error reading Excel file {file_path}: {e}"))
+        return ""
+
+
+def extract_html_text(file_path: str, messages: Messages) -> str:
+    """Basic extraction of text from HTML file (strips tags)."""
+    try:
+        text = join_chunks(iter_html_chunks(file_path))
+        messages.append(("success", f"Extracted text from HTML: {len(text)} chars"))
+        return text
+    except Exception as e:
+        messages.append(("error", f"Error reading HTML file {file_path}: {e}"))
+        return ""
+
+
+@dataclass
+class TextChunk:
+    """One piece of a document's text, as yielded by iter_text_chunks."""
+    text: str
+    page: Optional[int] = None  # 1-based PDF page
+    section: Optional[str] = None  # e.g. "Sheet: Fees" or "paragraphs 1-120"
+    engine: Optional[str] = None
+
+
+def join_chunks(chunks: Iterable[TextChunk]) -> str:
+    """Assemble chunks into the same text the extract_*_text functions return."""
+    return "\n".join(chunk.text for chunk in chunks if chunk.text).strip()
+
+
+def _text_lines(text: str) -> Iterator[str]:
+    """Lines of `text` without building a list of them."""
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def split_text_chunks(text: str, engine: Optional[str] = None) -> Iterator[TextChunk]:
+    """Re-chunk already extracted text (e.g. from the text cache) into pieces of about SECTION_CHARS."""
+    yield from _grouped_lines(_text_lines(text), "lines", engine)
+
+
+def _grouped_lines(lines: Iterable[str], label: str, engine: str) -> Iterator[TextChunk]:
+    """Group lines into chunks of about SECTION_CHARS characters."""
+    buffer: List[str] = []
+    size = 0
+    first = 1
+    number = 0
+    for number, line in enumerate(lines, 1):
+        buffer.append(line)
+        size += len(line) + 1
+        if size >= SECTION_CHARS:
+            yield TextChunk("\n".join(buffer), section=f"{label} {first}-{number}", engine=engine)
+            buffer, size, first = [], 0, number + 1
+    if buffer:
+        yield TextChunk("\n".join(buffer), section=f"{label} {first}-{number}", engine=engine)
+
+
+def iter_word_chunks(file_path: str) -> Iterator[TextChunk]:
+    doc = docx.Document(file_path)
+    yield from _grouped_lines((paragraph.text for paragraph in doc.paragraphs), "paragraphs", "python-docx")
+
+
+def iter_excel_chunks(file_path: str) -> Iterator[TextChunk]:
+    with pd.ExcelFile(file_path) as workbook:
+        for sheet_name in workbook.sheet_names:
+            sheet_df = workbook.parse(sheet_name)
+            yield TextChunk(f"Sheet: {sheet_name}\n{sheet_df.to_string()}\n", section=f"Sheet: {sheet_name}", engine="pandas")
+
+
+def iter_html_chunks(file_path: str) -> Iterator[TextChunk]:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f, 'html.parser')
+    yield from _grouped_lines(soup.stripped_strings, "text blocks", "beautifulsoup")
+
+
+def iter_text_chunks(file_path: str, pdf_strategy: str = "fast") -> Iterator[TextChunk]:
+    """Stream a document's text as chunks (PDF pages, sheets, groups of paragraphs) with metadata.
+
+    Runs in the calling process and parses lazily, so memory stays flat however long
+    the document is; errors propagate to the caller. Unsupported types yield nothing.
+    """
+    file_ext = Path(file_path).suffix.lower()
+    if file_ext == '.pdf':
+        for index, text, engine in iter_pdf_pages(file_path, pdf_strategy):
+            yield TextChunk(text, page=index + 1, engine=engine)
+    elif file_ext in ['.docx', '.doc']:
+        yield from iter_word_chunks(file_path)
+    elif file_ext in ['.xlsx', '.xls']:
+        yield from iter_excel_chunks(file_path)
+    elif file_ext in ['.html', '.htm']:
+        yield from iter_html_chunks(file_path)
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+from typing import Dict
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens are added per second, up to `capacity`.
+
+    acquire() blocks until enough tokens are available, which lets many workers share
+    one API rate limit without a fixed sleep between calls. acquire_async() is the
+    same for asyncio code, and draws on the same tokens.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _try_take(self, tokens: float) -> float:
+        """Take `tokens` and return 0 if available, else return the seconds until they will be."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: float = None) -> bool:
+        """Take `tokens`, waiting as needed. Returns False if `timeout` expires first."""
+        tokens = min(tokens, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._try_take(tokens)
+            if not wait:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1.0):
+        """Take `tokens`, yielding to the event loop while waiting."""
+        tokens = min(tokens, self.capacity)
+        while True:
+            wait = self._try_take(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def shared_token_bucket(key: str, rate: float, capacity: float) -> TokenBucket:
+    """Return the process-wide bucket for `key` (e.g. one per API key), creating it on first use.
+
+    Services are rebuilt on every Streamlit rerun, so the bucket has to outlive them
+    for the limit to hold across reruns and browser sessions.
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None or bucket.rate != rate or bucket.capacity != capacity:
+            bucket = TokenBucket(rate, capacity)
+            _buckets[key] = bucket
+        return bucket